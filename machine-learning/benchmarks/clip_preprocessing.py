@@ -0,0 +1,60 @@
+"""
+Compares the default CLIP visual preprocessing with the fused path enabled by MACHINE_LEARNING_FUSED_PREPROCESSING.
+
+Usage: python -m benchmarks.clip_preprocessing [--size 224] [--iterations 50]
+"""
+
+import tracemalloc
+from argparse import ArgumentParser
+from time import perf_counter
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from immich_ml.config import settings
+from immich_ml.models.clip.visual import OpenClipVisualEncoder
+
+
+def make_encoder(size: int) -> OpenClipVisualEncoder:
+    encoder = OpenClipVisualEncoder("ViT-B-32__openai", session=mock.Mock())
+    encoder.size = size
+    encoder.mean = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+    encoder.std = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+    return encoder
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    encoder = make_encoder(args.size)
+    rng = np.random.default_rng(0)
+    for width, height in [(4032, 3024), (1920, 1080), (1080, 1440)]:
+        # smooth structure with some fine detail on top, closer to photos than pure noise
+        coarse = Image.fromarray(rng.integers(0, 256, (24, 32, 3), dtype=np.uint8)).resize((width, height))
+        detail = rng.normal(0, 12, (height, width, 3))
+        image = Image.fromarray(np.clip(np.asarray(coarse, dtype=np.float32) + detail, 0, 255).astype(np.uint8))
+
+        results = {}
+        for fused in [False, True]:
+            settings.fused_preprocessing = fused
+            encoder.transform(image)  # allocates the reusable buffer outside of the measurement
+            tracemalloc.start()
+            start = perf_counter()
+            for _ in range(args.iterations):
+                results[fused] = encoder.transform(image)["image"].copy()
+            elapsed_ms = (perf_counter() - start) / args.iterations * 1000
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            mode = "fused" if fused else "default"
+            print(f"{width}x{height} {mode:<8} {elapsed_ms:>8.2f} ms  peak: {peak / 2**10:.0f} KiB")
+
+        diff = np.abs(results[True] - results[False])
+        print(f"{width}x{height} max abs difference: {diff.max():.5f}, mean abs difference: {diff.mean():.7f}")
+
+
+if __name__ == "__main__":
+    main()
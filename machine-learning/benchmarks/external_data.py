@@ -0,0 +1,148 @@
+"""
+Compares loading a model with its weights inline and with MACHINE_LEARNING_ORT_EXTERNAL_DATA, which memory-maps them.
+
+Usage: python -m benchmarks.external_data [--model PATH] [--iterations 5]
+
+Without `--model`, a synthetic model with a 128 MiB embedding table and a few MatMul layers is used, similar to a CLIP
+text encoder. Each mode runs in a new process. The cold load is measured after evicting the model files from the page
+cache, and the reload after unloading the model, like after it's been idle for MACHINE_LEARNING_MODEL_TTL seconds.
+This also reports the anonymous (private) and file-backed memory added by loading the model and how much the peak RSS
+increased while loading it.
+"""
+
+import gc
+import multiprocessing
+import os
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+import numpy as np
+import onnx
+
+import immich_ml.models  # noqa: F401 - imported before the session to avoid a circular import
+from immich_ml.sessions.ort import OrtSession, ensure_external_data
+
+
+def make_model(path: Path) -> None:
+    initializers = [onnx.numpy_helper.from_array(np.random.randn(32768, 1024).astype(np.float32) / 32, "embedding")]
+    nodes = [onnx.helper.make_node("Gather", ["embedding", "input_ids"], ["h"])]
+    name = "h"
+    for i in range(4):
+        weights = (np.random.randn(1024, 1024) / 32).astype(np.float32)
+        initializers.append(onnx.numpy_helper.from_array(weights, f"w{i}"))
+        nodes.append(onnx.helper.make_node("MatMul", [name, f"w{i}"], [f"m{i}"]))
+        name = f"m{i}"
+    graph = onnx.helper.make_graph(
+        nodes,
+        "external_data",
+        [onnx.helper.make_tensor_value_info("input_ids", onnx.TensorProto.INT32, ["batch", 77])],
+        [onnx.helper.make_tensor_value_info(name, onnx.TensorProto.FLOAT, ["batch", 77, 1024])],
+        initializers,
+    )
+    model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def memory_mib() -> dict[str, float]:
+    memory = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("RssAnon", "RssFile", "VmHWM"):
+                memory[name] = int(value.split()[0]) / 1024
+    return memory
+
+
+def evict_from_page_cache(folder: Path) -> None:
+    # only clean pages are dropped, so the files are flushed first
+    for path in folder.rglob("*"):
+        if path.is_file():
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def worker(model_path: Path, iterations: int, results: Any) -> None:
+    evict_from_page_cache(model_path.parent)
+
+    before = memory_mib()
+    start = perf_counter()
+    session = OrtSession(model_path, providers=["CPUExecutionProvider"])
+    cold_ms = (perf_counter() - start) * 1000
+    after = memory_mib()
+
+    reload_ms = 0.0
+    for _ in range(iterations):
+        del session
+        gc.collect()
+        start = perf_counter()
+        session = OrtSession(model_path, providers=["CPUExecutionProvider"])
+        reload_ms += (perf_counter() - start) * 1000
+
+    inputs = {"input_ids": np.random.randint(0, 32768, (1, 77), dtype=np.int32)}
+    session.run(None, inputs)
+    start = perf_counter()
+    for _ in range(iterations):
+        session.run(None, inputs)
+    run_ms = (perf_counter() - start) / iterations * 1000
+
+    results.put(
+        {
+            "cold_ms": cold_ms,
+            "reload_ms": reload_ms / iterations,
+            "model_anon": after["RssAnon"] - before["RssAnon"],
+            "model_file": after["RssFile"] - before["RssFile"],
+            "peak": after["VmHWM"] - before["VmHWM"],
+            "run_ms": run_ms,
+        }
+    )
+
+
+def measure(model_path: Path, iterations: int, external: bool) -> None:
+    # settings are read from the environment when the worker process imports them
+    os.environ["MACHINE_LEARNING_ORT_EXTERNAL_DATA"] = str(external)
+    if external:
+        # converted at download time when the setting is enabled, so it isn't part of the load time
+        ensure_external_data(model_path)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=worker, args=(model_path, iterations, results))
+    process.start()
+    stats = results.get()
+    process.join()
+
+    mode = "external" if external else "inline"
+    print(
+        f"{mode:<8} cold load {stats['cold_ms']:.0f} ms  reload {stats['reload_ms']:.0f} ms  "
+        f"model anon {stats['model_anon']:.0f} MiB  model file {stats['model_file']:.0f} MiB  "
+        f"peak rss increase {stats['peak']:.0f} MiB  "
+        f"{stats['run_ms']:.2f} ms/run"
+    )
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--model", type=Path)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model
+        if model_path is None:
+            model_path = Path(tmp) / "model" / "model.onnx"
+            model_path.parent.mkdir()
+            make_model(model_path)
+
+        for external in [False, True]:
+            measure(model_path, args.iterations, external)
+
+
+if __name__ == "__main__":
+    main()
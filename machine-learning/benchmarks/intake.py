@@ -0,0 +1,84 @@
+"""
+Compares peak RSS when decoding an uploaded image by reading it into bytes versus decoding the upload buffer directly.
+
+Usage: python -m benchmarks.intake [--width 8000] [--height 6000] [--spool-to-disk]
+
+Note that when the upload is spooled to disk, the memory-mapped file counts towards RSS as well, but unlike a copy in
+bytes these pages are backed by the page cache and can be reclaimed by the OS.
+"""
+
+import multiprocessing
+import os
+from argparse import ArgumentParser
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile, TemporaryDirectory
+
+import numpy as np
+from PIL import Image
+
+from immich_ml.models.transforms import decode_pil, decode_upload
+
+
+def make_image(path: str, width: int, height: int) -> None:
+    # noise compresses poorly, giving file sizes similar to large camera JPEGs
+    noise = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    Image.fromarray(noise).save(path, format="jpeg", quality=95)
+
+
+def reset_peak_rss() -> None:
+    # linux-only: resets VmHWM to the current RSS so the peak excludes memory used during startup
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def get_rss_kib(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1])
+    raise RuntimeError(f"{field} not found in /proc/self/status")
+
+
+def run(mode: str, path: str, spool_to_disk: bool, results: "multiprocessing.Queue[str]") -> None:
+    upload: SpooledTemporaryFile[bytes] = SpooledTemporaryFile(max_size=1 if spool_to_disk else 2**32)
+    with open(path, "rb") as f:
+        copyfileobj(f, upload)
+    size = upload.tell()
+    upload.seek(0)
+    reset_peak_rss()
+    before = get_rss_kib("VmRSS")
+
+    if mode == "bytes":
+        image = decode_pil(upload.read())
+    else:
+        image = decode_upload(upload)
+
+    after = get_rss_kib("VmHWM")
+    results.put(
+        f"{mode:<8} file: {size / 2**20:>7.1f} MiB  decoded: {image.width}x{image.height}  "
+        f"peak RSS: {before / 2**10:>8.1f} MiB -> {after / 2**10:>8.1f} MiB (+{(after - before) / 2**10:.1f} MiB)"
+    )
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--width", type=int, default=8000)
+    parser.add_argument("--height", type=int, default=6000)
+    parser.add_argument("--spool-to-disk", action="store_true")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results: "multiprocessing.Queue[str]" = ctx.Queue()
+    with TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "image.jpg")
+        make_image(path, args.width, args.height)
+        # each mode runs in a fresh process so allocations from one mode can't be reused by the other
+        for mode in ["bytes", "upload"]:
+            process = ctx.Process(target=run, args=(mode, path, args.spool_to_disk, results))
+            process.start()
+            print(results.get())
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
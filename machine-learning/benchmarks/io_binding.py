@@ -0,0 +1,82 @@
+"""
+Compares running an ONNX model with `session.run` and with the IO binding enabled by MACHINE_LEARNING_ORT_IO_BINDING.
+
+Usage: python -m benchmarks.io_binding [--model PATH] [--batch-size 1] [--iterations 100]
+
+Without `--model`, a synthetic model with a large output is used so the cost of allocating outputs is visible.
+Inputs with dynamic dimensions are given a size of 1 for the batch axis and 224 otherwise.
+"""
+
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import onnx
+from numpy.typing import NDArray
+
+import immich_ml.models  # noqa: F401 - imported before the session to avoid a circular import
+from immich_ml.config import settings
+from immich_ml.sessions.ort import OrtSession
+
+
+def make_model(path: Path) -> None:
+    # conv with many output channels so each run returns a large array
+    weights = np.random.rand(256, 3, 3, 3).astype(np.float32)
+    graph = onnx.helper.make_graph(
+        [onnx.helper.make_node("Conv", ["image", "weights"], ["features"], pads=[1, 1, 1, 1])],
+        "io_binding",
+        [onnx.helper.make_tensor_value_info("image", onnx.TensorProto.FLOAT, ["batch", 3, 224, 224])],
+        [onnx.helper.make_tensor_value_info("features", onnx.TensorProto.FLOAT, ["batch", 256, 224, 224])],
+        [onnx.numpy_helper.from_array(weights, "weights")],
+    )
+    model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 11)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def make_inputs(session: OrtSession, batch_size: int) -> dict[str, NDArray[np.float32]]:
+    inputs = {}
+    for i, node in enumerate(session.get_inputs()):
+        shape = [dim if isinstance(dim, int) else batch_size if j == 0 else 224 for j, dim in enumerate(node.shape)]
+        inputs[node.name or str(i)] = np.random.rand(*shape).astype(np.float32)
+    return inputs
+
+
+def measure(session: OrtSession, inputs: dict[str, NDArray[np.float32]], iterations: int) -> None:
+    # outputs are allocated by ORT outside of Python's allocator, so tracemalloc can't see them;
+    # instead, count the output bytes returned in arrays that weren't returned by the previous run
+    previous = {output.ctypes.data for output in session.run(None, inputs)}  # warm-up
+    allocated = 0
+    start = perf_counter()
+    for _ in range(iterations):
+        outputs = session.run(None, inputs)
+        allocated += sum(output.nbytes for output in outputs if output.ctypes.data not in previous)
+        previous = {output.ctypes.data for output in outputs}
+    elapsed_ms = (perf_counter() - start) / iterations * 1000
+    mode = "binding" if settings.ort_io_binding else "run"
+    print(f"{mode:<8} {elapsed_ms:>8.2f} ms/run  new output buffers: {allocated / iterations / 2**20:.1f} MiB/run")
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--model", type=Path)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model
+        if model_path is None:
+            model_path = Path(tmp) / "model.onnx"
+            make_model(model_path)
+
+        for io_binding in [False, True]:
+            settings.ort_io_binding = io_binding
+            session = OrtSession(model_path)
+            measure(session, make_inputs(session, args.batch_size), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
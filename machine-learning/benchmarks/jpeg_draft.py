@@ -0,0 +1,100 @@
+"""
+Compares full JPEG decoding with reduced-resolution (draft) decoding for CLIP preprocessing.
+
+Usage: python -m benchmarks.jpeg_draft [--images DIR] [--size 224] [--model ViT-B-32__openai]
+
+Without --images, a synthetic corpus is generated. With --model, embeddings are compared as well, which downloads the
+model if it isn't already in the cache folder.
+"""
+
+from argparse import ArgumentParser
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable
+
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image
+
+from immich_ml.models.clip.visual import OpenClipVisualEncoder
+from immich_ml.models.transforms import crop_pil, decode_pil, normalize, resize_pil, to_numpy
+
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+
+def synthetic_corpus(count: int) -> list[bytes]:
+    corpus = []
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        width, height = [(4032, 3024), (3024, 4032), (6000, 4000), (1920, 1080)][i % 4]
+        # smooth structure with some fine detail on top, closer to photos than pure noise
+        coarse = Image.fromarray(rng.integers(0, 256, (24, 32, 3), dtype=np.uint8)).resize((width, height))
+        detail = rng.normal(0, 12, (height, width, 3))
+        pixels = np.clip(np.asarray(coarse, dtype=np.float32) + detail, 0, 255).astype(np.uint8)
+        encoded = BytesIO()
+        Image.fromarray(pixels).save(encoded, format="jpeg", quality=90)
+        corpus.append(encoded.getvalue())
+    return corpus
+
+
+def cosine(a: NDArray[np.float32], b: NDArray[np.float32]) -> float:
+    a, b = a.ravel(), b.ravel()
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def timed(func: Callable[[], Any]) -> tuple[Any, float]:
+    start = perf_counter()
+    result = func()
+    return result, (perf_counter() - start) * 1000
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--images", type=Path, default=None)
+    parser.add_argument("--count", type=int, default=8, help="number of synthetic images if --images is not set")
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--model", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.images is not None:
+        paths = sorted(path for path in args.images.iterdir() if path.suffix.lower() in (".jpg", ".jpeg"))
+        corpus = [path.read_bytes() for path in paths]
+    else:
+        corpus = synthetic_corpus(args.count)
+
+    encoder = None
+    if args.model is not None:
+        encoder = OpenClipVisualEncoder(args.model)
+        encoder.load()
+        args.size = encoder.size
+
+    def transform(image: Image.Image) -> NDArray[np.float32]:
+        if encoder is not None:
+            return encoder.transform(image)["image"]
+        image = crop_pil(resize_pil(image, args.size), args.size)
+        return normalize(to_numpy(image), CLIP_MEAN, CLIP_STD)
+
+    full_ms, draft_ms, similarities = [], [], []
+    for data in corpus:
+        full, elapsed = timed(lambda: transform(decode_pil(data)))
+        full_ms.append(elapsed)
+        draft, elapsed = timed(lambda: transform(decode_pil(data, args.size)))
+        draft_ms.append(elapsed)
+
+        if encoder is not None:
+            full = encoder.session.run(None, {"image": full})[0]
+            draft = encoder.session.run(None, {"image": draft})[0]
+        similarities.append(cosine(full, draft))
+
+    compared = "embedding" if encoder is not None else "preprocessed input"
+    print(f"images: {len(corpus)}, target size: {args.size}")
+    print(f"full decode + preprocess:  {np.mean(full_ms):>8.2f} ms/image")
+    speedup = np.mean(full_ms) / np.mean(draft_ms)
+    print(f"draft decode + preprocess: {np.mean(draft_ms):>8.2f} ms/image ({speedup:.2f}x)")
+    print(f"{compared} cosine similarity: mean {np.mean(similarities):.6f}, min {np.min(similarities):.6f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the time to create an ONNX Runtime session with and without MACHINE_LEARNING_ORT_OPTIMIZED_MODEL_CACHE.
+
+Usage: python -m benchmarks.model_load [--models PATH ...] [--iterations 5]
+
+By default, every ONNX model in the cache folder is measured, e.g. after preloading the models to compare.
+Without any downloaded models, a synthetic convolutional model is used instead.
+"""
+
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import onnx
+
+import immich_ml.models  # noqa: F401 - imported before the session to avoid a circular import
+from immich_ml.config import settings
+from immich_ml.sessions.ort import OrtSession
+
+
+def make_model(path: Path) -> None:
+    # conv + batchnorm + relu blocks, which ORT fuses when optimizing the graph
+    nodes = []
+    initializers = []
+    name = "image"
+    for i in range(16):
+        weights = np.random.rand(32, 3 if i == 0 else 32, 3, 3).astype(np.float32)
+        initializers.append(onnx.numpy_helper.from_array(weights, f"w{i}"))
+        for param in ["scale", "bias", "mean", "var"]:
+            initializers.append(onnx.numpy_helper.from_array(np.random.rand(32).astype(np.float32), f"{param}{i}"))
+        nodes.append(onnx.helper.make_node("Conv", [name, f"w{i}"], [f"conv{i}"], pads=[1, 1, 1, 1]))
+        bn_inputs = [f"conv{i}", f"scale{i}", f"bias{i}", f"mean{i}", f"var{i}"]
+        nodes.append(onnx.helper.make_node("BatchNormalization", bn_inputs, [f"bn{i}"]))
+        name = f"relu{i}"
+        nodes.append(onnx.helper.make_node("Relu", [f"bn{i}"], [name]))
+    graph = onnx.helper.make_graph(
+        nodes,
+        "model_load",
+        [onnx.helper.make_tensor_value_info("image", onnx.TensorProto.FLOAT, [1, 3, 224, 224])],
+        [onnx.helper.make_tensor_value_info(name, onnx.TensorProto.FLOAT, [1, 32, 224, 224])],
+        initializers,
+    )
+    model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 11)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def time_load(model_path: Path, iterations: int) -> float:
+    start = perf_counter()
+    for _ in range(iterations):
+        OrtSession(model_path)
+    return (perf_counter() - start) / iterations * 1000
+
+
+def measure(model_path: Path, iterations: int) -> None:
+    settings.ort_optimized_model_cache = False
+    uncached_ms = time_load(model_path, iterations)
+
+    settings.ort_optimized_model_cache = True
+    optimized_path = OrtSession(model_path).optimized_model_path
+    optimized_path.unlink()
+    saving_ms = time_load(model_path, 1)
+    cached_ms = time_load(model_path, iterations)
+
+    print(
+        f"{model_path}: uncached {uncached_ms:.1f} ms  first load (saving) {saving_ms:.1f} ms  "
+        f"cached {cached_ms:.1f} ms"
+    )
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--models", type=Path, nargs="*")
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_paths = args.models
+        if not model_paths:
+            model_paths = [path for path in settings.cache_folder.glob("**/*.onnx") if path.parent.name != "optimized"]
+        if not model_paths:
+            model_path = Path(tmp) / "model" / "model.onnx"
+            model_path.parent.mkdir()
+            make_model(model_path)
+            model_paths = [model_path]
+
+        for model_path in model_paths:
+            measure(model_path, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
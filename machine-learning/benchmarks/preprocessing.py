@@ -0,0 +1,83 @@
+"""
+Compares preprocessing for a request with CLIP and facial recognition entries with and without a shared image context.
+
+Usage: python -m benchmarks.preprocessing [--width 4032] [--height 3024] [--iterations 20]
+
+Models aren't loaded, so only the conversions done by each model before inference are measured: the CLIP resize and
+crop, and the RGB to BGR array conversion done by both the face detector and the face recognizer.
+"""
+
+import tracemalloc
+from argparse import ArgumentParser
+from collections import Counter
+from time import perf_counter
+from typing import Any, Callable
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+import immich_ml.models.clip.visual as visual
+import immich_ml.models.transforms as transforms
+from immich_ml.models.clip.visual import OpenClipVisualEncoder
+from immich_ml.models.transforms import ImageContext, decode_cv2
+
+calls: Counter[str] = Counter()
+
+
+def counted(name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        calls[name] += 1
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def make_encoder() -> OpenClipVisualEncoder:
+    encoder = OpenClipVisualEncoder("ViT-B-32__openai", session=mock.Mock())
+    encoder.size = 224
+    encoder.mean = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+    encoder.std = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+    return encoder
+
+
+def preprocess(encoder: OpenClipVisualEncoder, payload: Image.Image | ImageContext) -> None:
+    encoder.transform(payload)  # visual encoder
+    decode_cv2(payload)  # face detector
+    decode_cv2(payload)  # face recognizer
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    pixels = np.random.randint(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels)
+    encoder = make_encoder()
+
+    with (
+        mock.patch.object(transforms, "pil_to_cv2", counted("pil_to_cv2", transforms.pil_to_cv2)),
+        mock.patch.object(visual, "resize_pil", counted("resize_pil", visual.resize_pil)),
+    ):
+        for mode in ["image", "context"]:
+            calls.clear()
+            tracemalloc.start()
+            start = perf_counter()
+            for _ in range(args.iterations):
+                preprocess(encoder, image if mode == "image" else ImageContext(image))
+            elapsed_ms = (perf_counter() - start) / args.iterations * 1000
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            conversions = ", ".join(f"{name}: {count / args.iterations:g}" for name, count in sorted(calls.items()))
+            print(
+                f"{mode:<8} {elapsed_ms:>8.2f} ms/request  conversions/request: {conversions}  "
+                f"peak traced: {peak / 2**20:.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compares the cost of serializing, transferring and parsing embeddings in each supported embedding format.
+
+Usage: python -m benchmarks.serialization [--iterations 1000] [--faces 8]
+"""
+
+import base64
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Any, Callable
+
+import numpy as np
+import orjson
+from numpy.typing import NDArray
+
+from immich_ml.models.transforms import serialize_np_array
+from immich_ml.schemas import EmbeddingFormat
+
+PARSERS: dict[EmbeddingFormat, Callable[[str], Any]] = {
+    EmbeddingFormat.JSON: lambda embedding: np.array(orjson.loads(embedding), dtype=np.float32),
+    EmbeddingFormat.FLOAT32: lambda embedding: np.frombuffer(base64.b64decode(embedding), dtype="<f4"),
+    EmbeddingFormat.FLOAT16: lambda embedding: np.frombuffer(base64.b64decode(embedding), dtype="<f2"),
+}
+
+
+def clip_response(embedding_format: EmbeddingFormat, embedding: NDArray[np.float32]) -> dict[str, Any]:
+    return {"clip": serialize_np_array(embedding, embedding_format)}
+
+
+def face_response(embedding_format: EmbeddingFormat, embeddings: NDArray[np.float32]) -> dict[str, Any]:
+    return {
+        "facial-recognition": [
+            {
+                "boundingBox": {"x1": 0, "y1": 0, "x2": 100, "y2": 100},
+                "embedding": serialize_np_array(embedding, embedding_format),
+                "score": 0.9,
+            }
+            for embedding in embeddings
+        ],
+        "imageHeight": 1440,
+        "imageWidth": 1920,
+    }
+
+
+def bench(name: str, make_response: Callable[[EmbeddingFormat], dict[str, Any]], iterations: int) -> None:
+    for embedding_format in EmbeddingFormat:
+        parse = PARSERS[embedding_format]
+        start = perf_counter()
+        for _ in range(iterations):
+            body = orjson.dumps(make_response(embedding_format))
+        serialize_ms = (perf_counter() - start) / iterations * 1000
+
+        start = perf_counter()
+        for _ in range(iterations):
+            response = orjson.loads(body)
+            if "clip" in response:
+                parse(response["clip"])
+            else:
+                for face in response["facial-recognition"]:
+                    parse(face["embedding"])
+        parse_ms = (perf_counter() - start) / iterations * 1000
+
+        print(
+            f"{name:<24} {embedding_format:<8} {len(body):>10,d} B"
+            f" {serialize_ms:>10.4f} ms serialize {parse_ms:>10.4f} ms parse"
+        )
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--faces", type=int, default=8)
+    args = parser.parse_args()
+
+    for dims in [512, 768, 1152]:
+        embedding = np.random.rand(dims).astype(np.float32)
+        bench(f"clip ({dims} dims)", lambda fmt: clip_response(fmt, embedding), args.iterations)
+    embeddings = np.random.rand(args.faces, 512).astype(np.float32)
+    bench(f"recognition ({args.faces} faces)", lambda fmt: face_response(fmt, embeddings), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
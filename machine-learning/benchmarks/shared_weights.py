@@ -0,0 +1,120 @@
+"""
+Compares the memory used by each of several processes that load the same model with and without
+MACHINE_LEARNING_ORT_SHARED_WEIGHTS, like gunicorn workers or inference processes would.
+
+Usage: python -m benchmarks.shared_weights [--model PATH] [--workers 4] [--iterations 20]
+
+Without `--model`, a synthetic model with 128 MiB of MatMul weights is used. For each worker, this reports the
+anonymous (private) RSS, including how much of it was added by loading the model, and the file-backed RSS, along with
+its PSS, which divides shared pages between the processes using them.
+"""
+
+import multiprocessing
+import os
+import tempfile
+from argparse import ArgumentParser
+from multiprocessing.synchronize import Barrier
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+import numpy as np
+import onnx
+
+
+def make_model(path: Path) -> None:
+    nodes = []
+    initializers = []
+    name = "x"
+    for i in range(8):
+        weights = (np.random.randn(2048, 2048) / 45).astype(np.float32)
+        initializers.append(onnx.numpy_helper.from_array(weights, f"w{i}"))
+        nodes.append(onnx.helper.make_node("MatMul", [name, f"w{i}"], [f"m{i}"]))
+        name = f"m{i}"
+    graph = onnx.helper.make_graph(
+        nodes,
+        "shared_weights",
+        [onnx.helper.make_tensor_value_info("x", onnx.TensorProto.FLOAT, ["batch", 2048])],
+        [onnx.helper.make_tensor_value_info(name, onnx.TensorProto.FLOAT, ["batch", 2048])],
+        initializers,
+    )
+    model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def memory_mib() -> dict[str, float]:
+    memory = {}
+    for path, fields in [("/proc/self/status", ("RssAnon", "RssFile")), ("/proc/self/smaps_rollup", ("Pss",))]:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    memory[name] = int(value.split()[0]) / 1024
+    return memory
+
+
+def worker(model_path: Path, iterations: int, barrier: Barrier, results: Any) -> None:
+    import immich_ml.models  # noqa: F401 - imported before the session to avoid a circular import
+    from immich_ml.sessions.ort import OrtSession
+
+    before = memory_mib()
+    session = OrtSession(model_path, providers=["CPUExecutionProvider"])
+    inputs = {str(node.name): np.random.rand(1, *node.shape[1:]).astype(np.float32) for node in session.get_inputs()}
+    session.run(None, inputs)
+    start = perf_counter()
+    for _ in range(iterations):
+        session.run(None, inputs)
+    elapsed_ms = (perf_counter() - start) / iterations * 1000
+
+    # every worker has the model loaded at this point, so shared pages are split between them
+    barrier.wait()
+    after = memory_mib()
+    results.put({**after, "ModelAnon": after["RssAnon"] - before["RssAnon"], "ms": elapsed_ms})
+    barrier.wait()
+
+
+def measure(model_path: Path, workers: int, iterations: int, shared: bool) -> None:
+    # settings are read from the environment when the workers import them
+    os.environ["MACHINE_LEARNING_ORT_SHARED_WEIGHTS"] = str(shared)
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(model_path, iterations, barrier, results)) for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    stats = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    mode = "shared" if shared else "default"
+    means = {name: sum(stat[name] for stat in stats) / len(stats) for name in stats[0]}
+    print(
+        f"{mode:<8} per worker: anon {means['RssAnon']:.0f} MiB (model {means['ModelAnon']:.0f} MiB)  "
+        f"file {means['RssFile']:.0f} MiB  pss {means['Pss']:.0f} MiB  total pss {means['Pss'] * workers:.0f} MiB  "
+        f"{means['ms']:.2f} ms/run"
+    )
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--model", type=Path)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model
+        if model_path is None:
+            model_path = Path(tmp) / "model" / "model.onnx"
+            model_path.parent.mkdir()
+            make_model(model_path)
+
+        for shared in [False, True]:
+            measure(model_path, args.workers, args.iterations, shared)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compares encoding search queries with a CLIP textual model one at a time versus in one batch, where texts are grouped
+by length and each group is padded only as much as needed if the model has a dynamic sequence length.
+
+Usage: python -m benchmarks.text_batching [--model ViT-B-32__openai] [--texts FILE] [--count 1000]
+
+The model is downloaded if it isn't already in the cache folder. Without --texts, queries of 1 to 12 words are generated
+from a small vocabulary, which is roughly the range of saved searches and album titles. With --texts, each line of the
+file is one query. The text embedding cache is disabled so every query is encoded.
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import orjson
+
+from immich_ml.models.clip.textual import OpenClipTextualEncoder, text_embedding_cache
+from immich_ml.schemas import EmbeddingFormat
+
+WORDS = "a photo of the dog cat beach mountain birthday party with my family at sunset in snow city night".split()
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--model", type=str, default="ViT-B-32__openai")
+    parser.add_argument("--texts", type=Path, default=None)
+    parser.add_argument("--count", type=int, default=1000, help="number of generated queries if --texts is not set")
+    args = parser.parse_args()
+
+    if args.texts is not None:
+        texts = [line.strip() for line in args.texts.read_text().splitlines() if line.strip()]
+    else:
+        rng = np.random.default_rng(0)
+        texts = [" ".join(rng.choice(WORDS, rng.integers(1, 13))) for _ in range(args.count)]
+
+    text_embedding_cache.max_size = 0
+    encoder = OpenClipTextualEncoder(args.model)
+    encoder.load()
+    buckets = encoder.tokenize_batch(texts)
+    shapes = ", ".join(f"{len(indices)}x{tokens['text'].shape[1]}" for indices, tokens in buckets)
+    print(f"{len(texts)} texts  dynamic length: {encoder.dynamic_length}  groups: {shapes}")
+
+    encoder._encode(texts[:8], None, EmbeddingFormat.JSON)
+    start = perf_counter()
+    single = [encoder._encode_one(text, None, EmbeddingFormat.JSON) for text in texts]
+    single_s = perf_counter() - start
+    start = perf_counter()
+    batched = encoder._encode(texts, None, EmbeddingFormat.JSON)
+    batched_s = perf_counter() - start
+
+    a = np.array([orjson.loads(embedding) for embedding in single])
+    b = np.array([orjson.loads(embedding) for embedding in batched])
+    similarity = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    print(
+        f"one at a time {single_s / len(texts) * 1000:.2f} ms/text  batched {batched_s / len(texts) * 1000:.2f} ms/text"
+        f"  ({single_s / batched_s:.1f}x)  min cosine similarity {similarity.min():.6f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,27 @@
 import json
+from pathlib import Path
 from typing import Any, Iterator
 from unittest import mock
 
 import numpy as np
+import onnx
 import pytest
 from fastapi.testclient import TestClient
 from numpy.typing import NDArray
 from PIL import Image
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
 
 from immich_ml.config import log
 from immich_ml.main import app
+from immich_ml.models.clip.textual import text_embedding_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_text_cache() -> Iterator[None]:
+    yield
+    text_embedding_cache.clear()
 
 
 @pytest.fixture
@@ -28,6 +40,15 @@ def mock_get_model() -> Iterator[mock.Mock]:
         yield mocked
 
 
+@pytest.fixture
+def word_tokenizer() -> Tokenizer:
+    """A tokenizer where each word is a token, with the pad token of the CLIP tokenizer config as ID 0."""
+    words = ["<|endoftext|>", "<unk>", "a", "dog", "on", "the", "beach", "birthday", "party", "photo"]
+    tokenizer = Tokenizer(WordLevel({word: i for i, word in enumerate(words)}, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = Whitespace()
+    return tokenizer
+
+
 @pytest.fixture(scope="session")
 def deployed_app() -> Iterator[TestClient]:
     with TestClient(app) as client:
@@ -123,6 +144,67 @@ def ov_device_ids(request: pytest.FixtureRequest, ort_pybind: mock.Mock) -> Iter
     return ort_pybind
 
 
+@pytest.fixture
+def onnx_model_path(tmp_path: Path) -> Path:
+    inputs = [onnx.helper.make_tensor_value_info("x", onnx.TensorProto.FLOAT, ["batch", 4])]
+    outputs = [
+        onnx.helper.make_tensor_value_info("relu", onnx.TensorProto.FLOAT, ["batch", 4]),
+        onnx.helper.make_tensor_value_info("sum", onnx.TensorProto.FLOAT, ["batch", 1]),
+    ]
+    nodes = [
+        onnx.helper.make_node("Relu", ["x"], ["relu"]),
+        onnx.helper.make_node("ReduceSum", ["x"], ["sum"], keepdims=1),
+    ]
+    graph = onnx.helper.make_graph(nodes, "test", inputs, outputs)
+    model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 11)])
+    model.ir_version = 8
+    path = tmp_path / "model" / "model.onnx"
+    path.parent.mkdir()
+    onnx.save(model, path)
+    return path
+
+
+@pytest.fixture
+def detection_model_path(tmp_path: Path) -> Path:
+    """A small model with the inputs and outputs of the buffalo detection models, which have a batch size of 1."""
+    rng = np.random.default_rng(0)
+    nodes, initializers, outputs = [], [], []
+    for kind, columns in [("score", 1), ("bbox", 4), ("kps", 10)]:
+        for stride in [8, 16, 32]:
+            name = f"{kind}_{stride}"
+            weights = rng.normal(0, 0.1, (columns * 2, 3, 1, 1)).astype(np.float32)
+            initializers += [
+                onnx.numpy_helper.from_array(weights, f"{name}_weights"),
+                onnx.numpy_helper.from_array(np.array([-1, columns], dtype=np.int64), f"{name}_shape"),
+            ]
+            nodes += [
+                onnx.helper.make_node(
+                    "AveragePool",
+                    ["input.1"],
+                    [f"{name}_pool"],
+                    kernel_shape=[stride, stride],
+                    strides=[stride, stride],
+                ),
+                onnx.helper.make_node("Conv", [f"{name}_pool", f"{name}_weights"], [f"{name}_conv"]),
+                onnx.helper.make_node("Transpose", [f"{name}_conv"], [f"{name}_nhwc"], perm=[0, 2, 3, 1]),
+                onnx.helper.make_node(
+                    "Reshape", [f"{name}_nhwc", f"{name}_shape"], [f"{name}_raw" if kind == "score" else name]
+                ),
+            ]
+            if kind == "score":
+                nodes.append(onnx.helper.make_node("Sigmoid", [f"{name}_raw"], [name]))
+            anchors = (640 // stride) ** 2 * 2
+            outputs.append(onnx.helper.make_tensor_value_info(name, onnx.TensorProto.FLOAT, [anchors, columns]))
+    inputs = [onnx.helper.make_tensor_value_info("input.1", onnx.TensorProto.FLOAT, [1, 3, "?", "?"])]
+    graph = onnx.helper.make_graph(nodes, "detection", inputs, outputs, initializers)
+    model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    path = tmp_path / "detection" / "model.onnx"
+    path.parent.mkdir()
+    onnx.save(model, path)
+    return path
+
+
 @pytest.fixture(scope="function")
 def ort_session() -> Iterator[mock.Mock]:
     with mock.patch("immich_ml.sessions.ort.ort.InferenceSession") as mocked:
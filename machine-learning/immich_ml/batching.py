@@ -0,0 +1,77 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+import orjson
+
+from .models.base import InferenceModel
+from .profiling import merge_request_timings, request_timings
+from .schemas import ModelTask, ModelType
+
+
+class PendingBatch:
+    def __init__(self, model: InferenceModel, options: dict[str, Any]) -> None:
+        self.model = model
+        self.options = options
+        self.inputs: list[tuple[Any, ...]] = []
+        self.futures: list[asyncio.Future[tuple[Any, dict[str, float]]]] = []
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class RequestBatcher:
+    """Coalesces concurrent predictions for the same model and options into a single batched call."""
+
+    def __init__(self, run: Callable[..., Awaitable[Any]], max_size: int, max_wait_s: float) -> None:
+        """
+        Args:
+            run: Executes a blocking function, e.g. in a thread pool, and returns its result.
+            max_size: Maximum number of inputs in a batch. A batch runs as soon as it reaches this size.
+            max_wait_s: Maximum time to wait for a batch to fill up after its first input arrives.
+        """
+
+        self.run = run
+        self.max_size = max_size
+        self.max_wait_s = max_wait_s
+        self.pending: dict[tuple[str, ModelType, ModelTask, bytes], PendingBatch] = {}
+        self.tasks: set[asyncio.Task[None]] = set()
+
+    async def predict(self, model: InferenceModel, *inputs: Any, **options: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        key = (model.model_name, model.model_type, model.model_task, orjson.dumps(options, option=orjson.OPT_SORT_KEYS))
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = PendingBatch(model, options)
+            batch.timer = loop.call_later(self.max_wait_s, self._flush, key)
+
+        future: asyncio.Future[tuple[Any, dict[str, float]]] = loop.create_future()
+        batch.inputs.append(inputs)
+        batch.futures.append(future)
+        if len(batch.inputs) >= self.max_size:
+            self._flush(key)
+        output, timings = await future
+        # every request in the batch waited for the whole batch, so each is attributed its full duration
+        merge_request_timings(timings)
+        return output
+
+    def _flush(self, key: tuple[str, ModelType, ModelTask, bytes]) -> None:
+        batch = self.pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run_batch(self, batch: PendingBatch) -> None:
+        with request_timings() as timings:
+            try:
+                outputs = await self.run(batch.model.predict_batch, batch.inputs, **batch.options)
+            except Exception as e:
+                for future in batch.futures:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+        for future, output in zip(batch.futures, outputs):
+            if not future.done():
+                future.set_result((output, timings))
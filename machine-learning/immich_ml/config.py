@@ -13,6 +13,8 @@ from rich.logging import RichHandler
 from uvicorn import Server
 from uvicorn.workers import UvicornWorker
 
+from .schemas import EvictionPolicy, ModelPrecision
+
 
 class ClipSettings(BaseModel):
     textual: str | None = None
@@ -40,7 +42,15 @@ class PreloadModelData(BaseModel):
 
 
 class MaxBatchSize(BaseModel):
+    clip: int | None = None
     facial_recognition: int | None = None
+    face_detection: int | None = None
+
+
+class ModelPrecisionSettings(BaseModel):
+    visual: ModelPrecision = ModelPrecision.FP32
+    textual: ModelPrecision = ModelPrecision.FP32
+    recognition: ModelPrecision = ModelPrecision.FP32
 
 
 class Settings(BaseSettings):
@@ -54,13 +64,33 @@ class Settings(BaseSettings):
     cache_folder: Path = (Path.home() / ".cache" / "immich_ml").resolve()
     model_ttl: int = 300
     model_ttl_poll_s: int = 10
+    model_cache_size_mb: int = 0
+    model_cache_policy: EvictionPolicy = EvictionPolicy.LRU
+    model_warmup: bool = False
+    model_warmup_batch_sizes: list[int] = [1, 8, 32]
     workers: int = 1
     worker_timeout: int = 300
     http_keepalive_timeout_s: int = 2
     test_full: bool = False
     request_threads: int = os.cpu_count() or 4
+    inference_processes: int = 0
+    request_batch_size: int = 1
+    request_batch_wait_ms: float = 5.0
+    max_batch_request_items: int = 256
+    jpeg_draft: bool = False
+    fused_preprocessing: bool = False
+    face_detection_max_tiled_size: int = 1920
+    text_cache_size: int = 1024
+    text_cache_ttl: int = 3600
+    server_timing: bool = False
+    profile_sample_rate: float = 0.0
+    profile_onnxruntime: bool = False
     model_inter_op_threads: int = 0
     model_intra_op_threads: int = 0
+    ort_io_binding: bool = False
+    ort_optimized_model_cache: bool = False
+    ort_external_data: bool = False
+    ort_shared_weights: bool = False
     ann: bool = True
     ann_fp16_turbo: bool = False
     ann_tuning_level: int = 2
@@ -68,6 +98,7 @@ class Settings(BaseSettings):
     rknn_threads: int = 1
     preload: PreloadModelData | None = None
     max_batch_size: MaxBatchSize | None = None
+    model_precision: ModelPrecisionSettings = ModelPrecisionSettings()
 
     @property
     def device_id(self) -> str:
@@ -1,30 +1,54 @@
 import asyncio
+import contextvars
 import gc
 import os
 import signal
-import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import asynccontextmanager
 from functools import partial
-from typing import Any, AsyncGenerator, Callable, Iterator
+from typing import IO, Any, AsyncGenerator, Callable, Iterator, Sequence
 from zipfile import BadZipFile
 
 import orjson
-from fastapi import Depends, FastAPI, File, Form, HTTPException
-from fastapi.responses import ORJSONResponse, PlainTextResponse
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, UploadFile
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
 from onnxruntime.capi.onnxruntime_pybind11_state import InvalidProtobuf, NoSuchFile
-from PIL.Image import Image
 from pydantic import ValidationError
 from starlette.formparsers import MultiPartParser
 
+from immich_ml.metrics import (
+    ACTIVE_REQUESTS,
+    DECODE_SECONDS,
+    MODEL_CACHE_BYTES,
+    TEXT_CACHE_ENTRIES,
+    TEXT_CACHE_HITS,
+    TEXT_CACHE_MISSES,
+    THREAD_POOL_BUSY,
+    THREAD_POOL_QUEUED,
+    generate_latest,
+    queue_wait,
+)
 from immich_ml.models import get_model_deps
 from immich_ml.models.base import InferenceModel
-from immich_ml.models.transforms import decode_pil
+from immich_ml.models.clip.textual import text_embedding_cache
+from immich_ml.models.transforms import ImageContext, decode_upload
+from immich_ml.process_pool import InferenceProcessPool
+from immich_ml.profiling import (
+    format_server_timing,
+    merge_request_timings,
+    profile_request,
+    request_timings,
+    run_profiled,
+    time_request,
+)
 
+from .batching import RequestBatcher
 from .config import PreloadModelData, log, settings
 from .models.cache import ModelCache
 from .schemas import (
+    EmbeddingFormat,
     InferenceEntries,
     InferenceEntry,
     InferenceResponse,
@@ -38,31 +62,59 @@ from .schemas import (
 
 MultiPartParser.max_file_size = 2**26  # spools to disk if payload is 64 MiB or larger
 
-model_cache = ModelCache(revalidate=settings.model_ttl > 0)
+model_cache = ModelCache(
+    revalidate=settings.model_ttl > 0,
+    max_bytes=settings.model_cache_size_mb * 2**20,
+    policy=settings.model_cache_policy,
+)
 thread_pool: ThreadPoolExecutor | None = None
-lock = threading.Lock()
+process_pool: InferenceProcessPool | None = None
+batcher: RequestBatcher | None = None
 active_requests = 0
 last_called: float | None = None
 
+ACTIVE_REQUESTS.set_function(lambda: active_requests)
+THREAD_POOL_QUEUED.set_function(lambda: thread_pool._work_queue.qsize() if thread_pool is not None else 0)
+MODEL_CACHE_BYTES.set_function(lambda: model_cache.size)
+TEXT_CACHE_HITS.set_function(lambda: text_embedding_cache.hits)
+TEXT_CACHE_MISSES.set_function(lambda: text_embedding_cache.misses)
+TEXT_CACHE_ENTRIES.set_function(lambda: len(text_embedding_cache))
+
 
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:
-    global thread_pool
+    global thread_pool, process_pool, batcher
     log.info(
         (
             "Created in-memory cache with unloading "
             f"{f'after {settings.model_ttl}s of inactivity' if settings.model_ttl > 0 else 'disabled'}."
         )
     )
+    if settings.model_cache_size_mb > 0:
+        log.info(
+            f"Limiting loaded models to an estimated {settings.model_cache_size_mb} MiB, "
+            f"with {settings.model_cache_policy.upper()} eviction."
+        )
 
     try:
         if settings.request_threads > 0:
             # asyncio is a huge bottleneck for performance, so we use a thread pool to run blocking code
             thread_pool = ThreadPoolExecutor(settings.request_threads) if settings.request_threads > 0 else None
             log.info(f"Initialized request thread pool with {settings.request_threads} threads.")
+        if settings.inference_processes > 0:
+            # each worker process loads its own models, so requests aren't batched or preloaded here
+            process_pool = InferenceProcessPool(settings.inference_processes)
+            await process_pool.start()
+            log.info(f"Initialized inference process pool with {settings.inference_processes} processes.")
+        elif settings.request_batch_size > 1:
+            batcher = RequestBatcher(run, settings.request_batch_size, settings.request_batch_wait_ms / 1000)
+            log.info(
+                f"Batching up to {settings.request_batch_size} requests per model "
+                f"with a maximum wait of {settings.request_batch_wait_ms}ms."
+            )
         if settings.model_ttl > 0 and settings.model_ttl_poll_s > 0:
             asyncio.ensure_future(idle_shutdown_task())
-        if settings.preload is not None:
+        if settings.preload is not None and process_pool is None:
             await preload_models(settings.preload)
         yield
     finally:
@@ -71,37 +123,34 @@ async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:
             del model
         if thread_pool is not None:
             thread_pool.shutdown()
+        if process_pool is not None:
+            process_pool.shutdown()
         gc.collect()
 
 
 async def preload_models(preload: PreloadModelData) -> None:
     log.info(f"Preloading models: clip:{preload.clip} facial_recognition:{preload.facial_recognition}")
 
-    async def load_models(model_string: str, model_type: ModelType, model_task: ModelTask) -> None:
-        for model_name in model_string.split(","):
-            model_name = model_name.strip()
-            model = await model_cache.get(model_name, model_type, model_task)
-            await load(model)
-
-    if preload.clip.textual is not None:
-        await load_models(preload.clip.textual, ModelType.TEXTUAL, ModelTask.SEARCH)
-
-    if preload.clip.visual is not None:
-        await load_models(preload.clip.visual, ModelType.VISUAL, ModelTask.SEARCH)
-
-    if preload.facial_recognition.detection is not None:
-        await load_models(
-            preload.facial_recognition.detection,
-            ModelType.DETECTION,
-            ModelTask.FACIAL_RECOGNITION,
-        )
-
-    if preload.facial_recognition.recognition is not None:
-        await load_models(
-            preload.facial_recognition.recognition,
-            ModelType.RECOGNITION,
-            ModelTask.FACIAL_RECOGNITION,
-        )
+    async def load_model(model_name: str, model_type: ModelType, model_task: ModelTask) -> None:
+        # preloaded models are expected to stay loaded, so they're never evicted to make room for other models
+        model = await model_cache.get(model_name.strip(), model_type, model_task, pinned=True)
+        await load(model)
+
+    models: list[tuple[str | None, ModelType, ModelTask]] = [
+        (preload.clip.textual, ModelType.TEXTUAL, ModelTask.SEARCH),
+        (preload.clip.visual, ModelType.VISUAL, ModelTask.SEARCH),
+        (preload.facial_recognition.detection, ModelType.DETECTION, ModelTask.FACIAL_RECOGNITION),
+        (preload.facial_recognition.recognition, ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION),
+    ]
+    # models are downloaded and loaded in parallel, so startup takes about as long as the slowest model
+    await asyncio.gather(
+        *[
+            load_model(model_name, model_type, model_task)
+            for model_string, model_type, model_task in models
+            if model_string is not None
+            for model_name in model_string.split(",")
+        ]
+    )
 
     if preload.clip_fallback is not None:
         log.warning(
@@ -128,7 +177,26 @@ def update_state() -> Iterator[None]:
         active_requests -= 1
 
 
-def get_entries(entries: str = Form()) -> InferenceEntries:
+def get_embedding_format(accept: str | None = Header(default=None)) -> EmbeddingFormat:
+    if accept is None:
+        return EmbeddingFormat.JSON
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        if media_type not in ("application/json", "application/*", "*/*"):
+            continue
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "embedding":
+                try:
+                    return EmbeddingFormat(value.strip().strip('"').lower())
+                except ValueError:
+                    raise HTTPException(406, f"Unsupported embedding format '{value}'")
+    return EmbeddingFormat.JSON
+
+
+def get_entries(
+    entries: str = Form(), embedding_format: EmbeddingFormat = Depends(get_embedding_format)
+) -> InferenceEntries:
     try:
         request: PipelineRequest = orjson.loads(entries)
         without_deps: list[InferenceEntry] = []
@@ -141,6 +209,8 @@ def get_entries(entries: str = Form()) -> InferenceEntries:
                     "type": type,
                     "options": entry.get("options", {}),
                 }
+                if embedding_format != EmbeddingFormat.JSON:
+                    parsed["options"] = {**parsed["options"], "embedding_format": embedding_format}
                 dep = get_model_deps(parsed["name"], type, task)
                 (with_deps if dep else without_deps).append(parsed)
         return without_deps, with_deps
@@ -162,37 +232,127 @@ def ping() -> PlainTextResponse:
     return PlainTextResponse("pong")
 
 
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(generate_latest(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/predict", dependencies=[Depends(update_state)])
 async def predict(
     entries: InferenceEntries = Depends(get_entries),
-    image: bytes | None = File(default=None),
+    image: UploadFile | None = File(default=None),
     text: str | None = Form(default=None),
+    embedding_format: EmbeddingFormat = Depends(get_embedding_format),
 ) -> Any:
-    if image is not None:
-        inputs: Image | str = await run(lambda: decode_pil(image))
-    elif text is not None:
-        inputs = text
-    else:
-        raise HTTPException(400, "Either image or text must be provided")
-    response = await run_inference(inputs, entries)
-    return ORJSONResponse(response)
+    with request_timings() as timings, profile_request("predict"):
+        if process_pool is not None:
+            if image is None and text is None:
+                raise HTTPException(400, "Either image or text must be provided")
+            images = [await image.read()] if image is not None else None
+            texts = [text] if text is not None else None
+            return render(await run_in_process(entries, images, texts, batch=False), embedding_format, timings)
+        if image is not None:
+            size = await get_size_hint(entries)
+            inputs: ImageContext | str = await run(decode, image.file, size)
+        elif text is not None:
+            inputs = text
+        else:
+            raise HTTPException(400, "Either image or text must be provided")
+        response = await run_inference(inputs, entries)
+        return render(response, embedding_format, timings)
+
+
+@app.post("/predict/batch", dependencies=[Depends(update_state)])
+async def predict_batch(
+    entries: InferenceEntries = Depends(get_entries),
+    images: list[UploadFile] | None = File(default=None),
+    texts: list[str] | None = Form(default=None),
+    embedding_format: EmbeddingFormat = Depends(get_embedding_format),
+) -> Any:
+    with request_timings() as timings, profile_request("predict-batch"):
+        count = len(images or texts or [])
+        if count > settings.max_batch_request_items:
+            raise HTTPException(413, f"At most {settings.max_batch_request_items} images or texts can be sent at once")
+        if process_pool is not None:
+            if not images and not texts:
+                raise HTTPException(400, "Either images or texts must be provided")
+            image_bytes = [await image.read() for image in images] if images else None
+            body = await run_in_process(entries, image_bytes, None if images else texts, batch=True)
+            return render(body, embedding_format, timings)
+        if images:
+            size = await get_size_hint(entries)
+            inputs: Sequence[ImageContext | str] = await asyncio.gather(
+                *[run(decode, image.file, size) for image in images]
+            )
+        elif texts:
+            inputs = texts
+        else:
+            raise HTTPException(400, "Either images or texts must be provided")
+        responses = await run_batch_inference(inputs, entries)
+        return render(responses, embedding_format, timings)
+
+
+def decode(file: IO[bytes], size: int | None) -> ImageContext:
+    with DECODE_SECONDS.time(), time_request("decode"):
+        return ImageContext(decode_upload(file, size))
+
+
+def render(content: Any, embedding_format: EmbeddingFormat, timings: dict[str, float]) -> Response:
+    with time_request("response"):
+        if isinstance(content, bytes):  # already serialized by a worker process
+            response = Response(content, media_type=get_media_type(embedding_format))
+        else:
+            response = ORJSONResponse(content, media_type=get_media_type(embedding_format))
+    if settings.server_timing:
+        response.headers["Server-Timing"] = format_server_timing(timings)
+    return response
+
+
+async def run_in_process(
+    entries: InferenceEntries, images: list[bytes] | None, texts: list[str] | None, batch: bool
+) -> bytes:
+    assert process_pool is not None
+    try:
+        body, timings = await process_pool.predict(entries, images, texts, batch=batch)
+    except BrokenProcessPool:
+        raise HTTPException(503, "An inference process exited unexpectedly and was restarted, please retry")
+    merge_request_timings(timings)
+    return body
+
+
+# the smallest image size that the requested models can use without affecting their outputs
+async def get_size_hint(entries: InferenceEntries) -> int | None:
+    if not settings.jpeg_draft:
+        return None
+    sizes: list[int] = []
+    for entry in [*entries[0], *entries[1]]:
+        model = await model_cache.get(entry["name"], entry["type"], entry["task"], ttl=settings.model_ttl)
+        model = await load(model)
+        # tiled face detection looks for small faces at a higher resolution than the model's input size
+        if model.size_hint is None or entry["options"].get("tiled"):
+            return None
+        sizes.append(model.size_hint)
+    return max(sizes, default=None)
 
 
-async def run_inference(payload: Image | str, entries: InferenceEntries) -> InferenceResponse:
+def get_media_type(embedding_format: EmbeddingFormat) -> str:
+    if embedding_format == EmbeddingFormat.JSON:
+        return "application/json"
+    return f"application/json; embedding={embedding_format}"
+
+
+async def run_inference(payload: ImageContext | str, entries: InferenceEntries) -> InferenceResponse:
     outputs: dict[ModelIdentity, Any] = {}
     response: InferenceResponse = {}
 
     async def _run_inference(entry: InferenceEntry) -> None:
         model = await model_cache.get(entry["name"], entry["type"], entry["task"], ttl=settings.model_ttl)
-        inputs = [payload]
-        for dep in model.depends:
-            try:
-                inputs.append(outputs[dep])
-            except KeyError:
-                message = f"Task {entry['task']} of type {entry['type']} depends on output of {dep}"
-                raise HTTPException(400, message)
+        inputs = get_model_inputs(model, entry, payload, outputs)
         model = await load(model)
-        output = await run(model.predict, *inputs, **entry["options"])
+        if batcher is not None:
+            output = await batcher.predict(model, *inputs, **entry["options"])
+        else:
+            output = await run(model.predict, *inputs, **entry["options"])
         outputs[model.identity] = output
         response[entry["task"]] = output
 
@@ -200,46 +360,99 @@ async def run_inference(payload: Image | str, entries: InferenceEntries) -> Infe
     await asyncio.gather(*[_run_inference(entry) for entry in without_deps])
     if with_deps:
         await asyncio.gather(*[_run_inference(entry) for entry in with_deps])
-    if isinstance(payload, Image):
+    if isinstance(payload, ImageContext):
         response["imageHeight"], response["imageWidth"] = payload.height, payload.width
 
     return response
 
 
+async def run_batch_inference(
+    payloads: Sequence[ImageContext | str], entries: InferenceEntries
+) -> list[InferenceResponse]:
+    outputs: list[dict[ModelIdentity, Any]] = [{} for _ in payloads]
+    responses: list[InferenceResponse] = [{} for _ in payloads]
+
+    async def _run_inference(entry: InferenceEntry) -> None:
+        model = await model_cache.get(entry["name"], entry["type"], entry["task"], ttl=settings.model_ttl)
+        batch = [
+            tuple(get_model_inputs(model, entry, payload, payload_outputs))
+            for payload, payload_outputs in zip(payloads, outputs)
+        ]
+        model = await load(model)
+        batch_outputs = await run(model.predict_batch, batch, **entry["options"])
+        for payload_outputs, response, output in zip(outputs, responses, batch_outputs):
+            payload_outputs[model.identity] = output
+            response[entry["task"]] = output
+
+    without_deps, with_deps = entries
+    await asyncio.gather(*[_run_inference(entry) for entry in without_deps])
+    if with_deps:
+        await asyncio.gather(*[_run_inference(entry) for entry in with_deps])
+    for payload, response in zip(payloads, responses):
+        if isinstance(payload, ImageContext):
+            response["imageHeight"], response["imageWidth"] = payload.height, payload.width
+
+    return responses
+
+
+def get_model_inputs(
+    model: InferenceModel, entry: InferenceEntry, payload: ImageContext | str, outputs: dict[ModelIdentity, Any]
+) -> list[Any]:
+    inputs = [payload]
+    for dep in model.depends:
+        try:
+            inputs.append(outputs[dep])
+        except KeyError:
+            message = f"Task {entry['task']} of type {entry['type']} depends on output of {dep}"
+            raise HTTPException(400, message)
+    return inputs
+
+
 async def run(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
     if thread_pool is None:
-        return func(*args, **kwargs)
-    partial_func = partial(func, *args, **kwargs)
+        return run_profiled(func, *args, **kwargs)
+    # copies the context so per-request state like timings is visible in the thread
+    context = contextvars.copy_context()
+    partial_func = partial(context.run, _run_in_thread, time.perf_counter(), func, *args, **kwargs)
     return await asyncio.get_running_loop().run_in_executor(thread_pool, partial_func)
 
 
+def _run_in_thread(submitted: float, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    THREAD_POOL_BUSY.inc()
+    try:
+        with queue_wait(time.perf_counter() - submitted):
+            return run_profiled(func, *args, **kwargs)
+    finally:
+        THREAD_POOL_BUSY.dec()
+
+
 async def load(model: InferenceModel) -> InferenceModel:
-    if model.loaded:
-        return model
+    return await model_cache.load(model, _load)
+
 
-    def _load(model: InferenceModel) -> InferenceModel:
+async def _load(model: InferenceModel) -> InferenceModel:
+    def _load_model(model: InferenceModel) -> InferenceModel:
         if model.load_attempts > 1:
             raise HTTPException(500, f"Failed to load model '{model.model_name}'")
-        with lock:
-            try:
-                model.load()
-            except FileNotFoundError as e:
-                if model.model_format == ModelFormat.ONNX:
-                    raise e
-                log.warning(
-                    f"{model.model_format.upper()} is available, but model '{model.model_name}' does not support it.",
-                    exc_info=e,
-                )
-                model.model_format = ModelFormat.ONNX
-                model.load()
+        try:
+            model.load()
+        except FileNotFoundError as e:
+            if model.model_format == ModelFormat.ONNX:
+                raise e
+            log.warning(
+                f"{model.model_format.upper()} is available, but model '{model.model_name}' does not support it.",
+                exc_info=e,
+            )
+            model.model_format = ModelFormat.ONNX
+            model.load()
         return model
 
     try:
-        return await run(_load, model)
+        return await run(_load_model, model)
     except (OSError, InvalidProtobuf, BadZipFile, NoSuchFile):
         log.warning(f"Failed to load {model.model_type.replace('_', ' ')} model '{model.model_name}'. Clearing cache.")
         model.clear_cache()
-        return await run(_load, model)
+        return await run(_load_model, model)
 
 
 async def idle_shutdown_task() -> None:
@@ -247,7 +460,7 @@ async def idle_shutdown_task() -> None:
         if (
             last_called is not None
             and not active_requests
-            and not lock.locked()
+            and not model_cache.loading
             and time.time() - last_called > settings.model_ttl
         ):
             log.info("Shutting down due to inactivity.")
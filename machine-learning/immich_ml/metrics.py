@@ -0,0 +1,236 @@
+"""Minimal metrics in the Prometheus text exposition format, without depending on prometheus_client."""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Callable, ClassVar, Iterator
+
+from .profiling import add_request_timing
+
+if TYPE_CHECKING:
+    from .models.base import InferenceModel
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+LOAD_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, math.inf)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Metric(ABC):
+    type: ClassVar[str]
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._function: Callable[[], float] | None = None
+        registry.append(self)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Reads the value from `function` at collection time instead of tracking it."""
+        self._function = function
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        if self._function is not None:
+            lines.append(f"{self.name} {_format_value(self._function())}")
+        else:
+            lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> list[str]: ...
+
+    def _check_labels(self, labelvalues: tuple[str, ...]) -> tuple[str, ...]:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"Expected labels {self.labelnames} for metric '{self.name}', got {labelvalues}")
+        return tuple(str(value) for value in labelvalues)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        key = self._check_labels(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        return self._values.get(self._check_labels(labelvalues), 0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labelvalues: str, amount: float = 1) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        key = self._check_labels(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets if buckets[-1] == math.inf else (*buckets, math.inf)
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        key = self._check_labels(labelvalues)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def get_count(self, *labelvalues: str) -> int:
+        counts = self._counts.get(self._check_labels(labelvalues))
+        return counts[-1] if counts is not None else 0
+
+    def get_sum(self, *labelvalues: str) -> float:
+        return self._sums.get(self._check_labels(labelvalues), 0.0)
+
+    def _samples(self) -> list[str]:
+        lines = []
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels((*self.labelnames, "le"), (*key, _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+registry: list[Metric] = []
+
+
+def generate_latest() -> str:
+    return "\n".join(line for metric in registry for line in metric.collect()) + "\n"
+
+
+MODEL_LABELS = ("model", "type", "task")
+
+STAGE_SECONDS = Histogram(
+    "immich_ml_stage_seconds",
+    "Time spent in each stage of a prediction. 'preprocess' is the time not spent in inference or serialization.",
+    (*MODEL_LABELS, "stage"),
+)
+DECODE_SECONDS = Histogram("immich_ml_decode_seconds", "Time spent decoding uploaded images.")
+MODEL_LOAD_SECONDS = Histogram(
+    "immich_ml_model_load_seconds", "Time spent loading models into memory.", MODEL_LABELS, buckets=LOAD_BUCKETS
+)
+MODEL_CACHE_REQUESTS = Counter(
+    "immich_ml_model_cache_requests_total", "Model cache lookups by result.", (*MODEL_LABELS, "result")
+)
+MODEL_CACHE_EVICTIONS = Counter(
+    "immich_ml_model_cache_evictions_total", "Models unloaded to stay within the model cache size.", MODEL_LABELS
+)
+MODEL_CACHE_BYTES = Gauge("immich_ml_model_cache_bytes", "Estimated size of the models currently loaded.")
+THREAD_POOL_BUSY = Gauge("immich_ml_thread_pool_busy_threads", "Request threads currently running a task.")
+THREAD_POOL_QUEUED = Gauge("immich_ml_thread_pool_queued_tasks", "Tasks waiting for a request thread.")
+ACTIVE_REQUESTS = Gauge("immich_ml_active_requests", "Requests currently being handled.")
+TEXT_CACHE_HITS = Counter("immich_ml_text_cache_hits_total", "Text embeddings served from the cache.")
+TEXT_CACHE_MISSES = Counter("immich_ml_text_cache_misses_total", "Text embeddings that had to be computed.")
+TEXT_CACHE_ENTRIES = Gauge("immich_ml_text_cache_entries", "Text embeddings currently in the cache.")
+
+
+# accumulates the time spent in each stage by the prediction running in the current thread
+_stage_times: ContextVar[dict[str, float] | None] = ContextVar("stage_times", default=None)
+# how long the task running in the current thread waited for a free thread
+_queue_wait: ContextVar[float | None] = ContextVar("queue_wait", default=None)
+
+
+@contextmanager
+def queue_wait(seconds: float) -> Iterator[None]:
+    token = _queue_wait.set(seconds)
+    try:
+        yield
+    finally:
+        _queue_wait.reset(token)
+
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    stage_times = _stage_times.get()
+    if stage_times is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_times[stage] = stage_times.get(stage, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def record_stages(model: InferenceModel) -> Iterator[None]:
+    labels = (model.model_name, str(model.model_type), str(model.model_task))
+    wait = _queue_wait.get()
+    if wait is not None:
+        STAGE_SECONDS.observe(wait, *labels, "queue")
+        add_request_timing(f"{model.model_type}-queue", wait)
+        _queue_wait.set(None)
+
+    stage_times: dict[str, float] = {}
+    token = _stage_times.set(stage_times)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        total = time.perf_counter() - start
+        _stage_times.reset(token)
+        inference = stage_times.get("inference", 0.0)
+        serialize = stage_times.get("serialize", 0.0)
+        preprocess = max(total - inference - serialize, 0.0)
+        for stage, seconds in [("preprocess", preprocess), ("inference", inference), ("serialize", serialize)]:
+            STAGE_SECONDS.observe(seconds, *labels, stage)
+            add_request_timing(f"{model.model_type}-{stage}", seconds)
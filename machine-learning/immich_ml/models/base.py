@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import threading
+import time
 from abc import ABC, abstractmethod
 from pathlib import Path
 from shutil import rmtree
@@ -9,10 +11,11 @@ from huggingface_hub import snapshot_download
 
 import immich_ml.sessions.ann.loader
 import immich_ml.sessions.rknn as rknn
-from immich_ml.sessions.ort import OrtSession
+from immich_ml.sessions.ort import OrtSession, ensure_external_data
 
 from ..config import clean_name, log, settings
-from ..schemas import ModelFormat, ModelIdentity, ModelSession, ModelTask, ModelType
+from ..metrics import MODEL_LOAD_SECONDS, record_stages
+from ..schemas import ModelFormat, ModelIdentity, ModelPrecision, ModelSession, ModelState, ModelTask, ModelType
 from ..sessions.ann import AnnSession
 
 
@@ -25,14 +28,22 @@ class InferenceModel(ABC):
         model_name: str,
         cache_dir: Path | str | None = None,
         model_format: ModelFormat | None = None,
+        model_precision: ModelPrecision | None = None,
         session: ModelSession | None = None,
         **model_kwargs: Any,
     ) -> None:
-        self.loaded = session is not None
+        self.state = ModelState.LOADED if session is not None else ModelState.UNLOADED
         self.load_attempts = 0
+        # estimated from the size of the model files when loading them
+        self.model_size = 0
+        # the file the session was created from, which is a variant of the model if one is used
+        self.session_path: Path | None = None
+        # held while loading so concurrent callers of this model wait for one load, but other models don't
+        self.load_lock = threading.Lock()
         self.model_name = clean_name(model_name)
         self.cache_dir = Path(cache_dir) if cache_dir is not None else self._cache_dir_default
         self.model_format = model_format if model_format is not None else self._model_format_default
+        self.model_precision = model_precision if model_precision is not None else self._model_precision_default
         if session is not None:
             self.session = session
 
@@ -42,27 +53,80 @@ class InferenceModel(ABC):
                 f"Downloading {self.model_type.replace('-', ' ')} model '{self.model_name}'. This may take a while."
             )
             self._download()
+        # converted ahead of loading so only the first load after downloading pays for it
+        if self.model_format == ModelFormat.ONNX and (settings.ort_external_data or settings.ort_shared_weights):
+            ensure_external_data(self.model_path)
+
+    @property
+    def loaded(self) -> bool:
+        return self.state == ModelState.LOADED
 
     def load(self) -> None:
         if self.loaded:
             return
-        self.load_attempts += 1
+        with self.load_lock:
+            if self.loaded:
+                return
+            self.load_attempts += 1
+            self.state = ModelState.LOADING
+            try:
+                self.download()
+                attempt = f"Attempt #{self.load_attempts} to load" if self.load_attempts > 1 else "Loading"
+                log.info(f"{attempt} {self.model_type.replace('-', ' ')} model '{self.model_name}' to memory")
+                with MODEL_LOAD_SECONDS.time(self.model_name, self.model_type, self.model_task):
+                    self.session = self._load()
+                if settings.model_warmup:
+                    self.warmup()
+            except BaseException:
+                self.state = ModelState.FAILED
+                raise
+            self.state = ModelState.LOADED
+
+    def warmup(self) -> None:
+        """
+        Runs the model on synthetic inputs so the first request doesn't pay for the provider selecting kernels or
+        compiling the model for the input shape. A failed warm-up is logged, since the model may still work.
+        """
+
+        start = time.perf_counter()
+        try:
+            for batch_size in self._warmup_batch_sizes:
+                self._warmup(batch_size)
+        except Exception as e:
+            log.warning(f"Failed to warm up {self.model_type.replace('-', ' ')} model '{self.model_name}'", exc_info=e)
+            return
+        log.info(
+            f"Warmed up {self.model_type.replace('-', ' ')} model '{self.model_name}' "
+            f"in {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
 
-        self.download()
-        attempt = f"Attempt #{self.load_attempts} to load" if self.load_attempts > 1 else "Loading"
-        log.info(f"{attempt} {self.model_type.replace('-', ' ')} model '{self.model_name}' to memory")
-        self.session = self._load()
-        self.loaded = True
+    def _warmup(self, batch_size: int) -> None:
+        pass
+
+    @property
+    def _warmup_batch_sizes(self) -> list[int]:
+        return [1]
 
     def predict(self, *inputs: Any, **model_kwargs: Any) -> Any:
         self.load()
         if model_kwargs:
             self.configure(**model_kwargs)
-        return self._predict(*inputs, **model_kwargs)
+        with record_stages(self):
+            return self._predict(*inputs, **model_kwargs)
+
+    def predict_batch(self, batch: list[tuple[Any, ...]], **model_kwargs: Any) -> list[Any]:
+        self.load()
+        if model_kwargs:
+            self.configure(**model_kwargs)
+        with record_stages(self):
+            return self._predict_batch(batch, **model_kwargs)
 
     @abstractmethod
     def _predict(self, *inputs: Any, **model_kwargs: Any) -> Any: ...
 
+    def _predict_batch(self, batch: list[tuple[Any, ...]], **model_kwargs: Any) -> list[Any]:
+        return [self._predict(*inputs, **model_kwargs) for inputs in batch]
+
     def configure(self, **kwargs: Any) -> None:
         pass
 
@@ -109,6 +173,20 @@ class InferenceModel(ABC):
         if not model_path.is_file():
             raise FileNotFoundError(f"Model file not found: {model_path}")
 
+        if model_path.suffix == ".onnx" and self.model_precision != ModelPrecision.FP32:
+            variant_path = self.model_path_for_precision(self.model_precision)
+            if variant_path.is_file():
+                log.info(f"Using {self.model_precision.upper()} variant of model '{self.model_name}'")
+                model_path = variant_path
+            else:
+                log.warning(
+                    f"{self.model_precision.upper()} variant of model '{self.model_name}' not found at "
+                    f"'{variant_path}', using the original. It can be created with `python -m immich_ml.quantize`."
+                )
+
+        self.session_path = model_path
+        # weights can be stored in separate files next to the model, e.g. model.onnx.data
+        self.model_size = sum(path.stat().st_size for path in model_path.parent.glob(f"{model_path.name}*"))
         match model_path.suffix:
             case ".armnn":
                 session: ModelSession = AnnSession(model_path)
@@ -126,6 +204,11 @@ class InferenceModel(ABC):
             return self.model_dir / model_path_prefix / f"model.{model_format}"
         return self.model_dir / f"model.{model_format}"
 
+    def model_path_for_precision(self, model_precision: ModelPrecision) -> Path:
+        if model_precision == ModelPrecision.FP32:
+            return self.model_path_for_format(ModelFormat.ONNX)
+        return self.model_dir / model_precision / f"model.{ModelFormat.ONNX}"
+
     @property
     def model_dir(self) -> Path:
         return self.cache_dir / self.model_type.value
@@ -134,6 +217,14 @@ class InferenceModel(ABC):
     def model_path(self) -> Path:
         return self.model_path_for_format(self.model_format)
 
+    @property
+    def size_hint(self) -> int | None:
+        return None
+
+    @property
+    def has_batch_axis(self) -> bool:
+        return not isinstance(self.session.get_inputs()[0].shape[0], int)
+
     @property
     def model_task(self) -> ModelTask:
         return self.identity[1]
@@ -167,6 +258,20 @@ class InferenceModel(ABC):
         log.debug(f"Setting model format to {model_format}")
         self._model_format = model_format
 
+    @property
+    def model_precision(self) -> ModelPrecision:
+        return self._model_precision
+
+    @model_precision.setter
+    def model_precision(self, model_precision: ModelPrecision) -> None:
+        log.debug(f"Setting model precision to {model_precision}")
+        self._model_precision = model_precision
+
+    @property
+    def _model_precision_default(self) -> ModelPrecision:
+        model_precision: ModelPrecision = getattr(settings.model_precision, self.model_type.value, ModelPrecision.FP32)
+        return model_precision
+
     @property
     def _model_format_default(self) -> ModelFormat:
         if rknn.is_available:
@@ -1,4 +1,6 @@
-from typing import Any
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
 
 from aiocache.backends.memory import SimpleMemoryCache
 from aiocache.lock import OptimisticLock
@@ -7,7 +9,9 @@ from aiocache.plugins import TimingPlugin
 from immich_ml.models import from_model_type
 from immich_ml.models.base import InferenceModel
 
-from ..schemas import ModelTask, ModelType, has_profiling
+from ..config import log
+from ..metrics import MODEL_CACHE_EVICTIONS, MODEL_CACHE_REQUESTS
+from ..schemas import EvictionPolicy, ModelState, ModelTask, ModelType, has_profiling
 
 
 class ModelCache:
@@ -18,12 +22,17 @@ class ModelCache:
         revalidate: bool = False,
         timeout: int | None = None,
         profiling: bool = False,
+        max_bytes: int = 0,
+        policy: EvictionPolicy = EvictionPolicy.LRU,
     ) -> None:
         """
         Args:
             revalidate: Resets TTL on cache hit. Useful to keep models in memory while active. Defaults to False.
             timeout: Maximum allowed time for model to load. Disabled if None. Defaults to None.
             profiling: Collects metrics for cache operations, adding slight overhead. Defaults to False.
+            max_bytes: Estimated size of loaded models above which other models are evicted. Disabled if 0.
+                Defaults to 0.
+            policy: Which models to evict first when over `max_bytes`. Defaults to least recently used.
         """
 
         plugins = []
@@ -34,21 +43,98 @@ class ModelCache:
         self.should_revalidate = revalidate
 
         self.cache = SimpleMemoryCache(timeout=timeout, plugins=plugins, namespace=None)
+        self.loads: dict[InferenceModel, asyncio.Future[InferenceModel]] = {}
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # time of last use and number of uses of each key
+        self.usage: dict[str, tuple[float, int]] = {}
+        # keys of models that are never evicted, e.g. preloaded models
+        self.pinned: set[str] = set()
 
     async def get(
-        self, model_name: str, model_type: ModelType, model_task: ModelTask, **model_kwargs: Any
+        self, model_name: str, model_type: ModelType, model_task: ModelTask, pinned: bool = False, **model_kwargs: Any
     ) -> InferenceModel:
         key = f"{model_name}{model_type}{model_task}"
+        if pinned:
+            self.pinned.add(key)
+        _, uses = self.usage.get(key, (0.0, 0))
+        self.usage[key] = (time.monotonic(), uses + 1)
 
         async with OptimisticLock(self.cache, key) as lock:
             model: InferenceModel | None = await self.cache.get(key)
             if model is None:
+                MODEL_CACHE_REQUESTS.inc(model_name, model_type, model_task, "miss")
                 model = from_model_type(model_name, model_type, model_task, **model_kwargs)
                 await lock.cas(model, ttl=model_kwargs.get("ttl", None))
-            elif self.should_revalidate:
-                await self.revalidate(key, model_kwargs.get("ttl", None))
+            else:
+                MODEL_CACHE_REQUESTS.inc(model_name, model_type, model_task, "hit")
+                if self.should_revalidate:
+                    await self.revalidate(key, model_kwargs.get("ttl", None))
         return model
 
+    async def load(
+        self, model: InferenceModel, load_func: Callable[[InferenceModel], Awaitable[InferenceModel]]
+    ) -> InferenceModel:
+        """
+        Loads the model with `load_func` if it isn't loaded yet. Concurrent calls for the same model wait for the same
+        load without occupying a thread, while other models load independently.
+        """
+
+        if model.loaded:
+            return model
+        future = self.loads.get(model)
+        if future is None:
+            future = asyncio.ensure_future(load_func(model))
+            self.loads[model] = future
+            future.add_done_callback(lambda _: self.loads.pop(model, None))
+        # a cancelled request shouldn't cancel the load for other requests waiting on it
+        model = await asyncio.shield(future)
+        await self.evict(keep=model)
+        return model
+
+    async def evict(self, keep: InferenceModel | None = None) -> None:
+        """Unloads models according to the eviction policy until the loaded models fit within `max_bytes`."""
+
+        if self.max_bytes <= 0:
+            return
+        models: dict[str, InferenceModel] = {key: model for key, model in self.cache._cache.items() if model.loaded}
+        size = sum(model.model_size for model in models.values())
+        candidates = [key for key, model in models.items() if key not in self.pinned and model is not keep]
+        candidates.sort(key=self._eviction_order)
+        for key in candidates:
+            if size <= self.max_bytes:
+                break
+            model = models[key]
+            await self.cache.delete(key)
+            self.usage.pop(key, None)
+            size -= model.model_size
+            MODEL_CACHE_EVICTIONS.inc(model.model_name, model.model_type, model.model_task)
+            log.info(
+                f"Unloaded {model.model_type.replace('-', ' ')} model '{model.model_name}' to stay within the "
+                f"model cache size ({size / 2**20:.0f}/{self.max_bytes / 2**20:.0f} MiB in use)"
+            )
+        if size > self.max_bytes:
+            log.warning(
+                f"Loaded models take up an estimated {size / 2**20:.0f} MiB, more than the model cache size of "
+                f"{self.max_bytes / 2**20:.0f} MiB, but the remaining models are pinned or in use"
+            )
+
+    @property
+    def size(self) -> int:
+        """Estimated size in bytes of the models currently loaded."""
+
+        return sum(model.model_size for model in self.cache._cache.values() if model.loaded)
+
+    def _eviction_order(self, key: str) -> tuple[float, ...]:
+        last_used, uses = self.usage.get(key, (0.0, 0))
+        if self.policy == EvictionPolicy.LFU:
+            return (uses, last_used)
+        return (last_used,)
+
+    @property
+    def loading(self) -> bool:
+        return bool(self.loads) or any(model.state == ModelState.LOADING for model in self.cache._cache.values())
+
     async def get_profiling(self) -> dict[str, float] | None:
         if not has_profiling(self.cache):
             return None
@@ -1,31 +1,151 @@
 import json
+import threading
+import time
 from abc import abstractmethod
+from collections import OrderedDict
 from functools import cached_property
 from pathlib import Path
-from typing import Any
+from typing import Any, Hashable
 
 import numpy as np
+import onnxruntime as ort
 from numpy.typing import NDArray
 from tokenizers import Encoding, Tokenizer
 
-from immich_ml.config import log
+from immich_ml.config import log, settings
 from immich_ml.models.base import InferenceModel
-from immich_ml.models.constants import WEBLATE_TO_FLORES200
+from immich_ml.models.constants import CLIP_BATCH_SIZE_DEFAULT, WEBLATE_TO_FLORES200
 from immich_ml.models.transforms import clean_text, serialize_np_array
-from immich_ml.schemas import ModelSession, ModelTask, ModelType
+from immich_ml.schemas import EmbeddingFormat, ModelFormat, ModelSession, ModelTask, ModelType
+
+# texts in a batch are padded to a multiple of this length, so similar lengths are run together
+TEXT_BUCKET_LENGTH = 16
+
+
+class TextEmbeddingCache:
+    """Thread-safe LRU cache of serialized text embeddings, shared by all textual models."""
+
+    def __init__(self, max_size: int, ttl: int = 0) -> None:
+        """
+        Args:
+            max_size: Maximum number of embeddings to keep. Disabled if 0.
+            ttl: Seconds after which an embedding expires. Never expires if 0.
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> str | None:
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl > 0 and time.monotonic() - entry[1] > self.ttl):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, embedding: str) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (embedding, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+text_embedding_cache = TextEmbeddingCache(settings.text_cache_size, settings.text_cache_ttl)
 
 
 class BaseCLIPTextualEncoder(InferenceModel):
     depends = []
     identity = (ModelType.TEXTUAL, ModelTask.SEARCH)
 
-    def _predict(self, inputs: str, language: str | None = None, **kwargs: Any) -> str:
-        tokens = self.tokenize(inputs, language=language)
+    def __init__(self, model_name: str, **model_kwargs: Any) -> None:
+        super().__init__(model_name, **model_kwargs)
+        max_batch_size = settings.max_batch_size.clip if settings.max_batch_size else None
+        self.batch_size = max_batch_size if max_batch_size else CLIP_BATCH_SIZE_DEFAULT
+
+    def _predict(
+        self,
+        inputs: str,
+        language: str | None = None,
+        embedding_format: EmbeddingFormat = EmbeddingFormat.JSON,
+        **kwargs: Any,
+    ) -> str:
+        return self._predict_batch([(inputs,)], language=language, embedding_format=embedding_format)[0]
+
+    def _predict_batch(
+        self,
+        batch: list[tuple[str]],
+        language: str | None = None,
+        embedding_format: EmbeddingFormat = EmbeddingFormat.JSON,
+        **kwargs: Any,
+    ) -> list[str]:
+        keys = [self._cache_key(inputs, language, embedding_format) for inputs, in batch]
+        outputs: dict[int, str] = {}
+        missing: list[int] = []
+        for i, key in enumerate(keys):
+            cached = text_embedding_cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                outputs[i] = cached
+        if missing:
+            embeddings = self._encode([batch[i][0] for i in missing], language, embedding_format)
+            for i, embedding in zip(missing, embeddings):
+                text_embedding_cache.set(keys[i], embedding)
+                outputs[i] = embedding
+        return [outputs[i] for i in range(len(batch))]
+
+    def _encode(self, texts: list[str], language: str | None, embedding_format: EmbeddingFormat) -> list[str]:
+        if len(texts) == 1 or not self.has_batch_axis:
+            return [self._encode_one(text, language, embedding_format) for text in texts]
+        outputs: list[str] = [""] * len(texts)
+        for indices, tokens in self.tokenize_batch(texts, language=language):
+            for start in range(0, len(indices), self.batch_size):
+                chunk = {name: array[start : start + self.batch_size] for name, array in tokens.items()}
+                res: NDArray[np.float32] = self.session.run(None, chunk)[0]
+                for i, embedding in zip(indices[start : start + self.batch_size], res):
+                    outputs[i] = serialize_np_array(embedding, embedding_format)
+        return outputs
+
+    def _encode_one(self, text: str, language: str | None, embedding_format: EmbeddingFormat) -> str:
+        tokens = self.tokenize(text, language=language)
         res: NDArray[np.float32] = self.session.run(None, tokens)[0][0]
-        return serialize_np_array(res)
+        return serialize_np_array(res, embedding_format)
+
+    def _warmup(self, batch_size: int) -> None:
+        # bypasses the text embedding cache
+        self.session.run(None, self.tokenize("a photo"))
+
+    def _cache_key(
+        self, text: str, language: str | None, embedding_format: EmbeddingFormat
+    ) -> tuple[str, str, str | None, EmbeddingFormat]:
+        # the language only affects the output of multilingual models
+        language = language if self.is_nllb else None
+        return (self.model_name, clean_text(text, canonicalize=self.canonicalize), language, embedding_format)
 
     def _load(self) -> ModelSession:
         session = super()._load()
+        self.dynamic_length = self._supports_dynamic_length(session)
         log.debug(f"Loading tokenizer for CLIP model '{self.model_name}'")
         self.tokenizer = self._load_tokenizer()
         tokenizer_kwargs: dict[str, Any] | None = self.text_cfg.get("tokenizer_kwargs")
@@ -35,6 +155,16 @@ class BaseCLIPTextualEncoder(InferenceModel):
 
         return session
 
+    def _supports_dynamic_length(self, session: ModelSession) -> bool:
+        # padding only changes the embedding if the model pools the last token, and
+        # OpenVINO compiles the model again for each new input shape
+        return (
+            self.model_format == ModelFormat.ONNX
+            and "OpenVINOExecutionProvider" not in ort.get_available_providers()
+            and not isinstance(session.get_inputs()[0].shape[-1], int)
+            and self.text_cfg.get("pool_type") != "last"
+        )
+
     @abstractmethod
     def _load_tokenizer(self) -> Tokenizer:
         pass
@@ -43,6 +173,13 @@ class BaseCLIPTextualEncoder(InferenceModel):
     def tokenize(self, text: str, language: str | None = None) -> dict[str, NDArray[np.int32]]:
         pass
 
+    @abstractmethod
+    def tokenize_batch(
+        self, texts: list[str], language: str | None = None
+    ) -> list[tuple[list[int], dict[str, NDArray[np.int32]]]]:
+        """Returns the indices of the texts and their inputs for each group of texts with a similar length."""
+        pass
+
     @property
     def model_cfg_path(self) -> Path:
         return self.cache_dir / "config.json"
@@ -84,18 +221,41 @@ class BaseCLIPTextualEncoder(InferenceModel):
 
 class OpenClipTextualEncoder(BaseCLIPTextualEncoder):
     def _load_tokenizer(self) -> Tokenizer:
-        context_length: int = self.text_cfg.get("context_length", 77)
-        pad_token: str = self.tokenizer_cfg["pad_token"]
+        self.context_length: int = self.text_cfg.get("context_length", 77)
+        self.pad_token: str = self.tokenizer_cfg["pad_token"]
 
         tokenizer: Tokenizer = Tokenizer.from_file(self.tokenizer_file_path.as_posix())
 
-        pad_id: int = tokenizer.token_to_id(pad_token)
-        tokenizer.enable_padding(length=context_length, pad_token=pad_token, pad_id=pad_id)
-        tokenizer.enable_truncation(max_length=context_length)
+        self.pad_id: int = tokenizer.token_to_id(self.pad_token)
+        # with a dynamic sequence length, texts are only padded to the longest text in a batch
+        if not self.dynamic_length:
+            tokenizer.enable_padding(length=self.context_length, pad_token=self.pad_token, pad_id=self.pad_id)
+        tokenizer.enable_truncation(max_length=self.context_length)
 
         return tokenizer
 
     def tokenize(self, text: str, language: str | None = None) -> dict[str, NDArray[np.int32]]:
+        tokens: Encoding = self.tokenizer.encode(self._preprocess_text(text, language))
+        return self._to_inputs([tokens])
+
+    def tokenize_batch(
+        self, texts: list[str], language: str | None = None
+    ) -> list[tuple[list[int], dict[str, NDArray[np.int32]]]]:
+        encodings: list[Encoding] = self.tokenizer.encode_batch([self._preprocess_text(t, language) for t in texts])
+        buckets: dict[int, list[int]] = {}
+        for i, encoding in enumerate(encodings):
+            length = min(-(-len(encoding.ids) // TEXT_BUCKET_LENGTH) * TEXT_BUCKET_LENGTH, self.context_length)
+            buckets.setdefault(length, []).append(i)
+
+        batches: list[tuple[list[int], dict[str, NDArray[np.int32]]]] = []
+        for length, indices in sorted(buckets.items()):
+            bucket = [encodings[i] for i in indices]
+            for encoding in bucket:
+                encoding.pad(length, pad_id=self.pad_id, pad_token=self.pad_token)
+            batches.append((indices, self._to_inputs(bucket)))
+        return batches
+
+    def _preprocess_text(self, text: str, language: str | None) -> str:
         text = clean_text(text, canonicalize=self.canonicalize)
         if self.is_nllb and language is not None:
             flores_code = WEBLATE_TO_FLORES200.get(language)
@@ -106,15 +266,18 @@ class OpenClipTextualEncoder(BaseCLIPTextualEncoder):
                     log.warning(f"Language '{language}' not found, defaulting to 'en'")
                     flores_code = "eng_Latn"
             text = f"{flores_code}{text}"
-        tokens: Encoding = self.tokenizer.encode(text)
-        return {"text": np.array([tokens.ids], dtype=np.int32)}
+        return text
+
+    def _to_inputs(self, encodings: list[Encoding]) -> dict[str, NDArray[np.int32]]:
+        return {"text": np.array([tokens.ids for tokens in encodings], dtype=np.int32)}
 
 
 class MClipTextualEncoder(OpenClipTextualEncoder):
-    def tokenize(self, text: str, language: str | None = None) -> dict[str, NDArray[np.int32]]:
-        text = clean_text(text, canonicalize=self.canonicalize)
-        tokens: Encoding = self.tokenizer.encode(text)
+    def _preprocess_text(self, text: str, language: str | None) -> str:
+        return clean_text(text, canonicalize=self.canonicalize)
+
+    def _to_inputs(self, encodings: list[Encoding]) -> dict[str, NDArray[np.int32]]:
         return {
-            "input_ids": np.array([tokens.ids], dtype=np.int32),
-            "attention_mask": np.array([tokens.attention_mask], dtype=np.int32),
+            "input_ids": np.array([tokens.ids for tokens in encodings], dtype=np.int32),
+            "attention_mask": np.array([tokens.attention_mask for tokens in encodings], dtype=np.int32),
         }
@@ -1,6 +1,7 @@
 import json
+import threading
 from abc import abstractmethod
-from functools import cached_property
+from functools import cached_property, partial
 from pathlib import Path
 from typing import Any
 
@@ -8,33 +9,71 @@ import numpy as np
 from numpy.typing import NDArray
 from PIL import Image
 
-from immich_ml.config import log
+from immich_ml.config import log, settings
 from immich_ml.models.base import InferenceModel
+from immich_ml.models.constants import CLIP_BATCH_SIZE_DEFAULT
 from immich_ml.models.transforms import (
+    ImageContext,
     crop_pil,
     decode_pil,
+    derive,
     get_pil_resampling,
     normalize,
+    normalize_into,
+    resize_crop_pil,
     resize_pil,
     serialize_np_array,
     to_numpy,
 )
-from immich_ml.schemas import ModelSession, ModelTask, ModelType
+from immich_ml.schemas import EmbeddingFormat, ModelSession, ModelTask, ModelType
 
 
 class BaseCLIPVisualEncoder(InferenceModel):
     depends = []
     identity = (ModelType.VISUAL, ModelTask.SEARCH)
 
-    def _predict(self, inputs: Image.Image | bytes, **kwargs: Any) -> str:
-        image = decode_pil(inputs)
-        res: NDArray[np.float32] = self.session.run(None, self.transform(image))[0][0]
-        return serialize_np_array(res)
+    def __init__(self, model_name: str, **model_kwargs: Any) -> None:
+        super().__init__(model_name, **model_kwargs)
+        max_batch_size = settings.max_batch_size.clip if settings.max_batch_size else None
+        self.batch_size = max_batch_size if max_batch_size else CLIP_BATCH_SIZE_DEFAULT
+
+    def _predict(
+        self,
+        inputs: ImageContext | Image.Image | bytes,
+        embedding_format: EmbeddingFormat = EmbeddingFormat.JSON,
+        **kwargs: Any,
+    ) -> str:
+        res: NDArray[np.float32] = self.session.run(None, self.transform(self._decode(inputs)))[0][0]
+        return serialize_np_array(res, embedding_format)
+
+    def _predict_batch(
+        self,
+        batch: list[tuple[ImageContext | Image.Image | bytes]],
+        embedding_format: EmbeddingFormat = EmbeddingFormat.JSON,
+        **kwargs: Any,
+    ) -> list[str]:
+        if len(batch) == 1 or not self.has_batch_axis:
+            return super()._predict_batch(batch, embedding_format=embedding_format, **kwargs)
+        outputs: list[str] = []
+        for start in range(0, len(batch), self.batch_size):
+            images = self.transform_batch([self._decode(inputs) for inputs, in batch[start : start + self.batch_size]])
+            res: NDArray[np.float32] = self.session.run(None, {"image": images})[0]
+            outputs += [serialize_np_array(embedding, embedding_format) for embedding in res]
+        return outputs
+
+    def _warmup(self, batch_size: int) -> None:
+        self.session.run(None, self.transform(Image.new("RGB", (640, 480))))
+
+    def _decode(self, inputs: ImageContext | Image.Image | bytes) -> ImageContext | Image.Image:
+        return inputs if isinstance(inputs, ImageContext) else decode_pil(inputs)
 
     @abstractmethod
-    def transform(self, image: Image.Image) -> dict[str, NDArray[np.float32]]:
+    def transform(self, image: ImageContext | Image.Image) -> dict[str, NDArray[np.float32]]:
         pass
 
+    def transform_batch(self, images: list[ImageContext | Image.Image]) -> NDArray[np.float32]:
+        return np.concatenate([self.transform(image)["image"] for image in images])
+
     @property
     def model_cfg_path(self) -> Path:
         return self.cache_dir / "config.json"
@@ -59,6 +98,10 @@ class BaseCLIPVisualEncoder(InferenceModel):
 
 
 class OpenClipVisualEncoder(BaseCLIPVisualEncoder):
+    def __init__(self, model_name: str, **model_kwargs: Any) -> None:
+        super().__init__(model_name, **model_kwargs)
+        self._buffers = threading.local()
+
     def _load(self) -> ModelSession:
         size: list[int] | int = self.preprocess_cfg["size"]
         self.size = size[0] if isinstance(size, list) else size
@@ -69,9 +112,44 @@ class OpenClipVisualEncoder(BaseCLIPVisualEncoder):
 
         return super()._load()
 
-    def transform(self, image: Image.Image) -> dict[str, NDArray[np.float32]]:
-        image = resize_pil(image, self.size)
-        image = crop_pil(image, self.size)
-        image_np = to_numpy(image)
+    @property
+    def size_hint(self) -> int | None:
+        return self.size
+
+    def transform(self, image: ImageContext | Image.Image) -> dict[str, NDArray[np.float32]]:
+        if settings.fused_preprocessing:
+            buffer = self._get_buffer(1)
+            self._transform_into(image, buffer[0])
+            return {"image": buffer}
+        cropped = derive(image, ("resize_crop", self.size), self._resize_crop)
+        image_np = to_numpy(cropped)
         image_np = normalize(image_np, self.mean, self.std)
         return {"image": np.expand_dims(image_np.transpose(2, 0, 1), 0)}
+
+    def transform_batch(self, images: list[ImageContext | Image.Image]) -> NDArray[np.float32]:
+        if not settings.fused_preprocessing:
+            return super().transform_batch(images)
+        buffer = self._get_buffer(len(images))
+        for image, out in zip(images, buffer):
+            self._transform_into(image, out)
+        return buffer
+
+    def _transform_into(self, image: ImageContext | Image.Image, out: NDArray[np.float32]) -> None:
+        cropped = derive(image, ("resize_crop_box", self.size), partial(resize_crop_pil, size=self.size))
+        scale = np.reciprocal(self.std * 255).reshape(3, 1, 1)
+        offset = (-self.mean / self.std).reshape(3, 1, 1)
+        normalize_into(cropped, scale, offset, out)
+
+    # the buffer is reused by the next call on the same thread, so its contents must be consumed before then
+    def _get_buffer(self, batch_size: int) -> NDArray[np.float32]:
+        # batches larger than the chunk size get a temporary buffer so each thread keeps at most one chunk
+        if batch_size > self.batch_size:
+            return np.empty((batch_size, 3, self.size, self.size), dtype=np.float32)
+        buffer: NDArray[np.float32] | None = getattr(self._buffers, "image", None)
+        if buffer is None or buffer.shape[0] < batch_size or buffer.shape[2] != self.size:
+            buffer = np.empty((batch_size, 3, self.size, self.size), dtype=np.float32)
+            self._buffers.image = buffer
+        return buffer[:batch_size]
+
+    def _resize_crop(self, image: Image.Image) -> Image.Image:
+        return crop_pil(resize_pil(image, self.size), self.size)
@@ -85,6 +85,9 @@ SUPPORTED_PROVIDERS = [
 RKNN_SUPPORTED_SOCS = ["rk3566", "rk3568", "rk3576", "rk3588"]
 RKNN_COREMASK_SUPPORTED_SOCS = ["rk3576", "rk3588"]
 
+# images or texts run in one call by CLIP models, which bounds the memory used for their activations
+CLIP_BATCH_SIZE_DEFAULT = 32
+
 
 WEBLATE_TO_FLORES200 = {
     "af": "afr_Latn",
@@ -1,12 +1,26 @@
+from itertools import product
+from pathlib import Path
 from typing import Any
 
+import cv2
 import numpy as np
+import onnx
+import onnxruntime as ort
 from insightface.model_zoo import RetinaFace
 from numpy.typing import NDArray
+from onnx.tools.update_model_dims import update_inputs_outputs_dims
+from PIL import Image
 
+from immich_ml.config import log, settings
 from immich_ml.models.base import InferenceModel
-from immich_ml.models.transforms import decode_cv2
-from immich_ml.schemas import FaceDetectionOutput, ModelSession, ModelTask, ModelType
+from immich_ml.models.transforms import ImageContext, decode_cv2
+from immich_ml.schemas import FaceDetectionOutput, ModelFormat, ModelSession, ModelTask, ModelType
+from immich_ml.sessions.ort import save_model
+
+# faces up to this size are entirely inside at least one tile, larger ones are found by the pass over the whole image
+TILE_OVERLAP = 128
+# faces this close to an edge shared with another tile may be cut off, so they're left to the other tile
+TILE_MARGIN = 16
 
 
 class FaceDetector(InferenceModel):
@@ -15,27 +29,288 @@ class FaceDetector(InferenceModel):
 
     def __init__(self, model_name: str, min_score: float = 0.3, **model_kwargs: Any) -> None:
         self.min_score = model_kwargs.pop("minScore", min_score)
+        # anchor centers and strides of all outputs for each input size
+        self.anchors: dict[tuple[int, int], tuple[NDArray[np.float32], NDArray[np.float32]]] = {}
         super().__init__(model_name, **model_kwargs)
+        max_batch_size = settings.max_batch_size.face_detection if settings.max_batch_size else None
+        self.batch_size = max_batch_size if max_batch_size else self._batch_size_default
 
     def _load(self) -> ModelSession:
         session = self._make_session(self.model_path)
+        if self.batch_size > 1 and isinstance(session.get_inputs()[0].shape[0], int):
+            # a variant may be loaded instead of the model itself, which needs the batch axis too
+            assert self.session_path is not None
+            self._add_batch_axis(self.session_path)
+            session = self._make_session(self.model_path)
         self.model = RetinaFace(session=session)
         self.model.prepare(ctx_id=0, det_thresh=self.min_score, input_size=(640, 640))
 
         return session
 
-    def _predict(self, inputs: NDArray[np.uint8] | bytes, **kwargs: Any) -> FaceDetectionOutput:
+    def _predict(
+        self, inputs: ImageContext | NDArray[np.uint8] | bytes | Image.Image, tiled: bool = False, **kwargs: Any
+    ) -> FaceDetectionOutput:
         inputs = decode_cv2(inputs)
 
-        bboxes, landmarks = self._detect(inputs)
+        bboxes, landmarks = self._detect_tiled(inputs) if tiled else self._detect(inputs)
+        return self.postprocess(bboxes, landmarks)
+
+    def _predict_batch(
+        self,
+        batch: list[tuple[ImageContext | NDArray[np.uint8] | bytes | Image.Image]],
+        tiled: bool = False,
+        **kwargs: Any,
+    ) -> list[FaceDetectionOutput]:
+        # the tiles of each image are already run together
+        if tiled:
+            return [self._predict(inputs, tiled=True) for inputs, in batch]
+        detections = self._detect_batch([decode_cv2(inputs) for inputs, in batch])
+        return [self.postprocess(bboxes, landmarks) for bboxes, landmarks in detections]
+
+    def postprocess(self, bboxes: NDArray[np.float32], landmarks: NDArray[np.float32]) -> FaceDetectionOutput:
         return {
             "boxes": bboxes[:, :4].round(),
             "scores": bboxes[:, 4],
             "landmarks": landmarks,
         }
 
-    def _detect(self, inputs: NDArray[np.uint8] | bytes) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
-        return self.model.detect(inputs)  # type: ignore
+    def _warmup(self, batch_size: int) -> None:
+        width, height = self.model.input_size
+        self._detect(np.zeros((height, width, 3), dtype=np.uint8))
+
+    def _detect(self, image: NDArray[np.uint8]) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
+        return self._detect_batch([image])[0]
+
+    def _detect_batch(self, images: list[NDArray[np.uint8]]) -> list[tuple[NDArray[np.float32], NDArray[np.float32]]]:
+        width, height = self.model.input_size
+        det_imgs = np.zeros((len(images), height, width, 3), dtype=np.uint8)
+        scales = []
+        for image, det_img in zip(images, det_imgs):
+            # resized to fit into the model's input and padded at the bottom or right, like `RetinaFace.detect`
+            image_ratio = image.shape[0] / image.shape[1]
+            if image_ratio > height / width:
+                new_height, new_width = height, int(height / image_ratio)
+            else:
+                new_height, new_width = int(width * image_ratio), width
+            det_img[:new_height, :new_width] = cv2.resize(image, (new_width, new_height))
+            scales.append(new_height / image.shape[0])
+
+        detections = []
+        for (bboxes, landmarks), scale in zip(self._forward(det_imgs), scales):
+            bboxes[:, :4] /= scale
+            landmarks /= scale
+            # sorted before NMS like in `RetinaFace.detect`, which determines the order of boxes with the same score
+            order = bboxes[:, 4].argsort()[::-1]
+            bboxes, landmarks = bboxes[order], landmarks[order]
+            keep = self._nms(bboxes)
+            detections.append((bboxes[keep], landmarks[keep]))
+        return detections
+
+    def _detect_tiled(self, image: NDArray[np.uint8]) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
+        """
+        Detects faces in overlapping tiles of the image, downscaled to at most `face_detection_max_tiled_size` pixels,
+        in addition to the pass over the whole image. This finds faces that are too small to detect once the whole
+        image is resized to the model's input size, e.g. in group photos.
+        """
+        bboxes, landmarks = self._detect(image)
+        height, width = image.shape[:2]
+        tile_width, tile_height = self.model.input_size
+        scale = min(1.0, settings.face_detection_max_tiled_size / max(height, width))
+        if width * scale <= tile_width and height * scale <= tile_height:
+            return bboxes, landmarks  # the pass over the whole image already ran at this resolution
+        if scale < 1.0:
+            size = (round(width * scale), round(height * scale))
+            image = np.asarray(cv2.resize(image, size, interpolation=cv2.INTER_AREA), dtype=np.uint8)
+            height, width = image.shape[:2]
+
+        offsets = list(product(self._tile_offsets(height, tile_height), self._tile_offsets(width, tile_width)))
+        tiles = np.zeros((len(offsets), tile_height, tile_width, 3), dtype=np.uint8)
+        for tile, (y, x) in zip(tiles, offsets):
+            crop = image[y : y + tile_height, x : x + tile_width]
+            tile[: crop.shape[0], : crop.shape[1]] = crop
+
+        all_bboxes, all_landmarks = [bboxes], [landmarks]
+        for (tile_bboxes, tile_landmarks), (y, x) in zip(self._forward(tiles), offsets):
+            x1, y1, x2, y2 = tile_bboxes[:, :4].T
+            cut_off = (
+                ((x > 0) & (x1 < TILE_MARGIN))
+                | ((y > 0) & (y1 < TILE_MARGIN))
+                | ((x + tile_width < width) & (x2 > tile_width - TILE_MARGIN))
+                | ((y + tile_height < height) & (y2 > tile_height - TILE_MARGIN))
+            )
+            tile_bboxes, tile_landmarks = tile_bboxes[~cut_off], tile_landmarks[~cut_off]
+            tile_bboxes[:, :4] = (tile_bboxes[:, :4] + (x, y, x, y)) / scale
+            tile_landmarks = (tile_landmarks + (x, y)) / scale
+            all_bboxes.append(tile_bboxes)
+            all_landmarks.append(tile_landmarks)
+
+        merged_bboxes = np.concatenate(all_bboxes).astype(np.float32)
+        merged_landmarks = np.concatenate(all_landmarks).astype(np.float32)
+        keep = self._nms(merged_bboxes)
+        return merged_bboxes[keep], merged_landmarks[keep]
+
+    @staticmethod
+    def _tile_offsets(length: int, tile_length: int) -> list[int]:
+        if length <= tile_length:
+            return [0]
+        count = -(-(length - TILE_OVERLAP) // (tile_length - TILE_OVERLAP))
+        return np.linspace(0, length - tile_length, count).round().astype(int).tolist()  # type: ignore
+
+    def _forward(self, images: NDArray[np.uint8]) -> list[tuple[NDArray[np.float32], NDArray[np.float32]]]:
+        """
+        Runs the model on (N, H, W, 3) BGR images of its input size and returns the boxes with scores and the
+        landmarks above the minimum score for each image. If the model has a batch axis, the images are run in chunks
+        of up to `batch_size` images.
+        """
+        height, width = images.shape[1:3]
+        blob = np.ascontiguousarray(images[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32)
+        blob -= self.model.input_mean
+        blob *= np.float32(1 / self.model.input_std)
+
+        batch_size = (self.batch_size or len(blob)) if self.has_batch_axis else 1
+        detections = []
+        for start in range(0, len(blob), batch_size):
+            chunk = blob[start : start + batch_size]
+            # batched models return either (N, K, C) or (N * K, C) outputs
+            outputs = [output.reshape(len(chunk), -1, output.shape[-1]) for output in self._run(chunk)]
+            detections += [self._decode([output[i] for output in outputs], height, width) for i in range(len(chunk))]
+        return detections
+
+    def _run(self, blob: NDArray[np.float32]) -> list[NDArray[np.float32]]:
+        outputs: list[NDArray[np.float32]] = self.session.run(self.model.output_names, {self.model.input_name: blob})
+        return outputs
+
+    def _decode(
+        self, outputs: list[NDArray[np.float32]], height: int, width: int
+    ) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
+        """
+        Decodes the outputs of all strides at once, only for anchors with a score above the minimum score.
+        The results are the same as `RetinaFace.forward`, which decodes every anchor of each stride separately.
+        """
+        fmc = self.model.fmc
+        centers, strides = self._anchors(height, width)
+        scores = np.concatenate([output.reshape(-1) for output in outputs[:fmc]])
+        keep = np.flatnonzero(scores >= self.model.det_thresh)
+        centers, strides = centers[keep], strides[keep]
+
+        distances = np.concatenate([output.reshape(-1, 4) for output in outputs[fmc : fmc * 2]])[keep] * strides
+        bboxes = np.hstack([centers - distances[:, :2], centers + distances[:, 2:], scores[keep, None]])
+        num_landmarks = outputs[fmc * 2].shape[-1] // 2
+        offsets = np.concatenate([output.reshape(-1, num_landmarks * 2) for output in outputs[fmc * 2 :]])[keep]
+        landmarks = offsets.reshape(len(keep), num_landmarks, 2) * strides[:, None] + centers[:, None]
+        return bboxes, landmarks
+
+    def _anchors(self, height: int, width: int) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
+        if (height, width) not in self.anchors:
+            all_centers, all_strides = [], []
+            for stride in self.model._feat_stride_fpn:
+                grid = np.meshgrid(np.arange(width // stride), np.arange(height // stride))
+                centers = np.repeat(np.stack(grid, axis=-1).reshape(-1, 2) * stride, self.model._num_anchors, axis=0)
+                all_centers.append(centers)
+                all_strides.append(np.full((len(centers), 1), stride))
+            self.anchors[height, width] = (
+                np.concatenate(all_centers).astype(np.float32),
+                np.concatenate(all_strides).astype(np.float32),
+            )
+        return self.anchors[height, width]
+
+    def _nms(self, bboxes: NDArray[np.float32]) -> NDArray[np.intp]:
+        """
+        Returns the indices of the boxes kept by greedy non-maximum suppression, from the highest score to the lowest.
+        The same boxes are kept as with `RetinaFace.nms`, including its order for equal scores, but instead of
+        comparing each kept box to all remaining boxes, overlaps are only computed for pairs of boxes that are close
+        enough to suppress each other. This keeps it fast with the thousands of candidates that survive a low minimum
+        score.
+        """
+        if len(bboxes) == 0:
+            return np.empty(0, dtype=np.intp)
+        order = bboxes[:, 4].argsort()[::-1]
+        x1, y1, x2, y2 = bboxes[order, :4].T
+        # widths and heights include the last pixel like in `RetinaFace.nms`
+        widths, heights = x2 - x1 + 1, y2 - y1 + 1
+        areas = widths * heights
+
+        # two boxes can only overlap by more than the threshold if they still intersect after shrinking both by half
+        # the threshold on every side, slightly less to allow for rounding
+        shrink = np.float32(self.model.nms_thresh * 0.49)
+        first, second = self._intersecting_pairs(
+            x1 + widths * shrink, y1 + heights * shrink, x2 + 1 - widths * shrink, y2 + 1 - heights * shrink
+        )
+
+        width = np.maximum(0.0, np.minimum(x2[first], x2[second]) - np.maximum(x1[first], x1[second]) + 1)
+        height = np.maximum(0.0, np.minimum(y2[first], y2[second]) - np.maximum(y1[first], y1[second]) + 1)
+        intersection = width * height
+        overlapping = intersection / (areas[first] + areas[second] - intersection) > self.model.nms_thresh
+        first, second = first[overlapping], second[overlapping]
+
+        # a box can only be suppressed by a box with a higher score
+        higher, lower = np.minimum(first, second), np.maximum(first, second)
+        by_higher = np.argsort(higher, kind="stable")
+        lower = lower[by_higher]
+        bounds = np.searchsorted(higher[by_higher], np.arange(len(order) + 1)).tolist()
+        suppressed = np.zeros(len(order), dtype=bool)
+        keep = []
+        for i in range(len(order)):
+            if not suppressed[i]:
+                keep.append(i)
+                suppressed[lower[bounds[i] : bounds[i + 1]]] = True
+        return order[keep]
+
+    @staticmethod
+    def _intersecting_pairs(
+        x1: NDArray[np.float32], y1: NDArray[np.float32], x2: NDArray[np.float32], y2: NDArray[np.float32]
+    ) -> tuple[NDArray[np.intp], NDArray[np.intp]]:
+        """
+        Finds the pairs of boxes that may intersect, where `x2` and `y2` are exclusive. The boxes are added to each
+        horizontal band about as tall as a typical box that they're in, and are sorted by their left edge within each
+        band so that a box is only compared to the boxes in the same band that start before it ends.
+        """
+        band_height = max(float(np.median(y2 - y1)), 1.0)
+        first_band = np.floor(y1 / band_height).astype(np.intp)
+        band_counts = np.maximum(np.floor(y2 / band_height).astype(np.intp) - first_band + 1, 0)
+        boxes = np.repeat(np.arange(len(x1)), band_counts)
+        bands = np.repeat(first_band - np.cumsum(band_counts) + band_counts, band_counts) + np.arange(len(boxes))
+        by_band = np.lexsort((x1[boxes], bands))
+        boxes, bands = boxes[by_band], bands[by_band]
+
+        # sorted by band first, then by left edge
+        left = float(x1.min(initial=0))
+        span = float(x2.max(initial=0)) - left + 1
+        keys = bands * span + (x1[boxes] - left)
+        ends = np.searchsorted(keys, bands * span + (x2[boxes] - left), side="left")
+        starts = np.arange(1, len(keys) + 1)
+        counts = np.maximum(ends - starts, 0)
+        others = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        first, second = np.repeat(boxes, counts), boxes[others]
+
+        # pairs of boxes that are both in several bands are only kept for the first one
+        in_first_band = np.repeat(bands, counts) == np.maximum(first_band[first], first_band[second])
+        return first[in_first_band], second[in_first_band]
+
+    def _add_batch_axis(self, model_path: Path) -> None:
+        log.debug(f"Adding batch axis to model {model_path}")
+        proto = onnx.load(model_path)
+        input_dims = {
+            input.name: ["batch"] + [dim.dim_param or dim.dim_value for dim in input.type.tensor_type.shape.dim[1:]]
+            for input in proto.graph.input
+        }
+        # outputs are either (N, K, C) or flattened to (N * K, C), so their first axis is given a new name
+        output_dims = {
+            output.name: [-1] + [dim.dim_param or dim.dim_value for dim in output.type.tensor_type.shape.dim[1:]]
+            for output in proto.graph.output
+        }
+        updated_proto = update_inputs_outputs_dims(proto, input_dims, output_dims)
+        save_model(updated_proto, model_path)
+
+    @property
+    def _batch_size_default(self) -> int:
+        # each image is a full 640x640 input, so batches are limited unlike with facial recognition
+        providers = ort.get_available_providers()
+        return 8 if self.model_format == ModelFormat.ONNX and "OpenVINOExecutionProvider" not in providers else 1
+
+    @property
+    def size_hint(self) -> int | None:
+        return int(max(self.model.input_size))
 
     def configure(self, **kwargs: Any) -> None:
         self.model.det_thresh = kwargs.pop("minScore", self.model.det_thresh)
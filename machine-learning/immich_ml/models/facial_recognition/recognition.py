@@ -1,19 +1,21 @@
 from pathlib import Path
 from typing import Any
 
+import cv2
 import numpy as np
 import onnx
 import onnxruntime as ort
 from insightface.model_zoo import ArcFaceONNX
-from insightface.utils.face_align import norm_crop
+from insightface.utils.face_align import arcface_dst
 from numpy.typing import NDArray
 from onnx.tools.update_model_dims import update_inputs_outputs_dims
 from PIL import Image
 
 from immich_ml.config import log, settings
 from immich_ml.models.base import InferenceModel
-from immich_ml.models.transforms import decode_cv2, serialize_np_array
+from immich_ml.models.transforms import ImageContext, decode_cv2, estimate_similarity_transforms, serialize_np_array
 from immich_ml.schemas import (
+    EmbeddingFormat,
     FaceDetectionOutput,
     FacialRecognitionOutput,
     ModelFormat,
@@ -21,6 +23,7 @@ from immich_ml.schemas import (
     ModelTask,
     ModelType,
 )
+from immich_ml.sessions.ort import save_model
 
 
 class FaceRecognizer(InferenceModel):
@@ -35,7 +38,9 @@ class FaceRecognizer(InferenceModel):
     def _load(self) -> ModelSession:
         session = self._make_session(self.model_path)
         if (not self.batch_size or self.batch_size > 1) and str(session.get_inputs()[0].shape[0]) != "batch":
-            self._add_batch_axis(self.model_path)
+            # a variant may be loaded instead of the model itself, which needs the batch axis too
+            assert self.session_path is not None
+            self._add_batch_axis(self.session_path)
             session = self._make_session(self.model_path)
         self.model = ArcFaceONNX(
             self.model_path_for_format(ModelFormat.ONNX).as_posix(),
@@ -44,37 +49,120 @@ class FaceRecognizer(InferenceModel):
         return session
 
     def _predict(
-        self, inputs: NDArray[np.uint8] | bytes | Image.Image, faces: FaceDetectionOutput, **kwargs: Any
+        self,
+        inputs: ImageContext | NDArray[np.uint8] | bytes | Image.Image,
+        faces: FaceDetectionOutput,
+        embedding_format: EmbeddingFormat = EmbeddingFormat.JSON,
+        **kwargs: Any,
     ) -> FacialRecognitionOutput:
         if faces["boxes"].shape[0] == 0:
             return []
         inputs = decode_cv2(inputs)
         cropped_faces = self._crop(inputs, faces)
-        embeddings = self._predict_batch(cropped_faces)
-        return self.postprocess(faces, embeddings)
+        embeddings = self._get_embeddings(cropped_faces)
+        return self.postprocess(faces, embeddings, embedding_format)
 
-    def _predict_batch(self, cropped_faces: list[NDArray[np.uint8]]) -> NDArray[np.float32]:
-        if not self.batch_size or len(cropped_faces) <= self.batch_size:
-            embeddings: NDArray[np.float32] = self.model.get_feat(cropped_faces)
-            return embeddings
+    def _predict_batch(
+        self,
+        batch: list[tuple[ImageContext | NDArray[np.uint8] | bytes | Image.Image, FaceDetectionOutput]],
+        embedding_format: EmbeddingFormat = EmbeddingFormat.JSON,
+        **kwargs: Any,
+    ) -> list[FacialRecognitionOutput]:
+        counts = [faces["boxes"].shape[0] for _, faces in batch]
+        if not sum(counts):
+            return [[] for _ in batch]
 
-        batch_embeddings: list[NDArray[np.float32]] = []
-        for i in range(0, len(cropped_faces), self.batch_size):
-            batch_embeddings.append(self.model.get_feat(cropped_faces[i : i + self.batch_size]))
-        return np.concatenate(batch_embeddings, axis=0)
+        # faces from every image are aligned into one array so they can be embedded together
+        cropped_faces = self._empty_crops(sum(counts))
+        start = 0
+        for (inputs, faces), count in zip(batch, counts):
+            if count > 0:
+                self._crop(decode_cv2(inputs), faces, out=cropped_faces[start : start + count])
+            start += count
 
-    def postprocess(self, faces: FaceDetectionOutput, embeddings: NDArray[np.float32]) -> FacialRecognitionOutput:
+        embeddings = self._get_embeddings(cropped_faces)
+        outputs: list[FacialRecognitionOutput] = []
+        start = 0
+        for (_, faces), count in zip(batch, counts):
+            outputs.append(self.postprocess(faces, embeddings[start : start + count], embedding_format))
+            start += count
+        return outputs
+
+    def _warmup(self, batch_size: int) -> None:
+        width, height = self.model.input_size
+        self._get_embeddings(np.zeros((batch_size, height, width, 3), dtype=np.uint8))
+
+    @property
+    def _warmup_batch_sizes(self) -> list[int]:
+        # larger batches are split into chunks of the maximum batch size anyway
+        if self.batch_size:
+            return sorted({min(batch_size, self.batch_size) for batch_size in settings.model_warmup_batch_sizes})
+        return settings.model_warmup_batch_sizes
+
+    def _get_embeddings(self, cropped_faces: NDArray[np.uint8]) -> NDArray[np.float32]:
+        blob = self._normalize(cropped_faces)
+        if not self.batch_size or len(blob) <= self.batch_size:
+            return self._run(blob)
+
+        # sessions may reuse their output arrays between calls, so each chunk is copied out before the next one
+        first = self._run(blob[: self.batch_size])
+        embeddings = np.empty((len(blob), *first.shape[1:]), dtype=first.dtype)
+        embeddings[: self.batch_size] = first
+        for i in range(self.batch_size, len(blob), self.batch_size):
+            embeddings[i : i + self.batch_size] = self._run(blob[i : i + self.batch_size])
+        return embeddings
+
+    def _run(self, blob: NDArray[np.float32]) -> NDArray[np.float32]:
+        embeddings: NDArray[np.float32] = self.session.run(self.model.output_names, {self.model.input_name: blob})[0]
+        return embeddings
+
+    def _normalize(self, cropped_faces: NDArray[np.uint8]) -> NDArray[np.float32]:
+        """
+        Converts (N, H, W, 3) BGR crops to the (N, 3, H, W) normalized RGB batch the model expects, like
+        `ArcFaceONNX.get_feat` does for a list of crops, but in one vectorized pass over the whole batch.
+        """
+
+        blob = np.empty((len(cropped_faces), 3, *cropped_faces.shape[1:3]), dtype=np.float32)
+        pixels = cropped_faces[..., ::-1].transpose(0, 3, 1, 2)
+        np.multiply(pixels, np.float32(1 / self.model.input_std), out=blob)
+        if self.model.input_mean:
+            blob -= np.float32(self.model.input_mean / self.model.input_std)
+        return blob
+
+    def postprocess(
+        self,
+        faces: FaceDetectionOutput,
+        embeddings: NDArray[np.float32],
+        embedding_format: EmbeddingFormat = EmbeddingFormat.JSON,
+    ) -> FacialRecognitionOutput:
         return [
             {
                 "boundingBox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
-                "embedding": serialize_np_array(embedding),
+                "embedding": serialize_np_array(embedding, embedding_format),
                 "score": score,
             }
             for (x1, y1, x2, y2), embedding, score in zip(faces["boxes"], embeddings, faces["scores"])
         ]
 
-    def _crop(self, image: NDArray[np.uint8], faces: FaceDetectionOutput) -> list[NDArray[np.uint8]]:
-        return [norm_crop(image, landmark) for landmark in faces["landmarks"]]
+    def _crop(
+        self, image: NDArray[np.uint8], faces: FaceDetectionOutput, out: NDArray[np.uint8] | None = None
+    ) -> NDArray[np.uint8]:
+        """
+        Aligns each face to the reference landmarks, like insightface's `norm_crop`, but estimates every transform in
+        one pass and warps each face directly into `out`, which has a shape of (N, H, W, 3).
+        """
+
+        width, height = self.model.input_size
+        if out is None:
+            out = self._empty_crops(len(faces["landmarks"]))
+        transforms = estimate_similarity_transforms(faces["landmarks"], arcface_dst * (width / 112))
+        for transform, crop in zip(transforms, out):
+            cv2.warpAffine(image, transform, (width, height), dst=crop, borderValue=0.0)
+        return out
+
+    def _empty_crops(self, count: int) -> NDArray[np.uint8]:
+        width, height = self.model.input_size
+        return np.empty((count, height, width, 3), dtype=np.uint8)
 
     def _add_batch_axis(self, model_path: Path) -> None:
         log.debug(f"Adding batch axis to model {model_path}")
@@ -84,7 +172,7 @@ class FaceRecognizer(InferenceModel):
         input_dims = {proto.graph.input[0].name: ["batch"] + static_input_dims}
         output_dims = {proto.graph.output[0].name: ["batch"] + static_output_dims}
         updated_proto = update_inputs_outputs_dims(proto, input_dims, output_dims)
-        onnx.save(updated_proto, model_path)
+        save_model(updated_proto, model_path)
 
     @property
     def _batch_size_default(self) -> int | None:
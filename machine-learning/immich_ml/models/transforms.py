@@ -1,6 +1,10 @@
+import base64
 import string
+import threading
 from io import BytesIO
-from typing import IO
+from mmap import ACCESS_READ, mmap
+from tempfile import SpooledTemporaryFile
+from typing import IO, Any, Callable, Hashable, TypeVar
 
 import cv2
 import numpy as np
@@ -8,10 +12,54 @@ import orjson
 from numpy.typing import NDArray
 from PIL import Image
 
+from immich_ml.metrics import time_stage
+from immich_ml.schemas import EmbeddingFormat
+
+_T = TypeVar("_T")
 _PIL_RESAMPLING_METHODS = {resampling.name.lower(): resampling for resampling in Image.Resampling}
 _PUNCTUATION_TRANS = str.maketrans("", "", string.punctuation)
 
 
+class ImageContext:
+    """
+    Holds a decoded image for the duration of a request, along with any representations derived from it.
+
+    Each representation is computed once on first use and shared by all models that ask for it with the same key.
+    """
+
+    def __init__(self, image: Image.Image) -> None:
+        self.image = image
+        self.conversions = 0
+        self._derived: dict[Hashable, Any] = {}
+        self._locks: dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def width(self) -> int:
+        return self.image.width
+
+    @property
+    def height(self) -> int:
+        return self.image.height
+
+    def derive(self, key: Hashable, func: Callable[[Image.Image], _T]) -> _T:
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        # models may run concurrently on the same image, so the first caller computes and the others wait for it
+        with key_lock:
+            if key not in self._derived:
+                self._derived[key] = func(self.image)
+                self.conversions += 1
+            derived: _T = self._derived[key]
+            return derived
+
+
+def derive(image: Image.Image | ImageContext, key: Hashable, func: Callable[[Image.Image], _T]) -> _T:
+    if isinstance(image, ImageContext):
+        return image.derive(key, func)
+    return func(image)
+
+
 def resize_pil(img: Image.Image, size: int) -> Image.Image:
     if img.width < img.height:
         return img.resize((size, int((img.height / img.width) * size)), resample=Image.Resampling.BICUBIC)
@@ -29,6 +77,54 @@ def crop_pil(img: Image.Image, size: int) -> Image.Image:
     return img.crop((left, upper, right, lower))
 
 
+# the region of the original image that `crop_pil(resize_pil(img, size), size)` keeps
+def center_crop_box(img: Image.Image, size: int) -> tuple[float, float, float, float]:
+    if img.width < img.height:
+        width, height = size, int((img.height / img.width) * size)
+    else:
+        width, height = int((img.width / img.height) * size), size
+    left = int((width / 2) - (size / 2))
+    upper = int((height / 2) - (size / 2))
+    scale_x, scale_y = img.width / width, img.height / height
+    return (left * scale_x, upper * scale_y, (left + size) * scale_x, (upper + size) * scale_y)
+
+
+# resizes only the part of the image that would be kept by cropping afterwards
+def resize_crop_pil(img: Image.Image, size: int) -> Image.Image:
+    return img.resize((size, size), resample=Image.Resampling.BICUBIC, box=center_crop_box(img, size))
+
+
+# equivalent to `normalize(to_numpy(img), mean, std).transpose(2, 0, 1)`, but with /255, mean and std folded into
+# one scale and offset per channel, and without any temporary float arrays
+def normalize_into(
+    img: Image.Image, scale: NDArray[np.float32], offset: NDArray[np.float32], out: NDArray[np.float32]
+) -> NDArray[np.float32]:
+    pixels = np.asarray(img if img.mode == "RGB" else img.convert("RGB")).transpose(2, 0, 1)
+    np.multiply(pixels, scale, out=out)
+    out += offset
+    return out
+
+
+# least-squares rotation, uniform scale and translation from each set of points in `src` (N, K, 2) to `dst` (K, 2),
+# like skimage's `SimilarityTransform.estimate`, but for all sets in one pass
+def estimate_similarity_transforms(src: NDArray[np.float32], dst: NDArray[np.float32]) -> NDArray[np.float64]:
+    src_mean = src.mean(axis=1, keepdims=True, dtype=np.float64)
+    dst_mean = dst.mean(axis=0, dtype=np.float64)
+    src_centered = src - src_mean
+    dst_centered = dst - dst_mean
+    variance = (src_centered**2).sum(axis=(1, 2))
+    # the transform is [[a, -b], [b, a]] scaled rotation plus a translation
+    a = (src_centered * dst_centered).sum(axis=(1, 2)) / variance
+    b = (src_centered[..., 0] * dst_centered[:, 1] - src_centered[..., 1] * dst_centered[:, 0]).sum(axis=1) / variance
+    transforms = np.empty((len(src), 2, 3), dtype=np.float64)
+    transforms[:, 0, 0] = a
+    transforms[:, 0, 1] = -b
+    transforms[:, 1, 0] = b
+    transforms[:, 1, 1] = a
+    transforms[:, :, 2] = dst_mean - (transforms[:, :, :2] @ src_mean.transpose(0, 2, 1))[..., 0]
+    return transforms
+
+
 def to_numpy(img: Image.Image) -> NDArray[np.float32]:
     return np.asarray(img if img.mode == "RGB" else img.convert("RGB"), dtype=np.float32) / 255.0
 
@@ -47,22 +143,41 @@ def pil_to_cv2(image: Image.Image) -> NDArray[np.uint8]:
     return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)  # type: ignore
 
 
-def decode_pil(image_bytes: bytes | IO[bytes] | Image.Image) -> Image.Image:
+def decode_pil(image_bytes: bytes | IO[bytes] | Image.Image | ImageContext, size: int | None = None) -> Image.Image:
     if isinstance(image_bytes, Image.Image):
         return image_bytes
+    if isinstance(image_bytes, ImageContext):
+        return image_bytes.image
     image: Image.Image = Image.open(BytesIO(image_bytes) if isinstance(image_bytes, bytes) else image_bytes)
+    if size is not None and image.format == "JPEG":
+        # decodes at the smallest 1/2, 1/4 or 1/8 scale where both sides are still at least `size`
+        image.draft("RGB", (size, size))
     image.load()
     if not image.mode == "RGB":
         image = image.convert("RGB")
     return image
 
 
-def decode_cv2(image_bytes: NDArray[np.uint8] | bytes | Image.Image) -> NDArray[np.uint8]:
+# avoids copying uploads into a new bytes object by decoding directly from the in-memory buffer,
+# or from a memory map of the file if it was spooled to disk
+def decode_upload(file: IO[bytes], size: int | None = None) -> Image.Image:
+    if isinstance(file, SpooledTemporaryFile):
+        file = file._file
+    file.seek(0)
+    if isinstance(file, BytesIO):
+        return decode_pil(file, size)
+    with mmap(file.fileno(), 0, access=ACCESS_READ) as mapped:
+        return decode_pil(mapped, size)  # type: ignore
+
+
+def decode_cv2(image_bytes: NDArray[np.uint8] | bytes | Image.Image | ImageContext) -> NDArray[np.uint8]:
     match image_bytes:
         case bytes() | memoryview() | bytearray():
             return pil_to_cv2(decode_pil(image_bytes))  # pillow is much faster than cv2
         case Image.Image():
             return pil_to_cv2(image_bytes)
+        case ImageContext():
+            return image_bytes.derive("bgr", pil_to_cv2)
         case _:
             return image_bytes
 
@@ -76,5 +191,12 @@ def clean_text(text: str, canonicalize: bool = False) -> str:
 
 # this allows the client to use the array as a string without deserializing only to serialize back to a string
 # TODO: use this in a less invasive way
-def serialize_np_array(arr: NDArray[np.float32]) -> str:
-    return orjson.dumps(arr, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+def serialize_np_array(arr: NDArray[np.float32], embedding_format: EmbeddingFormat = EmbeddingFormat.JSON) -> str:
+    with time_stage("serialize"):
+        match embedding_format:
+            case EmbeddingFormat.JSON:
+                return orjson.dumps(arr, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+            case EmbeddingFormat.FLOAT32:
+                return base64.b64encode(arr.astype("<f4", copy=False).tobytes()).decode()
+            case EmbeddingFormat.FLOAT16:
+                return base64.b64encode(arr.astype("<f2").tobytes()).decode()
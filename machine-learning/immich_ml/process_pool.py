@@ -0,0 +1,207 @@
+"""
+Runs whole requests in worker processes so preprocessing and serialization aren't limited by the GIL.
+
+The main process parses requests and passes the uploaded bytes to a worker through shared memory. The worker decodes
+them, runs each requested model with the same pipeline as the main process and writes the serialized response back to
+shared memory, so only small messages are pickled. Each worker loads its own models. Data that doesn't fit into the
+free space of /dev/shm is pickled instead, since writing past it kills the process with SIGBUS.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Sequence
+
+import orjson
+
+from .config import log, settings
+from .profiling import request_timings, time_request
+from .schemas import InferenceEntries
+
+SHARED_MEMORY_PATH = "/dev/shm"
+# left free for blocks created concurrently by other processes
+SHARED_MEMORY_HEADROOM = 16 * 2**20
+
+# event loop of a worker process, kept between requests so model cache expiry timers keep working
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def fits_shared(size: int) -> bool:
+    """
+    Whether a block of this size can be written to shared memory. Creating a block always succeeds since tmpfs
+    allocates pages lazily, so this is checked up front.
+    """
+
+    try:
+        stat = os.statvfs(SHARED_MEMORY_PATH)
+    except OSError:  # e.g. on macOS, where shared memory isn't backed by a file system with a size limit
+        return True
+    return size + SHARED_MEMORY_HEADROOM <= stat.f_bavail * stat.f_frsize
+
+
+def write_shared(chunks: Sequence[bytes]) -> tuple[str, list[int]]:
+    """Copies the chunks into a new shared memory block, returning its name and the chunk lengths."""
+
+    lengths = [len(chunk) for chunk in chunks]
+    shm = SharedMemory(create=True, size=max(sum(lengths), 1))
+    try:
+        buf = shm.buf
+        assert buf is not None
+        offset = 0
+        for chunk in chunks:
+            buf[offset : offset + len(chunk)] = chunk
+            offset += len(chunk)
+    finally:
+        shm.close()
+    return shm.name, lengths
+
+
+def read_shared(name: str, lengths: list[int], unlink: bool = False) -> list[bytes]:
+    shm = SharedMemory(name=name)
+    try:
+        buf = shm.buf
+        assert buf is not None
+        chunks = []
+        offset = 0
+        for length in lengths:
+            chunks.append(bytes(buf[offset : offset + length]))
+            offset += length
+        return chunks
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+class InferenceProcessPool:
+    def __init__(self, processes: int) -> None:
+        self.processes = processes
+        self.executor = self._create_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # fork isn't safe with the threads started by ONNX Runtime and the event loop
+        return ProcessPoolExecutor(
+            self.processes, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+        )
+
+    async def start(self) -> None:
+        """
+        Starts every worker and waits for them to preload their models, so failures surface at startup rather than
+        in the first requests. Workers are only started when no worker is idle, and starting one takes much longer
+        than submitting the tasks, so each task starts its own worker.
+        """
+
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*[loop.run_in_executor(self.executor, os.getpid) for _ in range(self.processes)])
+        log.info(f"Started {len(set(pids))} inference processes.")
+
+    async def predict(
+        self,
+        entries: InferenceEntries,
+        images: Sequence[bytes] | None = None,
+        texts: Sequence[str] | None = None,
+        batch: bool = False,
+    ) -> tuple[bytes, dict[str, float]]:
+        """Returns the serialized response along with the time spent in each stage by the worker."""
+
+        name: str | None = None
+        lengths: list[int] = []
+        if images and fits_shared(sum(len(image) for image in images)):
+            name, lengths = write_shared(images)
+        elif images:
+            log.warning("Not enough space in /dev/shm for the uploaded images, passing them to the worker directly")
+        executor = self.executor
+        try:
+            loop = asyncio.get_running_loop()
+            output, timings = await loop.run_in_executor(
+                executor,
+                _predict,
+                name,
+                lengths,
+                texts,
+                entries,
+                batch,
+                time.perf_counter(),
+                images if images and name is None else None,
+            )
+        except BrokenProcessPool:
+            # the pool can't run any more tasks once a worker exits unexpectedly, so later requests get a new one
+            if executor is self.executor:
+                log.error("An inference process exited unexpectedly, restarting the process pool")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self._create_executor()
+            raise
+        finally:
+            if name is not None:
+                shm = SharedMemory(name=name)
+                shm.close()
+                shm.unlink()
+        if isinstance(output, bytes):
+            return output, timings
+        output_name, output_length = output
+        return read_shared(output_name, [output_length], unlink=True)[0], timings
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
+
+
+def _init_worker() -> None:
+    global _loop
+    from . import main
+
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    if settings.preload is not None:
+        _loop.run_until_complete(main.preload_models(settings.preload))
+
+
+def _predict(
+    name: str | None,
+    lengths: list[int],
+    texts: Sequence[str] | None,
+    entries: InferenceEntries,
+    batch: bool,
+    submitted: float,
+    images: Sequence[bytes] | None = None,
+) -> tuple[tuple[str, int] | bytes, dict[str, float]]:
+    """
+    Runs a request with images from shared memory, or `images` if they didn't fit there. The response is returned as
+    the name and length of a shared memory block, or as bytes if it doesn't fit.
+    """
+
+    from . import main
+
+    assert _loop is not None
+    with request_timings() as timings:
+        # perf_counter is system-wide on Linux, so it can be compared between processes
+        timings["process-queue"] = time.perf_counter() - submitted
+        payloads: Sequence[Any]
+        if name is not None:
+            size = _loop.run_until_complete(main.get_size_hint(entries))
+            payloads = [main.decode(BytesIO(image), size) for image in read_shared(name, lengths)]
+        elif images is not None:
+            size = _loop.run_until_complete(main.get_size_hint(entries))
+            payloads = [main.decode(BytesIO(image), size) for image in images]
+        else:
+            payloads = texts or []
+
+        if batch:
+            response: Any = _loop.run_until_complete(main.run_batch_inference(payloads, entries))
+        else:
+            response = _loop.run_until_complete(main.run_inference(payloads[0], entries))
+
+        with time_request("process-serialize"):
+            body = orjson.dumps(response, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        output: tuple[str, int] | bytes = body
+        if fits_shared(len(body)):
+            output_name, output_lengths = write_shared([body])
+            output = (output_name, output_lengths[0])
+    log.debug(f"Ran request in worker process with timings {timings}")
+    return output, timings
@@ -0,0 +1,103 @@
+"""Per-request timing for the `Server-Timing` header and sampled cProfile traces of requests."""
+
+from __future__ import annotations
+
+import cProfile
+import pstats
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Iterator, TypeVar
+
+from .config import log, settings
+
+_T = TypeVar("_T")
+
+# time spent in each stage of the current request, shared with the threads it runs work in
+_request_timings: ContextVar[dict[str, float] | None] = ContextVar("request_timings", default=None)
+# profiles of the work done in other threads for the current request, if it's being profiled
+_request_profiles: ContextVar[list[cProfile.Profile] | None] = ContextVar("request_profiles", default=None)
+
+
+@contextmanager
+def request_timings() -> Iterator[dict[str, float]]:
+    timings: dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def add_request_timing(name: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def merge_request_timings(other: dict[str, float]) -> None:
+    for name, seconds in other.items():
+        add_request_timing(name, seconds)
+
+
+def get_request_timings() -> dict[str, float] | None:
+    return _request_timings.get()
+
+
+@contextmanager
+def time_request(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_request_timing(name, time.perf_counter() - start)
+
+
+def format_server_timing(timings: dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+
+
+@contextmanager
+def profile_request(name: str) -> Iterator[None]:
+    """Profiles a sample of requests with cProfile, writing the combined stats of all of their threads to a file."""
+
+    if settings.profile_sample_rate <= 0 or random.random() >= settings.profile_sample_rate:
+        yield
+        return
+
+    profiles: list[cProfile.Profile] = []
+    token = _request_profiles.set(profiles)
+    try:
+        yield
+    finally:
+        _request_profiles.reset(token)
+        if profiles:
+            path = profile_dir() / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof"
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+            log.info(f"Wrote request profile to {path}")
+
+
+def run_profiled(func: Callable[..., _T], *args: Any, **kwargs: Any) -> _T:
+    profiles = _request_profiles.get()
+    if profiles is None:
+        return func(*args, **kwargs)
+    # cProfile only profiles the thread it's enabled in, so each call in a thread gets its own profile
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        profiles.append(profile)
+
+
+def profile_dir() -> Path:
+    path = settings.cache_folder / "profiles"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
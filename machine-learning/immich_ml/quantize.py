@@ -0,0 +1,231 @@
+"""
+Creates reduced-precision variants of ONNX models, which are loaded instead of the original when selected with
+MACHINE_LEARNING_MODEL_PRECISION__<TYPE>, and reports how much faster they are and how far their embeddings drift.
+
+Usage: python -m immich_ml.quantize MODEL_NAME [MODEL_NAME ...] [--precisions int8 fp16]
+    [--types visual textual recognition] [--images DIR] [--samples 32] [--report PATH]
+
+Models are downloaded if needed. The variants are written to e.g. `<cache folder>/clip/<model>/visual/int8/`.
+Without `--images`, synthetic images are used, which are enough to compare speed but not a good sample for accuracy.
+Recognition models are compared on whole images resized to their input size rather than aligned faces.
+"""
+
+from __future__ import annotations
+
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Iterable
+
+import cv2
+import numpy as np
+import onnx
+from numpy.typing import NDArray
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from onnxruntime.transformers.float16 import convert_float_to_float16
+from PIL import Image
+
+from .config import log
+from .models import from_model_type
+from .models.base import InferenceModel
+from .models.clip.textual import BaseCLIPTextualEncoder
+from .models.clip.visual import BaseCLIPVisualEncoder
+from .models.facial_recognition.recognition import FaceRecognizer
+from .schemas import ModelFormat, ModelPrecision, ModelTask, ModelType
+
+# protobuf can't serialize models larger than this in a single file
+MAX_PROTOBUF_SIZE = 2**31 - 1
+
+# ops that run faster with dynamically quantized weights on CPU; ConvInteger is usually slower than a float Conv
+INT8_OP_TYPES = ["MatMul", "Attention", "Gather"]
+
+SAMPLE_TEXTS = [
+    "a photo of a dog",
+    "two cats sleeping on a couch",
+    "sunset over the ocean",
+    "a birthday cake with candles",
+    "people hiking in the mountains",
+    "a red car parked on the street",
+    "snow covered trees in winter",
+    "a plate of pasta",
+    "children playing in a park",
+    "the eiffel tower at night",
+    "a screenshot of a document",
+    "a bride and groom at their wedding",
+    "fireworks in the sky",
+    "a close-up of a flower",
+    "a crowded beach in summer",
+    "an old black and white photo",
+]
+
+TASKS = {
+    ModelType.VISUAL: ModelTask.SEARCH,
+    ModelType.TEXTUAL: ModelTask.SEARCH,
+    ModelType.RECOGNITION: ModelTask.FACIAL_RECOGNITION,
+}
+
+
+def quantize_model(model_path: Path, output_path: Path, model_precision: ModelPrecision) -> None:
+    """Writes a variant of the ONNX model at `model_path` with the given precision to `output_path`."""
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_suffix(".onnx.tmp")
+    use_external_data = _model_size(model_path) > MAX_PROTOBUF_SIZE
+    match model_precision:
+        case ModelPrecision.INT8:
+            quantize_dynamic(
+                model_path,
+                tmp_path,
+                op_types_to_quantize=INT8_OP_TYPES,
+                weight_type=QuantType.QInt8,
+                use_external_data_format=use_external_data,
+            )
+        case ModelPrecision.FP16:
+            # inputs and outputs stay in FP32 so the model is a drop-in replacement
+            proto = convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+            onnx.save(
+                proto,
+                tmp_path,
+                save_as_external_data=use_external_data,
+                location=f"{output_path.name}.data",
+            )
+        case _:
+            raise ValueError(f"Unsupported precision for quantization: {model_precision}")
+    tmp_path.replace(output_path)
+
+
+def cosine_similarity(a: NDArray[np.float32], b: NDArray[np.float32]) -> NDArray[np.float32]:
+    a = a / np.linalg.norm(a, axis=-1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=-1, keepdims=True)
+    similarity: NDArray[np.float32] = (a * b).sum(axis=-1)
+    return similarity
+
+
+def compare(reference: InferenceModel, variant: InferenceModel, samples: list[Any], runs: int = 1) -> dict[str, float]:
+    """Compares the speed and embeddings of a variant against the reference model on the same samples."""
+
+    reference_embeddings, reference_seconds = _embed(reference, samples, runs)
+    variant_embeddings, variant_seconds = _embed(variant, samples, runs)
+    similarity = cosine_similarity(reference_embeddings, variant_embeddings)
+    return {
+        "reference_ms": reference_seconds / len(samples) * 1000,
+        "variant_ms": variant_seconds / len(samples) * 1000,
+        "speedup": reference_seconds / variant_seconds,
+        "cosine_mean": float(similarity.mean()),
+        "cosine_min": float(similarity.min()),
+    }
+
+
+def load_samples(model_type: ModelType, count: int, image_dir: Path | None = None) -> list[Any]:
+    if model_type == ModelType.TEXTUAL:
+        return [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] for i in range(count)]
+    if image_dir is not None:
+        paths = sorted(path for path in image_dir.iterdir() if path.suffix.lower() in {".jpg", ".jpeg", ".png"})
+        images = [Image.open(path).convert("RGB") for path in paths[:count]]
+    else:
+        images = list(_synthetic_images(count))
+    if model_type == ModelType.RECOGNITION:
+        return [cv2.resize(np.asarray(image)[:, :, ::-1], (112, 112)) for image in images]
+    return images
+
+
+def _embed(model: InferenceModel, samples: list[Any], runs: int) -> tuple[NDArray[np.float32], float]:
+    embed = _get_embed_func(model)
+    embed(samples[0])  # warm-up
+    start = perf_counter()
+    for _ in range(runs):
+        embeddings = np.stack([embed(sample) for sample in samples])
+    return embeddings, (perf_counter() - start) / runs
+
+
+# outputs are copied since the session may reuse its output buffers for the next call with IO binding
+def _get_embed_func(model: InferenceModel) -> Callable[[Any], NDArray[np.float32]]:
+    if isinstance(model, BaseCLIPVisualEncoder):
+        return lambda image: model.session.run(None, model.transform(image))[0][0].copy()
+    if isinstance(model, BaseCLIPTextualEncoder):
+        return lambda text: model.session.run(None, model.tokenize(text))[0][0].copy()
+    if isinstance(model, FaceRecognizer):
+        return lambda face: model._get_embeddings(face[None])[0].copy()
+    raise ValueError(f"Unsupported model type for comparison: {model.model_type}")
+
+
+def _synthetic_images(count: int) -> Iterable[Image.Image]:
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:480, 0:640]
+    for _ in range(count):
+        # smooth gradients with some noise, which are closer to photos than pure noise
+        freq = rng.uniform(0.005, 0.05, 3)
+        phase = rng.uniform(0, np.pi, 3)
+        channels = [np.sin(x * f + p) * np.cos(y * f - p) for f, p in zip(freq, phase)]
+        pixels = (np.stack(channels, axis=-1) + 1) * 112 + rng.normal(0, 8, (480, 640, 3))
+        yield Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def _model_size(model_path: Path) -> int:
+    # external data is stored in other files in the same folder
+    return sum(path.stat().st_size for path in model_path.parent.iterdir() if path.is_file())
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Create and evaluate reduced-precision variants of ONNX models.")
+    parser.add_argument("model_names", nargs="+")
+    parser.add_argument(
+        "--precisions", nargs="+", type=ModelPrecision, default=[ModelPrecision.INT8, ModelPrecision.FP16]
+    )
+    parser.add_argument("--types", nargs="+", type=ModelType, default=list(TASKS))
+    parser.add_argument("--images", type=Path, help="folder of sample images for the accuracy comparison")
+    parser.add_argument("--samples", type=int, default=32)
+    parser.add_argument("--report", type=Path, help="write the results to this file as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for model_name in args.model_names:
+        for model_type in args.types:
+            if model_type not in TASKS:
+                raise ValueError(f"Unsupported model type for quantization: {model_type}")
+            try:
+                reference = from_model_type(
+                    model_name,
+                    model_type,
+                    TASKS[model_type],
+                    model_format=ModelFormat.ONNX,
+                    model_precision=ModelPrecision.FP32,
+                )
+            except ValueError:
+                continue  # e.g. a CLIP model name with the recognition type
+            # loading first downloads the model and applies any changes made to it on load
+            reference.load()
+            samples = load_samples(model_type, args.samples, args.images)
+
+            for model_precision in args.precisions:
+                if model_precision == ModelPrecision.FP32:
+                    continue
+                output_path = reference.model_path_for_precision(model_precision)
+                log.info(f"Creating {model_precision.upper()} variant of {model_type} model '{model_name}'")
+                quantize_model(reference.model_path, output_path, model_precision)
+
+                variant = from_model_type(
+                    model_name,
+                    model_type,
+                    TASKS[model_type],
+                    model_format=ModelFormat.ONNX,
+                    model_precision=model_precision,
+                )
+                variant.load()
+                result = compare(reference, variant, samples)
+                results.append(
+                    {"model_name": model_name, "model_type": model_type, "precision": model_precision, **result}
+                )
+                log.info(
+                    f"{model_name} {model_type} {model_precision}: {result['speedup']:.2f}x "
+                    f"({result['reference_ms']:.1f} -> {result['variant_ms']:.1f} ms/sample), "
+                    f"cosine similarity mean {result['cosine_mean']:.4f}, min {result['cosine_min']:.4f}"
+                )
+
+    if args.report is not None:
+        args.report.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
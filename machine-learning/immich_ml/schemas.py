@@ -38,6 +38,30 @@ class ModelFormat(StrEnum):
     RKNN = "rknn"
 
 
+class ModelState(StrEnum):
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    LOADED = "loaded"
+    FAILED = "failed"
+
+
+class EvictionPolicy(StrEnum):
+    LRU = "lru"
+    LFU = "lfu"
+
+
+class ModelPrecision(StrEnum):
+    FP32 = "fp32"
+    FP16 = "fp16"
+    INT8 = "int8"
+
+
+class EmbeddingFormat(StrEnum):
+    JSON = "json"
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+
+
 class ModelSource(StrEnum):
     INSIGHTFACE = "insightface"
     MCLIP = "mclip"
@@ -7,6 +7,7 @@ import numpy as np
 from numpy.typing import NDArray
 
 from immich_ml.config import log, settings
+from immich_ml.metrics import time_stage
 from immich_ml.schemas import SessionNode
 
 from .loader import Ann
@@ -50,7 +51,8 @@ class AnnSession:
         run_options: Any = None,
     ) -> list[NDArray[np.float32]]:
         inputs: list[NDArray[np.float32]] = [np.ascontiguousarray(v) for v in input_feed.values()]
-        return self.ann.execute(self.model, inputs)
+        with time_stage("inference"):
+            return self.ann.execute(self.model, inputs)
 
 
 class AnnNode(NamedTuple):
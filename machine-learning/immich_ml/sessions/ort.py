@@ -1,16 +1,29 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import platform
+import shutil
+import threading
+import uuid
+from functools import cache
 from pathlib import Path
 from typing import Any
 
 import numpy as np
+import onnx
 import onnxruntime as ort
 from numpy.typing import NDArray
 
+from immich_ml.metrics import time_stage
 from immich_ml.models.constants import SUPPORTED_PROVIDERS
 from immich_ml.schemas import SessionNode
 
 from ..config import log, settings
+from ..profiling import profile_dir
+
+# tensors smaller than this are kept in the model file, as mapping them isn't worth it
+EXTERNAL_DATA_MIN_SIZE = 1024
 
 
 class OrtSession:
@@ -25,13 +38,119 @@ class OrtSession:
         self.providers = providers if providers is not None else self._providers_default
         self.provider_options = provider_options if provider_options is not None else self._provider_options_default
         self.sess_options = sess_options if sess_options is not None else self._sess_options_default
-        self.session = ort.InferenceSession(
-            self.model_path.as_posix(),
+        self.session = self._create_session()
+        self._thread_state = threading.local()
+
+    def _create_session(self) -> ort.InferenceSession:
+        source_path = ensure_external_data(self.model_path) if self.external_data else self.model_path
+
+        # OpenVINO compiles and caches the model itself, and doesn't support saving an optimized model
+        if not settings.ort_optimized_model_cache or "OpenVINOExecutionProvider" in self.providers:
+            return self._load(source_path)
+
+        optimized_path = self.optimized_model_path
+        if optimized_path.is_file():
+            log.debug(f"Loading optimized model from '{optimized_path}'")
+            # the graph was already optimized when it was saved
+            optimization_level = self.sess_options.graph_optimization_level
+            self.sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            try:
+                return self._load(optimized_path)
+            except Exception as e:
+                log.warning(f"Failed to load optimized model '{optimized_path}', discarding it: {e}")
+                optimized_path.unlink(missing_ok=True)
+            finally:
+                self.sess_options.graph_optimization_level = optimization_level
+
+        # models optimized with different settings are stale, so only the latest one is kept
+        for stale_path in optimized_path.parent.glob(f"{self.model_path.stem}-*.onnx*"):
+            if not stale_path.name.startswith(optimized_path.name):
+                stale_path.unlink(missing_ok=True)
+        # written to a temporary folder unique to this process and renamed, so processes optimizing the same model
+        # at once don't overwrite each other's files and a partially written model is never loaded
+        tmp_dir = optimized_path.parent / f".tmp-{uuid.uuid4().hex}"
+        tmp_dir.mkdir(parents=True)
+        tmp_path = tmp_dir / optimized_path.name
+        self.sess_options.optimized_model_filepath = tmp_path.as_posix()
+        if self.external_data:
+            # keeps the optimized weights in a file that can be memory-mapped as well
+            self.sess_options.add_session_config_entry(
+                "session.optimized_model_external_initializers_file_name", f"{optimized_path.name}.data"
+            )
+            self.sess_options.add_session_config_entry(
+                "session.optimized_model_external_initializers_min_size_in_bytes", str(EXTERNAL_DATA_MIN_SIZE)
+            )
+        try:
+            try:
+                session = self._load(source_path)
+            except Exception as e:
+                log.warning(f"Failed to save optimized model for '{self.model_path}', loading it without caching: {e}")
+                self.sess_options.optimized_model_filepath = ""
+                return self._load(source_path)
+            finally:
+                self.sess_options.optimized_model_filepath = ""
+            self._save_optimized(tmp_path, optimized_path)
+            return session
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _save_optimized(self, tmp_path: Path, optimized_path: Path) -> None:
+        if not tmp_path.is_file():
+            return
+        try:
+            # the model is moved last since its presence means the weights are in place too
+            data_path = tmp_path.with_name(f"{tmp_path.name}.data")
+            if data_path.is_file():
+                data_path.replace(optimized_path.with_name(data_path.name))
+            tmp_path.replace(optimized_path)
+            log.debug(f"Saved optimized model to '{optimized_path}'")
+        except OSError as e:
+            # another process saved the same model first, and the session is usable either way
+            if not optimized_path.is_file():
+                log.warning(f"Failed to save optimized model to '{optimized_path}': {e}")
+
+    def _load(self, model_path: Path) -> ort.InferenceSession:
+        return ort.InferenceSession(
+            model_path.as_posix(),
             providers=self.providers,
             provider_options=self.provider_options,
             sess_options=self.sess_options,
         )
 
+    @property
+    def optimized_model_path(self) -> Path:
+        """
+        Path of the model after ORT's graph optimizations, keyed by everything that can change the optimized graph.
+        Some optimizations are specific to the provider and CPU, so the model is only reused in the same environment.
+        """
+
+        stat = self.model_path.stat()
+        key = {
+            "ort": ort.__version__,
+            "machine": platform.machine(),
+            "cpu_flags": _cpu_flags(),
+            "providers": self.providers,
+            "provider_options": self.provider_options,
+            "inter_op_threads": self.sess_options.inter_op_num_threads,
+            "intra_op_threads": self.sess_options.intra_op_num_threads,
+            "execution_mode": self.sess_options.execution_mode.name,
+            "optimization_level": self.sess_options.graph_optimization_level.name,
+            "external_data": self.external_data,
+            "shared_weights": settings.ort_shared_weights,
+            "model": [stat.st_size, stat.st_mtime_ns],
+        }
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return self.model_path.parent / "optimized" / f"{self.model_path.stem}-{digest}.onnx"
+
+    @property
+    def external_data(self) -> bool:
+        """Whether the weights are memory-mapped from a separate file instead of being read into memory."""
+
+        # OpenVINO reads the model itself
+        return (settings.ort_external_data or settings.ort_shared_weights) and (
+            "OpenVINOExecutionProvider" not in self.providers
+        )
+
     def get_inputs(self) -> list[SessionNode]:
         inputs: list[SessionNode] = self.session.get_inputs()
         return inputs
@@ -46,7 +165,47 @@ class OrtSession:
         input_feed: dict[str, NDArray[np.float32]] | dict[str, NDArray[np.int32]],
         run_options: Any = None,
     ) -> list[NDArray[np.float32]]:
-        outputs: list[NDArray[np.float32]] = self.session.run(output_names, input_feed, run_options)
+        with time_stage("inference"):
+            if settings.ort_io_binding:
+                return self._run_with_binding(output_names, input_feed, run_options)
+            outputs: list[NDArray[np.float32]] = self.session.run(output_names, input_feed, run_options)
+        return outputs
+
+    # the returned arrays are reused by the next call on the same thread with the same input shapes,
+    # so they must be consumed or copied before then
+    def _run_with_binding(
+        self,
+        output_names: list[str] | None,
+        input_feed: dict[str, NDArray[np.float32]] | dict[str, NDArray[np.int32]],
+        run_options: Any = None,
+    ) -> list[NDArray[np.float32]]:
+        state = self._thread_state
+        if not hasattr(state, "binding"):
+            state.binding = self.session.io_binding()
+            state.key = None
+            state.outputs = None
+        binding: ort.IOBinding = state.binding
+
+        for name, value in input_feed.items():
+            binding.bind_cpu_input(name, np.ascontiguousarray(value))
+
+        names = output_names if output_names is not None else [node.name for node in self.session.get_outputs()]
+        key = (tuple((name, value.shape) for name, value in input_feed.items()), tuple(names))
+        if key != state.key:
+            # output shapes can depend on the input shapes, so ORT allocates the outputs on the first run with
+            # these shapes and the same arrays are reused until they change, e.g. with a different batch size
+            for name in names:
+                binding.bind_output(name, "cpu")
+            self.session.run_with_iobinding(binding, run_options)
+            state.key = key
+            state.outputs = binding.copy_outputs_to_cpu()
+            outputs: list[NDArray[np.float32]] = state.outputs
+            return outputs
+
+        outputs = state.outputs
+        for name, output in zip(names, outputs):
+            binding.bind_output(name, "cpu", 0, output.dtype.type, output.shape, output.ctypes.data)
+        self.session.run_with_iobinding(binding, run_options)
         return outputs
 
     @property
@@ -132,4 +291,73 @@ class OrtSession:
         if sess_options.inter_op_num_threads > 1:
             sess_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
 
+        # prepacking copies weights into memory private to each process, which would defeat sharing them
+        if settings.ort_shared_weights:
+            sess_options.add_session_config_entry("session.disable_prepacking", "1")
+
+        # the trace is written when the session is released, e.g. when the model is unloaded or on shutdown
+        if settings.profile_onnxruntime:
+            sess_options.enable_profiling = True
+            model_name = f"{self.model_path.parent.parent.name}-{self.model_path.parent.name}"
+            sess_options.profile_file_prefix = (profile_dir() / f"onnxruntime-{model_name}").as_posix()
+
         return sess_options
+
+
+@cache
+def _cpu_flags() -> str:
+    # the block size of NCHWc layout optimizations depends on the instruction sets the CPU supports
+    try:
+        with open("/proc/cpuinfo") as f:
+            return next((line for line in f if line.startswith(("flags", "Features"))), "")
+    except OSError:
+        return ""
+
+
+def save_model(proto: onnx.ModelProto, model_path: Path) -> None:
+    """Replaces the model with `proto` so other processes loading it at the same time never read a partial file."""
+
+    tmp_path = model_path.with_name(f".{model_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        onnx.save(proto, tmp_path)
+        tmp_path.replace(model_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def ensure_external_data(model_path: Path) -> Path:
+    """
+    Returns the path of a copy of the model that stores its weights in a separate file, creating it if needed.
+    ONNX Runtime memory-maps weights in this layout instead of reading them into memory, so the pages are shared
+    through the page cache by every process that loads the model.
+    """
+
+    external_dir = model_path.parent / "external"
+    external_path = external_dir / model_path.name
+    if external_path.is_file():
+        # the model is changed in place in some cases, e.g. to add a batch axis to it
+        if external_path.stat().st_mtime_ns >= model_path.stat().st_mtime_ns:
+            return external_path
+        shutil.rmtree(external_dir, ignore_errors=True)
+
+    log.info(f"Converting model '{model_path}' to store its weights in a separate file")
+    # written to a temporary folder and renamed so other processes never load a partially written model
+    tmp_dir = model_path.parent / f".external-{uuid.uuid4().hex}"
+    tmp_dir.mkdir()
+    try:
+        onnx.save(
+            onnx.load(model_path),
+            tmp_dir / model_path.name,
+            save_as_external_data=True,
+            all_tensors_to_one_file=True,
+            location=f"{model_path.name}.data",
+            size_threshold=EXTERNAL_DATA_MIN_SIZE,
+        )
+        tmp_dir.rename(external_dir)
+    except OSError:
+        # another process finished converting it first
+        if not external_path.is_file():
+            raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return external_path
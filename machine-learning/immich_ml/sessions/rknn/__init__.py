@@ -7,6 +7,7 @@ import numpy as np
 from numpy.typing import NDArray
 
 from immich_ml.config import log, settings
+from immich_ml.metrics import time_stage
 from immich_ml.schemas import SessionNode
 
 from .rknnpool import RknnPoolExecutor, is_available, soc_name
@@ -61,8 +62,9 @@ class RknnSession:
         run_options: Any = None,
     ) -> list[NDArray[np.float32]]:
         input_data: list[NDArray[np.float32]] = [np.ascontiguousarray(v) for v in input_feed.values()]
-        self.rknnpool.put(input_data)
-        res = self.rknnpool.get()
+        with time_stage("inference"):
+            self.rknnpool.put(input_data)
+            res = self.rknnpool.get()
         if res is None:
             raise RuntimeError("RKNN inference failed!")
         return res
@@ -1,34 +1,100 @@
+import asyncio
+import base64
+import contextvars
 import json
 import os
+import pstats
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
 from pathlib import Path
 from random import randint
+from tempfile import SpooledTemporaryFile
 from types import SimpleNamespace
 from typing import Any, Callable
 from unittest import mock
 
 import cv2
 import numpy as np
+import onnx
 import onnxruntime as ort
 import orjson
 import pytest
 from fastapi import HTTPException
 from fastapi.testclient import TestClient
+from insightface.model_zoo import RetinaFace
+from insightface.utils.face_align import arcface_dst, estimate_norm, norm_crop
+from numpy.typing import NDArray
 from PIL import Image
 from pytest import MonkeyPatch
 from pytest_mock import MockerFixture
-
-from immich_ml.config import Settings, settings
-from immich_ml.main import load, preload_models
+from tokenizers import Tokenizer
+
+from immich_ml import process_pool
+from immich_ml.batching import RequestBatcher
+from immich_ml.config import (
+    ClipSettings,
+    FacialRecognitionSettings,
+    MaxBatchSize,
+    PreloadModelData,
+    Settings,
+    settings,
+)
+from immich_ml.main import get_embedding_format, get_size_hint, load, preload_models, run_batch_inference
+from immich_ml.metrics import (
+    MODEL_CACHE_EVICTIONS,
+    MODEL_LOAD_SECONDS,
+    STAGE_SECONDS,
+    Counter,
+    Histogram,
+    queue_wait,
+    record_stages,
+    registry,
+    time_stage,
+)
 from immich_ml.models.base import InferenceModel
 from immich_ml.models.cache import ModelCache
-from immich_ml.models.clip.textual import MClipTextualEncoder, OpenClipTextualEncoder
+from immich_ml.models.clip.textual import (
+    MClipTextualEncoder,
+    OpenClipTextualEncoder,
+    TextEmbeddingCache,
+    text_embedding_cache,
+)
 from immich_ml.models.clip.visual import OpenClipVisualEncoder
-from immich_ml.models.facial_recognition.detection import FaceDetector
+from immich_ml.models.facial_recognition.detection import TILE_OVERLAP, FaceDetector
 from immich_ml.models.facial_recognition.recognition import FaceRecognizer
-from immich_ml.schemas import ModelFormat, ModelTask, ModelType
+from immich_ml.models.transforms import (
+    ImageContext,
+    decode_cv2,
+    decode_pil,
+    decode_upload,
+    estimate_similarity_transforms,
+    serialize_np_array,
+)
+from immich_ml.process_pool import InferenceProcessPool, read_shared, write_shared
+from immich_ml.profiling import (
+    add_request_timing,
+    format_server_timing,
+    profile_request,
+    request_timings,
+    run_profiled,
+    time_request,
+)
+from immich_ml.quantize import compare, cosine_similarity, load_samples, quantize_model
+from immich_ml.schemas import (
+    EmbeddingFormat,
+    EvictionPolicy,
+    InferenceEntries,
+    ModelFormat,
+    ModelPrecision,
+    ModelState,
+    ModelTask,
+    ModelType,
+)
 from immich_ml.sessions.ann import AnnSession
-from immich_ml.sessions.ort import OrtSession
+from immich_ml.sessions.ort import OrtSession, ensure_external_data, save_model
 from immich_ml.sessions.rknn import RknnSession, run_inference
 
 
@@ -158,6 +224,102 @@ class TestBase:
             ignore_patterns=["*.armnn"],
         )
 
+    def test_download_converts_to_external_data(self, snapshot_download: mock.Mock, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_external_data", True)
+        ensure_external_data = mocker.patch("immich_ml.models.base.ensure_external_data")
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="/path/to/cache")
+        encoder.download()
+
+        ensure_external_data.assert_called_once_with(encoder.model_path)
+
+    def test_download_does_not_convert_other_formats(self, snapshot_download: mock.Mock, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_external_data", True)
+        ensure_external_data = mocker.patch("immich_ml.models.base.ensure_external_data")
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", model_format=ModelFormat.ARMNN)
+        encoder.download()
+
+        ensure_external_data.assert_not_called()
+
+    def test_sets_default_model_precision(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings.model_precision, "textual", ModelPrecision.INT8)
+
+        assert OpenClipTextualEncoder("ViT-B-32__openai").model_precision == ModelPrecision.INT8
+        assert OpenClipVisualEncoder("ViT-B-32__openai").model_precision == ModelPrecision.FP32
+        assert FaceDetector("buffalo_l").model_precision == ModelPrecision.FP32
+
+    def test_loads_precision_variant(self, ort_session: mock.Mock, tmp_path: Path) -> None:
+        encoder = OpenClipVisualEncoder(
+            "ViT-B-32__openai", cache_dir=tmp_path, model_format=ModelFormat.ONNX, model_precision=ModelPrecision.INT8
+        )
+        variant_path = tmp_path / "visual" / "int8" / "model.onnx"
+        variant_path.parent.mkdir(parents=True)
+        encoder.model_path.touch()
+        variant_path.touch()
+
+        encoder._make_session(encoder.model_path)
+
+        assert encoder.model_path_for_precision(ModelPrecision.INT8) == variant_path
+        assert ort_session.call_args.args[0] == variant_path.as_posix()
+
+    def test_falls_back_to_fp32_if_variant_does_not_exist(
+        self, ort_session: mock.Mock, tmp_path: Path, warning: mock.Mock
+    ) -> None:
+        encoder = OpenClipVisualEncoder(
+            "ViT-B-32__openai", cache_dir=tmp_path, model_format=ModelFormat.ONNX, model_precision=ModelPrecision.FP16
+        )
+        encoder.model_path.parent.mkdir(parents=True)
+        encoder.model_path.touch()
+
+        encoder._make_session(encoder.model_path)
+
+        assert ort_session.call_args.args[0] == encoder.model_path.as_posix()
+        warning.assert_called_once()
+
+    def test_warms_up_after_loading_if_enabled(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_warmup", True)
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="/path/to/cache")
+        mocker.patch.object(encoder, "download")
+        mocker.patch.object(encoder, "_load")
+        warmup = mocker.patch.object(encoder, "_warmup")
+
+        encoder.load()
+
+        warmup.assert_called_once_with(1)
+        assert encoder.loaded
+
+    def test_does_not_warm_up_by_default(self, mocker: MockerFixture) -> None:
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="/path/to/cache")
+        mocker.patch.object(encoder, "download")
+        mocker.patch.object(encoder, "_load")
+        warmup = mocker.patch.object(encoder, "_warmup")
+
+        encoder.load()
+
+        warmup.assert_not_called()
+
+    def test_loads_model_if_warmup_fails(self, mocker: MockerFixture, warning: mock.Mock) -> None:
+        mocker.patch.object(settings, "model_warmup", True)
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="/path/to/cache")
+        mocker.patch.object(encoder, "download")
+        mocker.patch.object(encoder, "_load")
+        mocker.patch.object(encoder, "_warmup", side_effect=RuntimeError)
+
+        encoder.load()
+
+        assert encoder.loaded
+        warning.assert_called_once()
+
+    def test_estimates_model_size_from_files(self, ort_session: mock.Mock, tmp_path: Path) -> None:
+        encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir=tmp_path, model_format=ModelFormat.ONNX)
+        encoder.model_path.parent.mkdir(parents=True)
+        encoder.model_path.write_bytes(b"0" * 100)
+        encoder.model_path.with_name("model.onnx.data").write_bytes(b"0" * 1000)
+        encoder.model_path.with_name("model.armnn").write_bytes(b"0" * 10000)
+
+        encoder._make_session(encoder.model_path)
+
+        assert encoder.model_size == 1100
+
     def test_throws_exception_if_model_path_does_not_exist(
         self, snapshot_download: mock.Mock, ort_session: mock.Mock, path: mock.Mock
     ) -> None:
@@ -170,6 +332,21 @@ class TestBase:
 
         snapshot_download.assert_called_once()
         ort_session.assert_not_called()
+        assert encoder.state == ModelState.FAILED
+        assert not encoder.loaded
+
+    def test_sets_state_when_loading(self, mocker: MockerFixture) -> None:
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="/path/to/cache")
+        mocker.patch.object(encoder, "download")
+        states = []
+        mocker.patch.object(encoder, "_load", side_effect=lambda: states.append(encoder.state))
+
+        assert encoder.state == ModelState.UNLOADED
+        encoder.load()
+
+        assert states == [ModelState.LOADING]
+        assert encoder.state == ModelState.LOADED
+        assert encoder.loaded
 
 
 @pytest.mark.usefixtures("ort_session")
@@ -286,6 +463,18 @@ class TestOrtSession:
         assert session.sess_options.intra_op_num_threads == 2
         assert session.sess_options.enable_cpu_mem_arena is False
 
+    def test_enables_profiling(self, mocker: MockerFixture, tmp_path: Path) -> None:
+        mocker.patch.object(settings, "profile_onnxruntime", True)
+        mocker.patch.object(settings, "cache_folder", tmp_path)
+
+        session = OrtSession("/cache/ViT-B-32__openai/visual/model.onnx", providers=["CPUExecutionProvider"])
+
+        assert session.sess_options.enable_profiling is True
+        assert (
+            session.sess_options.profile_file_prefix
+            == (tmp_path / "profiles" / "onnxruntime-ViT-B-32__openai-visual").as_posix()
+        )
+
     def test_sets_default_sess_options_does_not_set_threads_if_non_cpu_and_default_threads(self) -> None:
         session = OrtSession("ViT-B-32__openai", providers=["CUDAExecutionProvider", "CPUExecutionProvider"])
 
@@ -296,6 +485,9 @@ class TestOrtSession:
         mock_settings = mocker.patch("immich_ml.sessions.ort.settings", autospec=True)
         mock_settings.model_inter_op_threads = 2
         mock_settings.model_intra_op_threads = 4
+        mock_settings.ort_optimized_model_cache = False
+        mock_settings.ort_external_data = False
+        mock_settings.ort_shared_weights = False
 
         session = OrtSession("ViT-B-32__openai", providers=["CUDAExecutionProvider", "CPUExecutionProvider"])
 
@@ -314,6 +506,326 @@ class TestOrtSession:
         assert sess_options is session.sess_options
 
 
+class TestSaveModel:
+    def test_replaces_model(self, onnx_model_path: Path) -> None:
+        proto = onnx.load(onnx_model_path)
+        proto.graph.name = "updated"
+
+        save_model(proto, onnx_model_path)
+
+        assert onnx.load(onnx_model_path).graph.name == "updated"
+        assert list(onnx_model_path.parent.iterdir()) == [onnx_model_path]
+
+    def test_keeps_model_if_saving_fails(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        original = onnx_model_path.read_bytes()
+
+        def fail(proto: onnx.ModelProto, path: Path) -> None:
+            path.write_bytes(original[:10])
+            raise OSError("No space left on device")
+
+        mocker.patch("immich_ml.sessions.ort.onnx.save", side_effect=fail)
+
+        with pytest.raises(OSError):
+            save_model(onnx.load(onnx_model_path), onnx_model_path)
+
+        assert onnx_model_path.read_bytes() == original
+        assert list(onnx_model_path.parent.iterdir()) == [onnx_model_path]
+
+
+class TestOrtIOBinding:
+    def test_matches_run(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+        x = np.random.randn(2, 4).astype(np.float32)
+        expected = session.run(None, {"x": x})
+
+        mocker.patch.object(settings, "ort_io_binding", True)
+        first = [output.copy() for output in session.run(None, {"x": x})]
+        second = session.run(None, {"x": x})
+
+        for expected_output, first_output, second_output in zip(expected, first, second):
+            assert np.allclose(expected_output, first_output)
+            assert np.allclose(expected_output, second_output)
+
+    def test_reuses_outputs_until_shapes_change(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_io_binding", True)
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+
+        first = session.run(["relu"], {"x": np.ones((2, 4), dtype=np.float32)})
+        second = session.run(["relu"], {"x": -np.ones((2, 4), dtype=np.float32)})
+        third = session.run(["relu"], {"x": np.ones((3, 4), dtype=np.float32)})
+
+        assert second[0] is first[0]
+        assert np.array_equal(second[0], np.zeros((2, 4), dtype=np.float32))
+        assert third[0] is not first[0]
+        assert third[0].shape == (3, 4)
+
+    def test_uses_separate_outputs_per_thread(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_io_binding", True)
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+        x = np.ones((2, 4), dtype=np.float32)
+
+        with ThreadPoolExecutor(2) as pool:
+            outputs = list(pool.map(lambda _: session.run(["relu"], {"x": x})[0], range(2)))
+        main_output = session.run(["relu"], {"x": x})[0]
+
+        assert not any(output is main_output for output in outputs)
+
+
+class TestOrtOptimizedModelCache:
+    def test_saves_and_loads_optimized_model(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_optimized_model_cache", True)
+        x = np.random.randn(2, 4).astype(np.float32)
+
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+        optimized_path = session.optimized_model_path
+        expected = session.run(None, {"x": x})
+
+        assert optimized_path.is_file()
+        assert optimized_path.parent == onnx_model_path.parent / "optimized"
+
+        load = mocker.spy(OrtSession, "_load")
+        cached = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+
+        load.assert_called_once_with(cached, optimized_path)
+        assert cached.sess_options.graph_optimization_level == ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        for expected_output, output in zip(expected, cached.run(None, {"x": x})):
+            assert np.allclose(expected_output, output)
+
+    def test_key_depends_on_settings_and_model(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_optimized_model_cache", True)
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+        path = session.optimized_model_path
+
+        session.sess_options.intra_op_num_threads = 4
+        assert session.optimized_model_path != path
+        session.sess_options.intra_op_num_threads = 2
+
+        os.utime(onnx_model_path, ns=(0, 0))
+        assert session.optimized_model_path != path
+
+    def test_replaces_stale_optimized_model(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_optimized_model_cache", True)
+        stale_path = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"]).optimized_model_path
+
+        os.utime(onnx_model_path, ns=(0, 0))
+        path = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"]).optimized_model_path
+
+        assert path.is_file()
+        assert not stale_path.exists()
+
+    def test_discards_invalid_optimized_model(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_optimized_model_cache", True)
+        path = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"]).optimized_model_path
+        path.write_bytes(b"invalid")
+
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+
+        assert path.is_file()
+        assert path.read_bytes() != b"invalid"
+        assert session.run(["relu"], {"x": np.ones((1, 4), dtype=np.float32)})[0].shape == (1, 4)
+
+    def test_keeps_files_of_other_processes(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_optimized_model_cache", True)
+        path = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"]).optimized_model_path
+        path.unlink()
+        # another process optimizing the same model at once
+        data_path = path.with_name(f"{path.name}.data")
+        data_path.write_bytes(b"weights")
+        other_tmp_path = path.parent / ".tmp-other" / path.name
+        other_tmp_path.parent.mkdir()
+        other_tmp_path.write_bytes(b"model")
+
+        OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+
+        assert path.is_file()
+        assert data_path.is_file()
+        assert other_tmp_path.is_file()
+        assert [p.name for p in path.parent.glob(".tmp-*")] == [".tmp-other"]
+
+    def test_moves_optimized_model_with_external_weights(self, tmp_path: Path) -> None:
+        optimized_path = tmp_path / "optimized" / "model-0.onnx"
+        tmp_model_path = tmp_path / "optimized" / ".tmp-0" / "model-0.onnx"
+        tmp_model_path.parent.mkdir(parents=True)
+        tmp_model_path.write_bytes(b"model")
+        tmp_model_path.with_name("model-0.onnx.data").write_bytes(b"weights")
+
+        OrtSession._save_optimized(mock.Mock(), tmp_model_path, optimized_path)
+
+        assert optimized_path.read_bytes() == b"model"
+        assert optimized_path.with_name("model-0.onnx.data").read_bytes() == b"weights"
+
+    def test_ignores_optimized_model_saved_by_other_process(
+        self, onnx_model_path: Path, mocker: MockerFixture, warning: mock.Mock
+    ) -> None:
+        mocker.patch.object(settings, "ort_optimized_model_cache", True)
+        path = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"]).optimized_model_path
+        path.unlink()
+        replace = Path.replace
+
+        def lose_race(self: Path, target: Path) -> Path:
+            replace(self, target)
+            raise FileNotFoundError(self)
+
+        mocker.patch.object(Path, "replace", lose_race)
+
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+
+        assert path.is_file()
+        warning.assert_not_called()
+        assert not list(path.parent.glob(".tmp-*"))
+        assert session.run(["relu"], {"x": np.ones((1, 4), dtype=np.float32)})[0].shape == (1, 4)
+
+    def test_skips_openvino(self, ort_session: mock.Mock, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_optimized_model_cache", True)
+
+        session = OrtSession("/cache/ViT-B-32__openai/visual/model.onnx", providers=["OpenVINOExecutionProvider"])
+
+        assert session.sess_options.optimized_model_filepath == ""
+        ort_session.assert_called_once()
+        assert ort_session.call_args.args[0] == "/cache/ViT-B-32__openai/visual/model.onnx"
+
+
+class TestOrtSharedWeights:
+    def test_converts_to_external_data(self, onnx_model_path: Path) -> None:
+        external_path = ensure_external_data(onnx_model_path)
+        mtime = external_path.stat().st_mtime_ns
+
+        assert external_path == onnx_model_path.parent / "external" / "model.onnx"
+        assert ensure_external_data(onnx_model_path).stat().st_mtime_ns == mtime
+        assert not list(onnx_model_path.parent.glob(".external-*"))
+
+    def test_converts_again_if_model_changed(self, onnx_model_path: Path) -> None:
+        external_path = ensure_external_data(onnx_model_path)
+        os.utime(external_path, ns=(0, 0))
+
+        assert ensure_external_data(onnx_model_path).stat().st_mtime_ns > 0
+
+    def test_stores_large_weights_externally(self, tmp_path: Path) -> None:
+        weights = np.random.randn(64, 32).astype(np.float32)
+        graph = onnx.helper.make_graph(
+            [onnx.helper.make_node("MatMul", ["x", "weights"], ["y"])],
+            "test",
+            [onnx.helper.make_tensor_value_info("x", onnx.TensorProto.FLOAT, ["batch", 64])],
+            [onnx.helper.make_tensor_value_info("y", onnx.TensorProto.FLOAT, ["batch", 32])],
+            [onnx.numpy_helper.from_array(weights, "weights")],
+        )
+        model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 13)])
+        model.ir_version = 8
+        model_path = tmp_path / "model.onnx"
+        onnx.save(model, model_path)
+
+        external_path = ensure_external_data(model_path)
+
+        assert (tmp_path / "external" / "model.onnx.data").stat().st_size == weights.nbytes
+        assert external_path.stat().st_size < weights.nbytes
+
+    def test_loads_shared_weights(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_shared_weights", True)
+        load = mocker.spy(OrtSession, "_load")
+
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+
+        load.assert_called_once_with(session, onnx_model_path.parent / "external" / "model.onnx")
+        assert session.sess_options.get_session_config_entry("session.disable_prepacking") == "1"
+        assert session.run(["relu"], {"x": np.ones((1, 4), dtype=np.float32)})[0].shape == (1, 4)
+
+    def test_loads_external_data_with_prepacking(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_external_data", True)
+        load = mocker.spy(OrtSession, "_load")
+
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+
+        load.assert_called_once_with(session, onnx_model_path.parent / "external" / "model.onnx")
+        with pytest.raises(RuntimeError):
+            session.sess_options.get_session_config_entry("session.disable_prepacking")
+        assert session.run(["relu"], {"x": np.ones((1, 4), dtype=np.float32)})[0].shape == (1, 4)
+
+    def test_saves_optimized_model_with_external_weights(self, onnx_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ort_shared_weights", True)
+        mocker.patch.object(settings, "ort_optimized_model_cache", True)
+
+        optimized_path = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"]).optimized_model_path
+        session = OrtSession(onnx_model_path, providers=["CPUExecutionProvider"])
+
+        assert optimized_path.is_file()
+        assert session.run(["relu"], {"x": np.ones((1, 4), dtype=np.float32)})[0].shape == (1, 4)
+
+
+class TestQuantize:
+    @pytest.fixture
+    def matmul_model_path(self, tmp_path: Path) -> Path:
+        weights = np.random.randn(64, 32).astype(np.float32)
+        graph = onnx.helper.make_graph(
+            [onnx.helper.make_node("MatMul", ["x", "weights"], ["embedding"])],
+            "test",
+            [onnx.helper.make_tensor_value_info("x", onnx.TensorProto.FLOAT, ["batch", 64])],
+            [onnx.helper.make_tensor_value_info("embedding", onnx.TensorProto.FLOAT, ["batch", 32])],
+            [onnx.numpy_helper.from_array(weights, "weights")],
+        )
+        model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 13)])
+        model.ir_version = 8
+        path = tmp_path / "model.onnx"
+        onnx.save(model, path)
+        return path
+
+    @pytest.mark.parametrize("model_precision", [ModelPrecision.INT8, ModelPrecision.FP16])
+    def test_creates_variant(self, matmul_model_path: Path, model_precision: ModelPrecision, tmp_path: Path) -> None:
+        output_path = tmp_path / model_precision / "model.onnx"
+        x = np.random.randn(4, 64).astype(np.float32)
+
+        quantize_model(matmul_model_path, output_path, model_precision)
+
+        expected = OrtSession(matmul_model_path, providers=["CPUExecutionProvider"]).run(None, {"x": x})[0]
+        variant = OrtSession(output_path, providers=["CPUExecutionProvider"])
+        output = variant.run(None, {"x": x})[0]
+        assert variant.session.get_inputs()[0].type == "tensor(float)"
+        assert output.dtype == np.float32
+        assert cosine_similarity(expected, output).min() > 0.99
+        assert not output_path.with_suffix(".onnx.tmp").exists()
+
+    def test_rejects_fp32(self, matmul_model_path: Path, tmp_path: Path) -> None:
+        with pytest.raises(ValueError):
+            quantize_model(matmul_model_path, tmp_path / "fp32" / "model.onnx", ModelPrecision.FP32)
+
+    def test_compares_embeddings(self, mocker: MockerFixture) -> None:
+        reference = mock.Mock(spec=FaceRecognizer)
+        reference._get_embeddings.side_effect = lambda faces: np.array([[1.0, 0.0]])
+        variant = mock.Mock(spec=FaceRecognizer)
+        variant._get_embeddings.side_effect = lambda faces: np.array([[1.0, 1.0]])
+
+        result = compare(reference, variant, [np.zeros((112, 112, 3), dtype=np.uint8)] * 2)
+
+        assert result["cosine_mean"] == pytest.approx(np.sqrt(0.5))
+        assert result["cosine_min"] == pytest.approx(np.sqrt(0.5))
+        assert result["speedup"] > 0
+
+    def test_compares_embeddings_from_reused_output_buffer(self) -> None:
+        # with IO binding, each call writes its outputs into the same array
+        buffer = np.zeros((1, 2), dtype=np.float32)
+
+        def reused(faces: NDArray[np.uint8]) -> NDArray[np.float32]:
+            buffer[0] = [faces.mean(), 1.0]
+            return buffer
+
+        reference = mock.Mock(spec=FaceRecognizer)
+        reference._get_embeddings.side_effect = reused
+        variant = mock.Mock(spec=FaceRecognizer)
+        variant._get_embeddings.side_effect = lambda faces: np.array([[faces.mean(), 1.0]], dtype=np.float32)
+        faces = [np.full((112, 112, 3), value, dtype=np.uint8) for value in [0, 255]]
+
+        result = compare(reference, variant, faces)
+
+        assert result["cosine_min"] == pytest.approx(1.0)
+
+    @pytest.mark.parametrize("model_type", [ModelType.VISUAL, ModelType.TEXTUAL, ModelType.RECOGNITION])
+    def test_loads_samples(self, model_type: ModelType) -> None:
+        samples = load_samples(model_type, 3)
+
+        assert len(samples) == 3
+        if model_type == ModelType.RECOGNITION:
+            assert samples[0].shape == (112, 112, 3)
+
+
 class TestAnnSession:
     def test_creates_ann_session(self, ann_session: mock.Mock, info: mock.Mock) -> None:
         model_path = mock.MagicMock(spec=Path)
@@ -421,6 +933,144 @@ class TestCLIP:
         assert len(embedding) == clip_model_cfg["embed_dim"]
         mocked.run.assert_called_once()
 
+    def test_basic_image_binary_embedding(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        embedding_str = clip_encoder.predict(pil_image, embedding_format=EmbeddingFormat.FLOAT16)
+
+        embedding = np.frombuffer(base64.b64decode(embedding_str), dtype="<f2")
+        assert embedding.shape == (clip_model_cfg["embed_dim"],)
+        assert np.allclose(embedding, self.embedding, atol=1e-3)
+
+    def test_basic_image_batch(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.get_inputs.return_value = [SimpleNamespace(name="image", shape=("batch_size", 3, 224, 224))]
+        mocked.run.return_value = [np.stack([self.embedding] * 3)]
+
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        embedding_strs = clip_encoder.predict_batch([(pil_image,), (pil_image,), (pil_image,)])
+
+        assert len(embedding_strs) == 3
+        for embedding_str in embedding_strs:
+            assert isinstance(embedding_str, str)
+            assert len(orjson.loads(embedding_str)) == clip_model_cfg["embed_dim"]
+        mocked.run.assert_called_once()
+        assert mocked.run.call_args.args[1]["image"].shape == (3, 3, 224, 224)
+
+    def test_basic_image_batch_runs_individually_without_batch_axis(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.get_inputs.return_value = [SimpleNamespace(name="image", shape=(1, 3, 224, 224))]
+        mocked.run.return_value = [[self.embedding]]
+
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        embedding_strs = clip_encoder.predict_batch([(pil_image,), (pil_image,)])
+
+        assert len(embedding_strs) == 2
+        assert mocked.run.call_count == 2
+
+    def test_basic_image_batch_runs_in_chunks(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(settings, "max_batch_size", MaxBatchSize(clip=2))
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.get_inputs.return_value = [SimpleNamespace(name="image", shape=("batch_size", 3, 224, 224))]
+        mocked.run.side_effect = lambda _, feed: [np.stack([self.embedding] * len(feed["image"]))]
+
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        embedding_strs = clip_encoder.predict_batch([(pil_image,)] * 5)
+
+        assert len(embedding_strs) == 5
+        assert [call.args[1]["image"].shape[0] for call in mocked.run.call_args_list] == [2, 2, 1]
+
+    @pytest.mark.parametrize("size", [(600, 800), (1000, 300), (224, 224), (225, 500)])
+    def test_fused_preprocessing_matches_default(self, size: tuple[int, int], mocker: MockerFixture) -> None:
+        image = Image.fromarray(np.random.randint(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+        encoder = OpenClipVisualEncoder("ViT-B-32__openai", session=mock.Mock())
+        encoder.size = 224
+        encoder.mean = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+        encoder.std = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+        mocker.patch.object(settings, "fused_preprocessing", False)
+        expected = encoder.transform(image)["image"]
+        mocker.patch.object(settings, "fused_preprocessing", True)
+        actual = encoder.transform(image)["image"]
+
+        assert actual.shape == expected.shape == (1, 3, 224, 224)
+        assert actual.dtype == np.float32
+        # resizing only the cropped region can change a pixel by at most one 8-bit step
+        assert np.allclose(actual, expected, rtol=0, atol=1 / (255 * encoder.std.min()) + 1e-5)
+        assert np.abs(actual - expected).mean() < 1e-4
+
+    def test_fused_preprocessing_reuses_buffer(self, pil_image: Image.Image, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "fused_preprocessing", True)
+        encoder = OpenClipVisualEncoder("ViT-B-32__openai", session=mock.Mock())
+        encoder.size = 224
+        encoder.mean = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+        encoder.std = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+
+        batch = encoder.transform_batch([pil_image, pil_image.rotate(90, expand=True)])
+        single = encoder.transform(pil_image)["image"]
+
+        assert batch.shape == (2, 3, 224, 224)
+        assert np.shares_memory(batch, single)
+
+    def test_fused_preprocessing_does_not_keep_buffer_larger_than_chunk(
+        self, pil_image: Image.Image, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(settings, "fused_preprocessing", True)
+        encoder = OpenClipVisualEncoder("ViT-B-32__openai", session=mock.Mock())
+        encoder.size = 224
+        encoder.batch_size = 2
+        encoder.mean = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+        encoder.std = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+
+        chunk = encoder.transform_batch([pil_image] * 2)
+        batch = encoder.transform_batch([pil_image] * 3)
+
+        assert batch.shape == (3, 3, 224, 224)
+        assert not np.shares_memory(batch, chunk)
+        assert encoder._buffers.image.shape[0] == 2
+
     def test_basic_text(
         self,
         mocker: MockerFixture,
@@ -443,6 +1093,124 @@ class TestCLIP:
         assert len(embedding) == clip_model_cfg["embed_dim"]
         mocked.run.assert_called_once()
 
+    def test_text_cache_skips_repeated_queries(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+        mocker.patch("immich_ml.models.clip.textual.Tokenizer.from_file", autospec=True)
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        first = clip_encoder.predict("dog")
+        second = clip_encoder.predict("  dog ")
+        binary = clip_encoder.predict("dog", embedding_format=EmbeddingFormat.FLOAT32)
+
+        assert first == second
+        assert binary != first
+        assert mocked.run.call_count == 2
+        assert text_embedding_cache.hits == 1
+        assert text_embedding_cache.misses == 2
+
+    def mock_text_session(self, mocker: MockerFixture, word_tokenizer: Tokenizer, shape: list[Any]) -> mock.Mock:
+        mocker.patch("immich_ml.models.clip.textual.Tokenizer.from_file", autospec=True, return_value=word_tokenizer)
+        session = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        session.get_inputs.return_value = [SimpleNamespace(name="text", shape=shape)]
+
+        # each embedding is the sum of the text's token IDs so outputs can be matched to their texts
+        def run(output_names: None, tokens: dict[str, NDArray[np.int32]]) -> list[NDArray[np.float32]]:
+            return [np.repeat(tokens["text"].sum(axis=1, keepdims=True), 512, axis=1).astype(np.float32)]
+
+        session.run.side_effect = run
+        return session
+
+    def test_text_cache_in_batch(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+        word_tokenizer: Tokenizer,
+    ) -> None:
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        session = self.mock_text_session(mocker, word_tokenizer, ["batch", 77])
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder.predict("dog")
+        embeddings = clip_encoder.predict_batch([("dog",), ("beach",), ("birthday",)])
+
+        assert len(embeddings) == 3
+        assert session.run.call_count == 2
+        assert session.run.call_args.args[1]["text"].shape == (2, 77)
+        assert text_embedding_cache.hits == 1
+
+    def test_text_batch_is_grouped_by_length(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+        word_tokenizer: Tokenizer,
+    ) -> None:
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        session = self.mock_text_session(mocker, word_tokenizer, ["batch", "sequence"])
+        texts = ["a dog on the beach", " ".join(["party"] * 20), "dog", "birthday party", " ".join(["photo"] * 90)]
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        embeddings = clip_encoder.predict_batch([(text,) for text in texts])
+
+        assert [call.args[1]["text"].shape for call in session.run.call_args_list] == [(3, 16), (1, 32), (1, 77)]
+        assert clip_encoder.tokenize("birthday party")["text"].shape == (1, 2)
+        expected = [2 + 3 + 4 + 5 + 6, 8 * 20, 3, 7 + 8, 9 * 77]
+        assert [orjson.loads(embedding)[0] for embedding in embeddings] == expected
+
+    def test_text_batch_runs_in_chunks(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+        word_tokenizer: Tokenizer,
+    ) -> None:
+        mocker.patch.object(settings, "max_batch_size", MaxBatchSize(clip=2))
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        session = self.mock_text_session(mocker, word_tokenizer, ["batch", "sequence"])
+        texts = ["dog", "a dog", "beach", "a photo", "party"]
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        embeddings = clip_encoder.predict_batch([(text,) for text in texts])
+
+        assert [call.args[1]["text"].shape for call in session.run.call_args_list] == [(2, 16), (2, 16), (1, 16)]
+        assert [orjson.loads(embedding)[0] for embedding in embeddings] == [3, 5, 6, 11, 8]
+
+    def test_text_batch_is_padded_to_context_length_if_last_token_is_pooled(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+        word_tokenizer: Tokenizer,
+    ) -> None:
+        clip_model_cfg["text_cfg"]["pool_type"] = "last"
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        session = self.mock_text_session(mocker, word_tokenizer, ["batch", "sequence"])
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder.predict_batch([("dog",), ("birthday party",)])
+
+        session.run.assert_called_once()
+        assert session.run.call_args.args[1]["text"].shape == (2, 77)
+
     def test_openclip_tokenizer(
         self,
         mocker: MockerFixture,
@@ -615,17 +1383,47 @@ class TestFaceRecognition:
         assert face_detector.min_score == 0.5
         assert face_detector.model.det_thresh == 0.5
 
-    def test_detection(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
+    def mock_detector(self, mocker: MockerFixture, batch_axis: bool = False) -> tuple[FaceDetector, mock.Mock]:
         mocker.patch.object(FaceDetector, "load")
-        face_detector = FaceDetector("buffalo_s", min_score=0.0, cache_dir="test_cache")
+        face_detector = FaceDetector("buffalo_s", min_score=0.5, cache_dir="test_cache")
+        session = mock.Mock()
+        session.get_inputs.return_value = [
+            SimpleNamespace(name="input.1", shape=["batch" if batch_axis else 1, 3, 640, 640])
+        ]
+        names = [f"{kind}_{stride}" for kind in ["score", "bbox", "kps"] for stride in [8, 16, 32]]
+        session.get_outputs.return_value = [SimpleNamespace(name=name) for name in names]
+
+        # outputs depend on each image's pixels so batched and unbatched calls can be compared
+        def run(output_names: list[str], feed: dict[str, NDArray[np.float32]]) -> list[NDArray[np.float32]]:
+            outputs: list[list[NDArray[np.float32]]] = [[] for _ in output_names]
+            for blob in feed["input.1"]:
+                rng = np.random.default_rng(int(abs(blob).sum()))
+                for i, name in enumerate(output_names):
+                    kind, stride = name.split("_")
+                    anchors = (640 // int(stride)) ** 2 * 2
+                    columns = {"score": 1, "bbox": 4, "kps": 10}[kind]
+                    outputs[i].append(rng.random((anchors, columns), dtype=np.float32) * (1 if kind == "score" else 4))
+            return [np.concatenate(output) for output in outputs]
+
+        session.run.side_effect = run
+        face_detector.session = session
+        face_detector.model = RetinaFace(session=session)
+        face_detector.model.prepare(ctx_id=0, det_thresh=0.5, input_size=(640, 640))
+        return face_detector, session
+
+    def test_detection_decodes_like_insightface(self, mocker: MockerFixture) -> None:
+        face_detector, _ = self.mock_detector(mocker)
+        image = np.random.default_rng(0).integers(0, 256, (640, 640, 3), dtype=np.uint8)
+
+        bboxes, landmarks = face_detector._forward(image[None])[0]
+
+        scores_list, bboxes_list, kpss_list = face_detector.model.forward(image, 0.5)
+        expected_bboxes = np.hstack([np.vstack(bboxes_list), np.vstack(scores_list)])
+        np.testing.assert_allclose(bboxes, expected_bboxes, rtol=1e-6)
+        np.testing.assert_allclose(landmarks, np.vstack(kpss_list), rtol=1e-6)
 
-        det_model = mock.Mock()
-        num_faces = 2
-        bbox = np.random.rand(num_faces, 4).astype(np.float32)
-        scores = np.array([[0.67]] * num_faces).astype(np.float32)
-        kpss = np.random.rand(num_faces, 5, 2).astype(np.float32)
-        det_model.detect.return_value = (np.concatenate([bbox, scores], axis=-1), kpss)
-        face_detector.model = det_model
+    def test_detection(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
+        face_detector, session = self.mock_detector(mocker)
 
         faces = face_detector.predict(cv_image)
 
@@ -633,14 +1431,191 @@ class TestFaceRecognition:
         assert isinstance(faces.get("boxes", None), np.ndarray)
         assert isinstance(faces.get("landmarks", None), np.ndarray)
         assert isinstance(faces.get("scores", None), np.ndarray)
-        assert np.equal(faces["boxes"], bbox.round()).all()
-        assert np.equal(faces["landmarks"], kpss).all()
-        assert np.equal(faces["scores"], scores).all()
-        det_model.detect.assert_called_once()
+        assert faces["boxes"].shape[0] > 0
+        assert faces["landmarks"].shape == (faces["boxes"].shape[0], 5, 2)
+        assert (faces["scores"] >= 0.5).all()
+        session.run.assert_called_once()
+
+    @pytest.mark.parametrize("size", [(480, 640), (640, 480), (1000, 1000)])
+    def test_detection_matches_insightface(self, mocker: MockerFixture, size: tuple[int, int]) -> None:
+        face_detector, _ = self.mock_detector(mocker)
+        image = np.random.default_rng(0).integers(0, 256, (*size, 3), dtype=np.uint8)
+
+        bboxes, landmarks = face_detector._detect(image)
+
+        expected_bboxes, expected_landmarks = face_detector.model.detect(image)
+        np.testing.assert_allclose(bboxes, expected_bboxes, rtol=1e-5)
+        np.testing.assert_allclose(landmarks, expected_landmarks, rtol=1e-5)
+
+    def test_detection_matches_insightface_with_equal_scores(self, mocker: MockerFixture) -> None:
+        face_detector, session = self.mock_detector(mocker)
+        run = session.run.side_effect
+
+        def run_with_equal_scores(
+            output_names: list[str], feed: dict[str, NDArray[np.float32]]
+        ) -> list[NDArray[np.float32]]:
+            outputs: list[NDArray[np.float32]] = run(output_names, feed)
+            return [
+                np.minimum(np.round(output * 1.5, 1), 1.0) if name.startswith("score") else output
+                for name, output in zip(output_names, outputs)
+            ]
 
-    def test_recognition(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
+        session.run.side_effect = run_with_equal_scores
+        image = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+
+        bboxes, landmarks = face_detector._detect(image)
+
+        expected_bboxes, expected_landmarks = face_detector.model.detect(image)
+        np.testing.assert_allclose(bboxes, expected_bboxes, rtol=1e-5)
+        np.testing.assert_allclose(landmarks, expected_landmarks, rtol=1e-5)
+
+    @pytest.mark.parametrize("nms_thresh", [0.1, 0.4, 0.7])
+    def test_nms_matches_insightface(self, mocker: MockerFixture, nms_thresh: float) -> None:
+        face_detector, _ = self.mock_detector(mocker)
+        face_detector.model.nms_thresh = nms_thresh
+        rng = np.random.default_rng(0)
+        # mostly small boxes, with some large ones containing them and some exact duplicates
+        top_left = rng.uniform(-20, 600, (2000, 2))
+        sizes = np.where(rng.random((2000, 1)) < 0.95, rng.uniform(1, 60, (2000, 2)), rng.uniform(100, 600, (2000, 2)))
+        bboxes = np.hstack([top_left, top_left + sizes, rng.random((2000, 1))]).astype(np.float32)
+        bboxes[1500:1600, :4] = bboxes[1400:1500, :4]
+        # scores can be equal, e.g. when sigmoid outputs saturate at 1.0
+        bboxes[:500, 4] = np.round(bboxes[:500, 4], 1)
+        bboxes[1450:1550, 4] = 1.0
+
+        keep = face_detector._nms(bboxes)
+
+        np.testing.assert_array_equal(keep, face_detector.model.nms(bboxes))
+        assert face_detector._nms(np.zeros((0, 5), np.float32)).shape == (0,)
+
+    def test_detection_decodes_images_without_faces(self, mocker: MockerFixture) -> None:
+        face_detector, _ = self.mock_detector(mocker)
+        face_detector.model.det_thresh = 1.1
+
+        bboxes, landmarks = face_detector._forward(np.zeros((1, 640, 640, 3), dtype=np.uint8))[0]
+
+        assert bboxes.shape == (0, 5)
+        assert landmarks.shape == (0, 5, 2)
+
+    def test_detection_runs_tiles_in_one_call_with_batch_axis(self, mocker: MockerFixture) -> None:
+        face_detector, session = self.mock_detector(mocker)
+        batched_detector, batched_session = self.mock_detector(mocker, batch_axis=True)
+        tiles = np.random.default_rng(0).integers(0, 256, (3, 640, 640, 3), dtype=np.uint8)
+
+        outputs = face_detector._forward(tiles)
+        batched_outputs = batched_detector._forward(tiles)
+
+        assert session.run.call_count == 3
+        batched_session.run.assert_called_once()
+        for (bboxes, landmarks), (batched_bboxes, batched_landmarks) in zip(outputs, batched_outputs):
+            np.testing.assert_array_equal(bboxes, batched_bboxes)
+            np.testing.assert_array_equal(landmarks, batched_landmarks)
+
+    def test_detection_runs_batches_in_chunks(self, mocker: MockerFixture) -> None:
+        face_detector, session = self.mock_detector(mocker)
+        batched_detector, batched_session = self.mock_detector(mocker, batch_axis=True)
+        batched_detector.batch_size = 2
+        images = np.random.default_rng(0).integers(0, 256, (5, 640, 640, 3), dtype=np.uint8)
+
+        outputs = face_detector._forward(images)
+        batched_outputs = batched_detector._forward(images)
+
+        assert batched_session.run.call_count == 3
+        for (bboxes, landmarks), (batched_bboxes, batched_landmarks) in zip(outputs, batched_outputs):
+            np.testing.assert_array_equal(bboxes, batched_bboxes)
+            np.testing.assert_array_equal(landmarks, batched_landmarks)
+
+    def test_detection_adds_batch_axis_for_ort(self, detection_model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(FaceDetector, "download")
+        face_detector = FaceDetector("buffalo_s", min_score=0.5, cache_dir=detection_model_path.parent.parent)
+        face_detector.load()
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 256, (*size, 3), dtype=np.uint8) for size in [(480, 640), (640, 480), (300, 300)]]
+        run = mocker.spy(face_detector.session, "run")
+
+        outputs = face_detector.predict_batch([(image,) for image in images])
+
+        assert face_detector.session.get_inputs()[0].shape[0] == "batch"
+        run.assert_called_once()
+        assert run.call_args.args[1]["input.1"].shape == (3, 3, 640, 640)
+        for image, output in zip(images, outputs):
+            expected = face_detector.predict(image)
+            assert len(output["boxes"]) > 0
+            np.testing.assert_allclose(output["boxes"], expected["boxes"], atol=1)
+            np.testing.assert_allclose(output["scores"], expected["scores"], rtol=1e-5)
+            np.testing.assert_allclose(output["landmarks"], expected["landmarks"], rtol=1e-4, atol=1e-3)
+
+    def test_detection_does_not_add_batch_axis_with_batch_size_1(
+        self, detection_model_path: Path, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(settings, "max_batch_size", MaxBatchSize(face_detection=1))
+        mocker.patch.object(FaceDetector, "download")
+        face_detector = FaceDetector("buffalo_s", min_score=0.5, cache_dir=detection_model_path.parent.parent)
+        face_detector.load()
+        run = mocker.spy(face_detector.session, "run")
+
+        outputs = face_detector.predict_batch([(np.zeros((480, 640, 3), dtype=np.uint8),)] * 2)
+
+        assert face_detector.batch_size == 1
+        assert face_detector.session.get_inputs()[0].shape[0] == 1
+        assert run.call_count == 2
+        assert len(outputs) == 2
+
+    @pytest.mark.parametrize("length", [640, 641, 1000, 1440, 1920, 4000])
+    def test_tile_offsets_cover_image_with_overlap(self, length: int) -> None:
+        offsets = FaceDetector._tile_offsets(length, 640)
+
+        assert offsets[0] == 0
+        assert offsets[-1] == max(length - 640, 0)
+        assert all(next - prev <= 640 - TILE_OVERLAP for prev, next in zip(offsets, offsets[1:]))
+
+    def test_tiled_detection(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "face_detection_max_tiled_size", 1920)
+        face_detector, _ = self.mock_detector(mocker)
+        large_face = np.array([[400, 400, 1400, 1400, 0.9]], dtype=np.float32)
+        mocker.patch.object(face_detector, "_detect", return_value=(large_face, np.full((1, 5, 2), 900, np.float32)))
+        forward = mocker.patch.object(face_detector, "_forward")
+
+        # the image is downscaled to 1920x1440, which is split into 4x3 tiles
+        def detect_tiles(tiles: NDArray[np.uint8]) -> list[tuple[NDArray[np.float32], NDArray[np.float32]]]:
+            outputs = [(np.zeros((0, 5), np.float32), np.zeros((0, 5, 2), np.float32)) for _ in tiles]
+            small_face = np.array([[100, 200, 140, 250, 0.8], [100, 200, 142, 251, 0.7]], dtype=np.float32)
+            cut_off_face = np.array([[600, 300, 639, 340, 0.8]], dtype=np.float32)
+            outputs[1] = (np.concatenate([small_face, cut_off_face]), np.full((3, 5, 2), 120, np.float32))
+            return outputs
+
+        forward.side_effect = detect_tiles
+        faces = face_detector.predict(np.zeros((2880, 3840, 3), dtype=np.uint8), tiled=True)
+
+        assert forward.call_args.args[0].shape == (12, 640, 640, 3)
+        np.testing.assert_allclose(faces["boxes"], [[400, 400, 1400, 1400], [(100 + 427) * 2, 400, 1134, 500]])
+        np.testing.assert_allclose(faces["scores"], [0.9, 0.8])
+        np.testing.assert_allclose(faces["landmarks"][1], np.full((5, 2), ((120 + 427) * 2, 240)))
+
+    def test_tiled_detection_skips_tiles_for_small_images(self, mocker: MockerFixture) -> None:
+        face_detector, _ = self.mock_detector(mocker)
+        forward = mocker.patch.object(face_detector, "_forward")
+        detect = mocker.patch.object(face_detector, "_detect")
+        detect.return_value = (np.zeros((0, 5), np.float32), np.zeros((0, 5, 2), np.float32))
+
+        face_detector.predict(np.zeros((480, 640, 3), dtype=np.uint8), tiled=True)
+
+        detect.assert_called_once()
+        forward.assert_not_called()
+
+    def mock_recognizer(self, mocker: MockerFixture) -> tuple[FaceRecognizer, mock.Mock]:
         mocker.patch.object(FaceRecognizer, "load")
         face_recognizer = FaceRecognizer("buffalo_s", min_score=0.0, cache_dir="test_cache")
+        face_recognizer.model = SimpleNamespace(
+            input_size=(112, 112), input_mean=127.5, input_std=127.5, input_name="input.1", output_names=["683"]
+        )
+        session = mock.Mock()
+        session.run.side_effect = lambda names, feed: [np.random.rand(len(feed["input.1"]), 512).astype(np.float32)]
+        face_recognizer.session = session
+        return face_recognizer, session
+
+    def test_recognition(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
+        face_recognizer, session = self.mock_recognizer(mocker)
 
         num_faces = 2
         bbox = np.random.rand(num_faces, 4).astype(np.float32)
@@ -648,11 +1623,6 @@ class TestFaceRecognition:
         kpss = np.random.rand(num_faces, 5, 2).astype(np.float32)
         faces = {"boxes": bbox, "landmarks": kpss, "scores": scores}
 
-        rec_model = mock.Mock()
-        embedding = np.random.rand(num_faces, 512).astype(np.float32)
-        rec_model.get_feat.return_value = embedding
-        face_recognizer.model = rec_model
-
         faces = face_recognizer.predict(cv_image, faces)
 
         assert isinstance(faces, list)
@@ -668,12 +1638,88 @@ class TestFaceRecognition:
             assert len(embedding) == 512
             assert isinstance(face.get("score", None), np.float32)
 
-        rec_model.get_feat.assert_called_once()
-        call_args = rec_model.get_feat.call_args_list[0].args
-        assert len(call_args) == 1
-        assert isinstance(call_args[0], list)
-        assert isinstance(call_args[0][0], np.ndarray)
-        assert call_args[0][0].shape == (112, 112, 3)
+        session.run.assert_called_once()
+        names, feed = session.run.call_args.args
+        assert names == ["683"]
+        assert feed["input.1"].shape == (num_faces, 3, 112, 112)
+        assert feed["input.1"].dtype == np.float32
+
+    def test_recognition_aligns_faces_like_insightface(self, mocker: MockerFixture) -> None:
+        face_recognizer, session = self.mock_recognizer(mocker)
+        rng = np.random.default_rng(0)
+        image = np.asarray(cv2.GaussianBlur(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8), (9, 9), 3), np.uint8)
+        landmarks = arcface_dst[None] * rng.uniform(0.5, 3, (8, 1, 1)) + rng.uniform(0, 300, (8, 1, 2))
+        faces: Any = {"landmarks": landmarks.astype(np.float32)}
+
+        crops = face_recognizer._crop(image, faces)
+
+        expected = np.stack([norm_crop(image, landmark) for landmark in faces["landmarks"]])
+        # insightface estimates the transforms in lower precision, which can round a few pixels differently
+        assert (crops != expected).mean() < 0.001
+        expected_blob = cv2.dnn.blobFromImages(list(expected), 1 / 127.5, (112, 112), (127.5,) * 3, swapRB=True)
+        np.testing.assert_allclose(face_recognizer._normalize(expected), expected_blob, atol=1e-6)
+
+    def test_estimates_similarity_transforms(self) -> None:
+        rng = np.random.default_rng(0)
+        landmarks = arcface_dst[None] * rng.uniform(0.5, 3, (8, 1, 1)) + rng.normal(0, 3, (8, 5, 2))
+
+        transforms = estimate_similarity_transforms(landmarks, arcface_dst)
+
+        expected = np.stack([estimate_norm(landmark) for landmark in landmarks])
+        np.testing.assert_allclose(transforms, expected, atol=1e-4)
+
+    def test_recognition_copies_chunks_from_reused_outputs(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
+        face_recognizer, session = self.mock_recognizer(mocker)
+        face_recognizer.batch_size = 2
+
+        num_faces = 5
+        bbox = np.random.rand(num_faces, 4).astype(np.float32)
+        scores = np.array([0.67] * num_faces).astype(np.float32)
+        kpss = np.random.rand(num_faces, 5, 2).astype(np.float32)
+        faces = {"boxes": bbox, "landmarks": kpss, "scores": scores}
+
+        # mimics a session that writes each chunk's outputs into the same array
+        output = np.empty((2, 512), dtype=np.float32)
+        calls = 0
+
+        def run(names: list[str], feed: dict[str, NDArray[np.float32]]) -> list[NDArray[np.float32]]:
+            nonlocal calls
+            batch_size = len(feed["input.1"])
+            output[:batch_size] = calls
+            calls += 1
+            return [output[:batch_size]]
+
+        session.run.side_effect = run
+
+        results = face_recognizer.predict(cv_image, faces)
+
+        assert [orjson.loads(face["embedding"])[0] for face in results] == [0, 0, 1, 1, 2]
+
+    def test_recognition_warms_up_each_batch_size(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_warmup_batch_sizes", [1, 8, 32])
+        face_recognizer, session = self.mock_recognizer(mocker)
+        face_recognizer.batch_size = 8
+
+        face_recognizer.warmup()
+
+        batches = [call.args[1]["input.1"] for call in session.run.call_args_list]
+        assert [batch.shape for batch in batches] == [(1, 3, 112, 112), (8, 3, 112, 112)]
+
+    def test_recognition_batch(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
+        face_recognizer, session = self.mock_recognizer(mocker)
+
+        batch = []
+        for num_faces in [2, 0, 1]:
+            bbox = np.random.rand(num_faces, 4).astype(np.float32)
+            scores = np.array([0.67] * num_faces).astype(np.float32)
+            kpss = np.random.rand(num_faces, 5, 2).astype(np.float32)
+            batch.append((cv_image, {"boxes": bbox, "landmarks": kpss, "scores": scores}))
+
+        outputs = face_recognizer.predict_batch(batch)
+
+        assert [len(faces) for faces in outputs] == [2, 0, 1]
+        session.run.assert_called_once()
+        assert session.run.call_args.args[1]["input.1"].shape == (3, 3, 112, 112)
 
     def test_recognition_adds_batch_axis_for_ort(
         self, ort_session: mock.Mock, path: mock.Mock, mocker: MockerFixture
@@ -682,6 +1728,7 @@ class TestFaceRecognition:
         update_dims = mocker.patch(
             "immich_ml.models.facial_recognition.recognition.update_inputs_outputs_dims", autospec=True
         )
+        save_model = mocker.patch("immich_ml.models.facial_recognition.recognition.save_model", autospec=True)
         mocker.patch("immich_ml.models.base.InferenceModel.download")
         mocker.patch("immich_ml.models.facial_recognition.recognition.ArcFaceONNX")
         ort_session.return_value.get_inputs.return_value = [SimpleNamespace(name="input.1", shape=(1, 3, 224, 224))]
@@ -707,7 +1754,37 @@ class TestFaceRecognition:
 
         assert face_recognizer.batch_size is None
         update_dims.assert_called_once_with(proto, {"input.1": ["batch", 3, 224, 224]}, {"output.1": ["batch", 800]})
-        onnx.save.assert_called_once_with(update_dims.return_value, face_recognizer.model_path)
+        save_model.assert_called_once_with(update_dims.return_value, face_recognizer.model_path)
+
+    def test_recognition_adds_batch_axis_to_variant(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(FaceRecognizer, "download")
+        mocker.patch("immich_ml.models.facial_recognition.recognition.ArcFaceONNX")
+
+        def save_model(path: Path, batch: str | int) -> None:
+            inputs = [onnx.helper.make_tensor_value_info("input.1", onnx.TensorProto.FLOAT, [batch, 3, 112, 112])]
+            outputs = [onnx.helper.make_tensor_value_info("output", onnx.TensorProto.FLOAT, [batch, 3, 1, 1])]
+            nodes = [onnx.helper.make_node("GlobalAveragePool", ["input.1"], ["output"])]
+            model = onnx.helper.make_model(
+                onnx.helper.make_graph(nodes, "recognition", inputs, outputs),
+                opset_imports=[onnx.helper.make_opsetid("", 13)],
+            )
+            model.ir_version = 8
+            path.parent.mkdir(parents=True, exist_ok=True)
+            onnx.save(model, path)
+
+        model_path = tmp_path / "recognition" / "model.onnx"
+        variant_path = tmp_path / "recognition" / "int8" / "model.onnx"
+        save_model(model_path, "batch")
+        # e.g. quantized while OpenVINO was available, so the original didn't have a batch axis yet
+        save_model(variant_path, 1)
+        original = model_path.read_bytes()
+
+        face_recognizer = FaceRecognizer("buffalo_s", cache_dir=tmp_path, model_precision=ModelPrecision.INT8)
+        face_recognizer.load()
+
+        assert face_recognizer.session_path == variant_path
+        assert face_recognizer.session.get_inputs()[0].shape[0] == "batch"
+        assert model_path.read_bytes() == original
 
     def test_recognition_does_not_add_batch_axis_if_exists(
         self, ort_session: mock.Mock, path: mock.Mock, mocker: MockerFixture
@@ -855,6 +1932,128 @@ class TestCache:
         with pytest.raises(ValueError):
             await model_cache.get("test_model_name", ModelType.TEXTUAL, ModelTask.SEARCH)
 
+    async def test_load_waits_for_same_model(self) -> None:
+        model_cache = ModelCache()
+        mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.loaded = False
+        started = asyncio.Event()
+        finish = asyncio.Event()
+        load_func = mock.AsyncMock()
+
+        async def load_model(model: InferenceModel) -> InferenceModel:
+            await load_func(model)
+            started.set()
+            await finish.wait()
+            return model
+
+        first = asyncio.ensure_future(model_cache.load(mock_model, load_model))
+        second = asyncio.ensure_future(model_cache.load(mock_model, load_model))
+        await started.wait()
+        assert model_cache.loading
+        finish.set()
+
+        assert await asyncio.gather(first, second) == [mock_model, mock_model]
+        load_func.assert_awaited_once_with(mock_model)
+        assert not model_cache.loading
+
+    async def test_load_does_not_wait_for_other_models(self) -> None:
+        model_cache = ModelCache()
+        slow_model = mock.Mock(spec=InferenceModel)
+        slow_model.loaded = False
+        fast_model = mock.Mock(spec=InferenceModel)
+        fast_model.loaded = False
+        finish = asyncio.Event()
+
+        async def load_model(model: InferenceModel) -> InferenceModel:
+            if model is slow_model:
+                await finish.wait()
+            return model
+
+        slow = asyncio.ensure_future(model_cache.load(slow_model, load_model))
+        assert await asyncio.wait_for(model_cache.load(fast_model, load_model), timeout=1) is fast_model
+        assert not slow.done()
+
+        finish.set()
+        assert await slow is slow_model
+
+    async def test_load_raises_for_every_waiter_and_retries(self) -> None:
+        model_cache = ModelCache()
+        mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.loaded = False
+        load_func = mock.AsyncMock(side_effect=[OSError, mock_model])
+
+        results = await asyncio.gather(
+            model_cache.load(mock_model, load_func), model_cache.load(mock_model, load_func), return_exceptions=True
+        )
+
+        assert all(isinstance(result, OSError) for result in results)
+        assert await model_cache.load(mock_model, load_func) is mock_model
+        assert load_func.await_count == 2
+
+    def sized_models(self, mock_get_model: mock.Mock, size: int) -> None:
+        def from_model_type(model_name: str, model_type: ModelType, model_task: ModelTask) -> mock.Mock:
+            mock_model = mock.Mock(spec=InferenceModel)
+            mock_model.model_name = model_name
+            mock_model.model_type = model_type
+            mock_model.model_task = model_task
+            mock_model.loaded = False
+            mock_model.model_size = size
+            return mock_model
+
+        mock_get_model.side_effect = from_model_type
+
+    async def load_models(self, model_cache: ModelCache, *model_names: str, pinned: bool = False) -> None:
+        async def load_model(model: InferenceModel) -> InferenceModel:
+            model.loaded = True  # type: ignore[misc]
+            return model
+
+        for model_name in model_names:
+            model = await model_cache.get(model_name, ModelType.VISUAL, ModelTask.SEARCH, pinned=pinned)
+            await model_cache.load(model, load_model)
+
+    def cached_names(self, model_cache: ModelCache) -> set[str]:
+        return {model.model_name for model in model_cache.cache._cache.values()}
+
+    async def test_evicts_least_recently_used_model(self, mock_get_model: mock.Mock) -> None:
+        self.sized_models(mock_get_model, 100)
+        model_cache = ModelCache(max_bytes=200)
+        await self.load_models(model_cache, "a", "b")
+        await self.load_models(model_cache, "a")
+        before = MODEL_CACHE_EVICTIONS.get("b", ModelType.VISUAL, ModelTask.SEARCH)
+
+        await self.load_models(model_cache, "c")
+
+        assert self.cached_names(model_cache) == {"a", "c"}
+        assert model_cache.size == 200
+        assert MODEL_CACHE_EVICTIONS.get("b", ModelType.VISUAL, ModelTask.SEARCH) == before + 1
+
+    async def test_evicts_least_frequently_used_model(self, mock_get_model: mock.Mock) -> None:
+        self.sized_models(mock_get_model, 100)
+        model_cache = ModelCache(max_bytes=200, policy=EvictionPolicy.LFU)
+        await self.load_models(model_cache, "a", "a", "b")
+
+        await self.load_models(model_cache, "c")
+
+        assert self.cached_names(model_cache) == {"a", "c"}
+
+    async def test_does_not_evict_pinned_models(self, mock_get_model: mock.Mock, warning: mock.Mock) -> None:
+        self.sized_models(mock_get_model, 100)
+        model_cache = ModelCache(max_bytes=100)
+        await self.load_models(model_cache, "a", pinned=True)
+
+        await self.load_models(model_cache, "b")
+
+        assert self.cached_names(model_cache) == {"a", "b"}
+        warning.assert_called_once()
+
+    async def test_does_not_evict_without_max_bytes(self, mock_get_model: mock.Mock) -> None:
+        self.sized_models(mock_get_model, 100)
+        model_cache = ModelCache()
+
+        await self.load_models(model_cache, "a", "b", "c")
+
+        assert self.cached_names(model_cache) == {"a", "b", "c"}
+
     async def test_preloads_clip_models(self, monkeypatch: MonkeyPatch, mock_get_model: mock.Mock) -> None:
         os.environ["MACHINE_LEARNING_PRELOAD__CLIP__TEXTUAL"] = "ViT-B-32__openai"
         os.environ["MACHINE_LEARNING_PRELOAD__CLIP__VISUAL"] = "ViT-B-32__openai"
@@ -926,6 +2125,222 @@ class TestCache:
             any_order=True,
         )
 
+    async def test_preloads_models_concurrently(self, monkeypatch: MonkeyPatch, mock_get_model: mock.Mock) -> None:
+        # each load waits for the others to start, so this times out if they're loaded one at a time
+        barrier = threading.Barrier(4, timeout=5)
+
+        def from_model_type(*args: Any, **kwargs: Any) -> mock.Mock:
+            mock_model = mock.Mock(spec=InferenceModel)
+            mock_model.loaded = False
+            mock_model.load_attempts = 0
+            mock_model.load.side_effect = lambda: barrier.wait()
+            return mock_model
+
+        mock_get_model.side_effect = from_model_type
+        preload = PreloadModelData(
+            clip=ClipSettings(textual="ViT-B-32__openai", visual="ViT-B-32__openai"),
+            facial_recognition=FacialRecognitionSettings(detection="buffalo_s", recognition="buffalo_s"),
+        )
+        monkeypatch.setattr("immich_ml.main.model_cache", ModelCache())
+        monkeypatch.setattr("immich_ml.main.thread_pool", ThreadPoolExecutor(4))
+
+        await preload_models(preload)
+
+        assert mock_get_model.call_count == 4
+
+
+@pytest.mark.asyncio
+class TestBatching:
+    @staticmethod
+    async def run(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return func(*args, **kwargs)
+
+    def mock_model(self) -> mock.Mock:
+        mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.model_name = "test_model_name"
+        mock_model.model_type = ModelType.VISUAL
+        mock_model.model_task = ModelTask.SEARCH
+        mock_model.predict_batch.side_effect = lambda batch, **kwargs: [inputs[0] * 2 for inputs in batch]
+        return mock_model
+
+    async def test_coalesces_concurrent_requests(self) -> None:
+        mock_model = self.mock_model()
+        batcher = RequestBatcher(self.run, max_size=8, max_wait_s=0.01)
+
+        outputs = await asyncio.gather(*[batcher.predict(mock_model, i) for i in range(3)])
+
+        assert outputs == [0, 2, 4]
+        mock_model.predict_batch.assert_called_once_with([(0,), (1,), (2,)])
+
+    async def test_runs_batch_when_full(self) -> None:
+        mock_model = self.mock_model()
+        batcher = RequestBatcher(self.run, max_size=2, max_wait_s=60)
+
+        outputs = await asyncio.wait_for(asyncio.gather(*[batcher.predict(mock_model, i) for i in range(4)]), 1)
+
+        assert outputs == [0, 2, 4, 6]
+        mock_model.predict_batch.assert_has_calls([mock.call([(0,), (1,)]), mock.call([(2,), (3,)])])
+
+    async def test_separates_batches_by_options(self) -> None:
+        mock_model = self.mock_model()
+        batcher = RequestBatcher(self.run, max_size=8, max_wait_s=0.01)
+
+        await asyncio.gather(
+            batcher.predict(mock_model, 1, minScore=0.5),
+            batcher.predict(mock_model, 2, minScore=0.7),
+            batcher.predict(mock_model, 3, minScore=0.5),
+        )
+
+        mock_model.predict_batch.assert_has_calls(
+            [mock.call([(1,), (3,)], minScore=0.5), mock.call([(2,)], minScore=0.7)], any_order=True
+        )
+
+    async def test_attributes_batch_timings_to_each_request(self) -> None:
+        mock_model = self.mock_model()
+
+        def predict_batch(batch: list[tuple[int]], **kwargs: Any) -> list[int]:
+            add_request_timing("visual-inference", 0.5)
+            return [inputs[0] for inputs in batch]
+
+        mock_model.predict_batch.side_effect = predict_batch
+        batcher = RequestBatcher(self.run, max_size=8, max_wait_s=0.01)
+
+        async def predict(i: int) -> dict[str, float]:
+            with request_timings() as timings:
+                await batcher.predict(mock_model, i)
+            return timings
+
+        timings = await asyncio.gather(*[predict(i) for i in range(3)])
+
+        assert timings == [{"visual-inference": 0.5}] * 3
+        mock_model.predict_batch.assert_called_once()
+
+    async def test_propagates_exceptions(self) -> None:
+        mock_model = self.mock_model()
+        mock_model.predict_batch.side_effect = HTTPException(400)
+        batcher = RequestBatcher(self.run, max_size=8, max_wait_s=0.01)
+
+        results = await asyncio.gather(*[batcher.predict(mock_model, i) for i in range(2)], return_exceptions=True)
+
+        assert all(isinstance(result, HTTPException) for result in results)
+        mock_model.predict_batch.assert_called_once()
+
+
+class TestProcessPool:
+    def test_shared_memory_round_trip(self) -> None:
+        name, lengths = write_shared([b"abc", b"", b"de"])
+
+        assert read_shared(name, lengths) == [b"abc", b"", b"de"]
+        assert read_shared(name, lengths, unlink=True) == [b"abc", b"", b"de"]
+        with pytest.raises(FileNotFoundError):
+            read_shared(name, lengths)
+
+    def test_runs_request_from_shared_memory(self, pil_image: Image.Image, mocker: MockerFixture) -> None:
+        mocker.patch.object(process_pool, "_loop", asyncio.new_event_loop())
+
+        async def run_inference(payload: ImageContext, entries: Any) -> dict[str, Any]:
+            return {"imageWidth": payload.width, "clip": np.array([1.0], dtype=np.float32)}
+
+        mocker.patch("immich_ml.main.run_inference", side_effect=run_inference)
+        byte_image = BytesIO()
+        pil_image.save(byte_image, format="jpeg")
+        name, lengths = write_shared([byte_image.getvalue()])
+
+        output, timings = process_pool._predict(name, lengths, None, ([], []), False, time.perf_counter())
+
+        assert isinstance(output, tuple)
+        output_name, output_length = output
+        assert orjson.loads(read_shared(output_name, [output_length], unlink=True)[0]) == {
+            "imageWidth": 600,
+            "clip": [1.0],
+        }
+        assert list(timings) == ["process-queue", "decode", "process-serialize"]
+        read_shared(name, lengths, unlink=True)
+
+    def test_checks_free_shared_memory(self, mocker: MockerFixture) -> None:
+        statvfs = mocker.patch("immich_ml.process_pool.os.statvfs")
+        statvfs.return_value = SimpleNamespace(f_bavail=16 * 1024 + 256, f_frsize=1024)
+
+        assert process_pool.fits_shared(256 * 1024)
+        assert not process_pool.fits_shared(256 * 1024 + 1)
+        statvfs.assert_called_with("/dev/shm")
+
+    @pytest.mark.asyncio
+    async def test_passes_data_directly_without_free_shared_memory(
+        self, pil_image: Image.Image, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(process_pool, "fits_shared", return_value=False)
+        write_shared = mocker.spy(process_pool, "write_shared")
+        mocker.patch.object(process_pool, "_loop", asyncio.new_event_loop())
+
+        async def run_inference(payload: ImageContext, entries: Any) -> dict[str, Any]:
+            return {"imageWidth": payload.width}
+
+        mocker.patch("immich_ml.main.run_inference", side_effect=run_inference)
+        byte_image = BytesIO()
+        pil_image.save(byte_image, format="jpeg")
+        pool = InferenceProcessPool(1)
+        pool.executor.shutdown()
+        # runs the worker function in this process so the patches apply
+        pool.executor = ThreadPoolExecutor(1)  # type: ignore[assignment]
+        try:
+            body, timings = await pool.predict(([], []), images=[byte_image.getvalue()])
+        finally:
+            pool.shutdown()
+
+        assert orjson.loads(body) == {"imageWidth": 600}
+        assert "decode" in timings
+        write_shared.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_runs_request_in_worker_process(self, monkeypatch: MonkeyPatch) -> None:
+        # workers read their settings from the environment, and shouldn't try to download models here
+        for name in [name for name in os.environ if name.startswith("MACHINE_LEARNING_PRELOAD")]:
+            monkeypatch.delenv(name)
+        pool = InferenceProcessPool(1)
+        try:
+            body, timings = await pool.predict(([], []), texts=["a photo of a dog"])
+        finally:
+            pool.shutdown()
+
+        assert orjson.loads(body) == {}
+        assert "process-queue" in timings
+
+    @pytest.mark.asyncio
+    async def test_starts_all_workers(self, monkeypatch: MonkeyPatch) -> None:
+        for name in [name for name in os.environ if name.startswith("MACHINE_LEARNING_PRELOAD")]:
+            monkeypatch.delenv(name)
+        pool = InferenceProcessPool(2)
+        try:
+            await pool.start()
+            processes = list(pool.executor._processes.values())
+        finally:
+            pool.shutdown()
+
+        assert len(processes) == 2
+
+    @pytest.mark.asyncio
+    async def test_start_fails_if_worker_fails_to_start(self, mocker: MockerFixture) -> None:
+        pool = InferenceProcessPool(1)
+        executor = mocker.patch.object(pool, "executor", mock.Mock())
+        executor.submit.side_effect = BrokenProcessPool("initializer failed")
+
+        with pytest.raises(BrokenProcessPool):
+            await pool.start()
+
+    @pytest.mark.asyncio
+    async def test_recreates_broken_pool(self, mocker: MockerFixture) -> None:
+        pool = InferenceProcessPool(1)
+        broken = mocker.patch.object(pool, "executor", mock.Mock())
+        broken.submit.side_effect = BrokenProcessPool("worker exited")
+
+        with pytest.raises(BrokenProcessPool):
+            await pool.predict(([], []), texts=["a photo of a dog"])
+
+        broken.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        assert pool.executor is not broken
+        pool.shutdown()
+
 
 @pytest.mark.asyncio
 class TestLoad:
@@ -998,6 +2413,400 @@ class TestLoad:
         )
         mock_model.model_format = ModelFormat.ONNX
 
+    async def test_loads_model_once_if_requested_concurrently(self, monkeypatch: MonkeyPatch) -> None:
+        mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.loaded = False
+        mock_model.load_attempts = 0
+
+        def load_model() -> None:
+            time.sleep(0.05)
+            mock_model.loaded = True
+
+        mock_model.load.side_effect = load_model
+        monkeypatch.setattr("immich_ml.main.thread_pool", ThreadPoolExecutor(2))
+
+        await asyncio.gather(load(mock_model), load(mock_model))
+
+        mock_model.load.assert_called_once()
+
+    async def test_loads_different_models_concurrently(self, monkeypatch: MonkeyPatch) -> None:
+        # each load waits for the other to start, so this times out if they're loaded one at a time
+        barrier = threading.Barrier(2, timeout=5)
+        models = []
+        for _ in range(2):
+            mock_model = mock.Mock(spec=InferenceModel)
+            mock_model.loaded = False
+            mock_model.load_attempts = 0
+            mock_model.load.side_effect = lambda: barrier.wait()
+            models.append(mock_model)
+        monkeypatch.setattr("immich_ml.main.thread_pool", ThreadPoolExecutor(2))
+
+        await asyncio.gather(*[load(model) for model in models])
+
+        for model in models:
+            model.load.assert_called_once()
+
+
+class TestDecodeUpload:
+    @pytest.mark.parametrize("max_size", [1, 2**26])
+    def test_decodes_spooled_upload(self, pil_image: Image.Image, max_size: int) -> None:
+        upload = SpooledTemporaryFile(max_size=max_size)
+        pil_image.save(upload, format="png")
+
+        image = decode_upload(upload)
+
+        assert upload._rolled == (max_size == 1)  # type: ignore
+        assert image.mode == "RGB"
+        assert image.size == pil_image.size
+        assert np.array_equal(np.asarray(image), np.asarray(pil_image))
+
+    def test_decodes_file(self, pil_image: Image.Image, tmp_path: Path) -> None:
+        pil_image.save(tmp_path / "image.png")
+
+        with open(tmp_path / "image.png", "rb") as f:
+            image = decode_upload(f)
+
+        assert image.size == pil_image.size
+
+
+class TestMetrics:
+    def test_histogram_exposition(self) -> None:
+        histogram = Histogram("test_seconds", "Test histogram.", ("model",), buckets=(0.1, 1.0))
+        registry.remove(histogram)
+        histogram.observe(0.05, 'say "hi"')
+        histogram.observe(0.5, 'say "hi"')
+        histogram.observe(5, 'say "hi"')
+
+        assert histogram.collect() == [
+            "# HELP test_seconds Test histogram.",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{model="say \\"hi\\"",le="0.1"} 1',
+            'test_seconds_bucket{model="say \\"hi\\"",le="1"} 2',
+            'test_seconds_bucket{model="say \\"hi\\"",le="+Inf"} 3',
+            'test_seconds_sum{model="say \\"hi\\""} 5.55',
+            'test_seconds_count{model="say \\"hi\\""} 3',
+        ]
+
+    def test_counter_rejects_wrong_labels(self) -> None:
+        counter = Counter("test_total", "Test counter.", ("model",))
+        registry.remove(counter)
+
+        with pytest.raises(ValueError):
+            counter.inc()
+
+    def test_records_stages(self) -> None:
+        model = SimpleNamespace(model_name="test_model", model_type=ModelType.VISUAL, model_task=ModelTask.SEARCH)
+        labels = ("test_model", "visual", "clip")
+        before = {
+            stage: STAGE_SECONDS.get_count(*labels, stage)
+            for stage in ["queue", "preprocess", "inference", "serialize"]
+        }
+
+        with queue_wait(0.5), record_stages(model):  # type: ignore
+            with time_stage("inference"):
+                time.sleep(0.01)
+            serialize_np_array(np.zeros(4, dtype=np.float32))
+
+        for stage, count in before.items():
+            assert STAGE_SECONDS.get_count(*labels, stage) == count + 1
+        assert STAGE_SECONDS.get_sum(*labels, "inference") >= 0.01
+        assert STAGE_SECONDS.get_sum(*labels, "queue") >= 0.5
+
+    def test_ignores_stages_outside_of_predictions(self) -> None:
+        with time_stage("inference"):
+            pass
+
+    def test_records_model_load_time(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+        mocker.patch.object(InferenceModel, "_make_session", autospec=True)
+        before = MODEL_LOAD_SECONDS.get_count("ViT-B-32__openai", "visual", "clip")
+
+        OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache").load()
+
+        assert MODEL_LOAD_SECONDS.get_count("ViT-B-32__openai", "visual", "clip") == before + 1
+
+
+class TestProfiling:
+    def test_formats_server_timing(self) -> None:
+        header = format_server_timing({"decode": 0.0123, "visual-inference": 0.5})
+
+        assert header == "decode;dur=12.30, visual-inference;dur=500.00"
+
+    def test_ignores_timings_outside_of_requests(self) -> None:
+        with time_request("decode"):
+            pass
+
+    def test_profiles_sampled_requests(self, mocker: MockerFixture, tmp_path: Path) -> None:
+        mocker.patch.object(settings, "profile_sample_rate", 1.0)
+        mocker.patch.object(settings, "cache_folder", tmp_path)
+
+        with profile_request("predict"), ThreadPoolExecutor(1) as pool:
+            context = contextvars.copy_context()
+            pool.submit(context.run, run_profiled, sorted, [3, 1, 2]).result()
+
+        profiles = list((tmp_path / "profiles").glob("predict-*.prof"))
+        assert len(profiles) == 1
+        stats = pstats.Stats(str(profiles[0])).stats  # type: ignore
+        assert any(func[2] == "<built-in method builtins.sorted>" for func in stats)
+
+    def test_skips_unsampled_requests(self, mocker: MockerFixture, tmp_path: Path) -> None:
+        mocker.patch.object(settings, "cache_folder", tmp_path)
+
+        with profile_request("predict"):
+            assert run_profiled(sorted, [3, 1, 2]) == [1, 2, 3]
+
+        assert not (tmp_path / "profiles").exists()
+
+
+class TestTextEmbeddingCache:
+    def test_evicts_least_recently_used(self) -> None:
+        cache = TextEmbeddingCache(max_size=2)
+        cache.set("dog", "1")
+        cache.set("beach", "2")
+        cache.get("dog")
+        cache.set("birthday", "3")
+
+        assert cache.get("beach") is None
+        assert cache.get("dog") == "1"
+        assert cache.get("birthday") == "3"
+        assert len(cache) == 2
+
+    def test_expires_entries(self, mocker: MockerFixture) -> None:
+        monotonic = mocker.patch("immich_ml.models.clip.textual.time.monotonic", return_value=0)
+        cache = TextEmbeddingCache(max_size=2, ttl=10)
+        cache.set("dog", "1")
+
+        monotonic.return_value = 5
+        assert cache.get("dog") == "1"
+        monotonic.return_value = 11
+        assert cache.get("dog") is None
+        assert len(cache) == 0
+
+    def test_disabled(self) -> None:
+        cache = TextEmbeddingCache(max_size=0)
+        cache.set("dog", "1")
+
+        assert cache.get("dog") is None
+        assert len(cache) == 0
+
+
+class TestImageContext:
+    def test_derives_once_per_key(self, pil_image: Image.Image) -> None:
+        context = ImageContext(pil_image)
+        func = mock.Mock(side_effect=lambda image: image.size)
+
+        assert context.derive("size", func) == pil_image.size
+        assert context.derive("size", func) == pil_image.size
+        assert context.derive("other", func) == pil_image.size
+
+        assert func.call_count == 2
+        assert context.conversions == 2
+
+    def test_derives_once_when_called_concurrently(self, pil_image: Image.Image) -> None:
+        context = ImageContext(pil_image)
+
+        def slow_size(image: Image.Image) -> tuple[int, int]:
+            time.sleep(0.01)
+            return image.size
+
+        func = mock.Mock(side_effect=slow_size)
+
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(lambda _: context.derive("size", func), range(4)))
+
+        assert results == [pil_image.size] * 4
+        func.assert_called_once()
+
+    def test_decode_cv2_converts_once(self, pil_image: Image.Image) -> None:
+        context = ImageContext(pil_image)
+
+        first = decode_cv2(context)
+        second = decode_cv2(context)
+
+        assert first is second
+        assert np.array_equal(first, decode_cv2(pil_image))
+        assert context.conversions == 1
+
+    def test_visual_transform_is_shared(self, pil_image: Image.Image) -> None:
+        context = ImageContext(pil_image)
+        encoder = OpenClipVisualEncoder("ViT-B-32__openai", session=mock.Mock())
+        encoder.size = 224
+        encoder.mean = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+        encoder.std = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+
+        shared = encoder.transform(context)["image"]
+        encoder.transform(context)
+
+        assert np.allclose(shared, encoder.transform(pil_image)["image"])
+        assert context.conversions == 1
+
+
+class TestDraftDecoding:
+    def test_decodes_jpeg_at_reduced_size(self) -> None:
+        byte_image = BytesIO()
+        Image.new("RGB", (2000, 1600)).save(byte_image, format="jpeg")
+
+        image = decode_pil(byte_image.getvalue(), 224)
+
+        assert image.size == (500, 400)
+        assert image.mode == "RGB"
+
+    def test_decodes_jpeg_at_full_size_without_hint(self) -> None:
+        byte_image = BytesIO()
+        Image.new("RGB", (2000, 1600)).save(byte_image, format="jpeg")
+
+        image = decode_pil(byte_image.getvalue())
+
+        assert image.size == (2000, 1600)
+
+    def test_ignores_hint_for_other_formats(self) -> None:
+        byte_image = BytesIO()
+        Image.new("RGB", (2000, 1600)).save(byte_image, format="png")
+
+        image = decode_pil(byte_image.getvalue(), 224)
+
+        assert image.size == (2000, 1600)
+
+
+@pytest.mark.asyncio
+class TestSizeHint:
+    def mock_models(self, mocker: MockerFixture, size_hints: dict[ModelType, int | None]) -> None:
+        models = {}
+        for model_type, size_hint in size_hints.items():
+            models[model_type] = mock.Mock(spec=InferenceModel, loaded=True, size_hint=size_hint)
+        mocker.patch("immich_ml.main.model_cache.get", side_effect=lambda name, type, task, **kwargs: models[type])
+
+    async def test_uses_largest_size_hint(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "jpeg_draft", True)
+        self.mock_models(mocker, {ModelType.VISUAL: 224, ModelType.DETECTION: 640})
+        entries: Any = (
+            [
+                {"name": "ViT-B-32__openai", "task": "clip", "type": "visual", "options": {}},
+                {"name": "buffalo_s", "task": "facial-recognition", "type": "detection", "options": {}},
+            ],
+            [],
+        )
+
+        assert await get_size_hint(entries) == 640
+
+    async def test_returns_none_if_any_model_needs_full_resolution(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "jpeg_draft", True)
+        self.mock_models(mocker, {ModelType.DETECTION: 640, ModelType.RECOGNITION: None})
+        entries: Any = (
+            [{"name": "buffalo_s", "task": "facial-recognition", "type": "detection", "options": {}}],
+            [{"name": "buffalo_s", "task": "facial-recognition", "type": "recognition", "options": {}}],
+        )
+
+        assert await get_size_hint(entries) is None
+
+    async def test_returns_none_for_tiled_face_detection(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "jpeg_draft", True)
+        self.mock_models(mocker, {ModelType.DETECTION: 640})
+        entries: Any = (
+            [{"name": "buffalo_s", "task": "facial-recognition", "type": "detection", "options": {"tiled": True}}],
+            [],
+        )
+
+        assert await get_size_hint(entries) is None
+
+    async def test_returns_none_if_disabled(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "jpeg_draft", False)
+        self.mock_models(mocker, {ModelType.VISUAL: 224})
+        entries: Any = ([{"name": "ViT-B-32__openai", "task": "clip", "type": "visual", "options": {}}], [])
+
+        assert await get_size_hint(entries) is None
+
+
+class TestEmbeddingFormat:
+    @pytest.mark.parametrize("embedding_format", [EmbeddingFormat.FLOAT32, EmbeddingFormat.FLOAT16])
+    def test_serializes_binary_embedding(self, embedding_format: EmbeddingFormat) -> None:
+        embedding = np.random.rand(512).astype(np.float32)
+        dtype = "<f4" if embedding_format == EmbeddingFormat.FLOAT32 else "<f2"
+
+        serialized = serialize_np_array(embedding, embedding_format)
+
+        assert isinstance(serialized, str)
+        assert np.array_equal(np.frombuffer(base64.b64decode(serialized), dtype=dtype), embedding.astype(dtype))
+
+    def test_serializes_json_embedding_by_default(self) -> None:
+        embedding = np.random.rand(512).astype(np.float32)
+
+        assert np.allclose(orjson.loads(serialize_np_array(embedding)), embedding)
+
+    @pytest.mark.parametrize(
+        "accept,expected",
+        [
+            (None, EmbeddingFormat.JSON),
+            ("application/json", EmbeddingFormat.JSON),
+            ("*/*", EmbeddingFormat.JSON),
+            ("application/json; embedding=float32", EmbeddingFormat.FLOAT32),
+            ("text/html, application/json;embedding=FLOAT16", EmbeddingFormat.FLOAT16),
+        ],
+    )
+    def test_negotiates_embedding_format(self, accept: str | None, expected: EmbeddingFormat) -> None:
+        assert get_embedding_format(accept) == expected
+
+    def test_rejects_unknown_embedding_format(self) -> None:
+        with pytest.raises(HTTPException) as e:
+            get_embedding_format("application/json; embedding=int4")
+
+        assert e.value.status_code == 406
+
+
+@pytest.mark.asyncio
+class TestBatchInference:
+    async def test_runs_each_model_once_per_batch(self, mocker: MockerFixture) -> None:
+        mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.depends = []
+        mock_model.identity = (ModelType.TEXTUAL, ModelTask.SEARCH)
+        mock_model.loaded = True
+        mock_model.predict_batch.return_value = ["embedding1", "embedding2"]
+        mocker.patch("immich_ml.main.model_cache.get", return_value=mock_model)
+        entries: Any = ([{"name": "ViT-B-32__openai", "task": "clip", "type": "textual", "options": {}}], [])
+
+        responses = await run_batch_inference(["query 1", "query 2"], entries)
+
+        assert responses == [{"clip": "embedding1"}, {"clip": "embedding2"}]
+        mock_model.predict_batch.assert_called_once_with([("query 1",), ("query 2",)])
+
+    async def test_passes_dependency_outputs(self, pil_image: Image.Image, mocker: MockerFixture) -> None:
+        detector = mock.Mock(spec=InferenceModel)
+        detector.depends = []
+        detector.identity = (ModelType.DETECTION, ModelTask.FACIAL_RECOGNITION)
+        detector.loaded = True
+        detector.predict_batch.return_value = ["faces1", "faces2"]
+        recognizer = mock.Mock(spec=InferenceModel)
+        recognizer.depends = [(ModelType.DETECTION, ModelTask.FACIAL_RECOGNITION)]
+        recognizer.identity = (ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION)
+        recognizer.loaded = True
+        recognizer.predict_batch.return_value = [["face1"], ["face2"]]
+        mocker.patch(
+            "immich_ml.main.model_cache.get",
+            side_effect=lambda name, type, task, **kwargs: detector if type == ModelType.DETECTION else recognizer,
+        )
+        entries: Any = (
+            [{"name": "buffalo_s", "task": "facial-recognition", "type": "detection", "options": {"minScore": 0.5}}],
+            [{"name": "buffalo_s", "task": "facial-recognition", "type": "recognition", "options": {}}],
+        )
+
+        images = [ImageContext(pil_image), ImageContext(pil_image)]
+
+        responses = await run_batch_inference(images, entries)
+
+        detector.predict_batch.assert_called_once_with([(images[0],), (images[1],)], minScore=0.5)
+        recognizer.predict_batch.assert_called_once_with([(images[0], "faces1"), (images[1], "faces2")])
+        assert responses == [
+            {"facial-recognition": ["face1"], "imageHeight": 800, "imageWidth": 600},
+            {"facial-recognition": ["face2"], "imageHeight": 800, "imageWidth": 600},
+        ]
+
 
 def test_root_endpoint(deployed_app: TestClient) -> None:
     response = deployed_app.get("http://localhost:3003")
@@ -1014,6 +2823,151 @@ def test_ping_endpoint(deployed_app: TestClient) -> None:
     assert response.text == "pong"
 
 
+def test_metrics_endpoint(deployed_app: TestClient) -> None:
+    text_embedding_cache.set("key", "embedding")
+    text_embedding_cache.get("key")
+    text_embedding_cache.get("missing")
+
+    response = deployed_app.get("http://localhost:3003/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "immich_ml_text_cache_hits_total 1\n" in response.text
+    assert "immich_ml_text_cache_misses_total 1\n" in response.text
+    assert "immich_ml_text_cache_entries 1\n" in response.text
+    assert "# TYPE immich_ml_stage_seconds histogram\n" in response.text
+    assert "# TYPE immich_ml_model_load_seconds histogram\n" in response.text
+    assert "immich_ml_thread_pool_busy_threads" in response.text
+    assert "immich_ml_active_requests" in response.text
+
+
+@pytest.mark.parametrize("server_timing", [True, False])
+def test_server_timing_header(
+    pil_image: Image.Image, deployed_app: TestClient, mocker: MockerFixture, server_timing: bool
+) -> None:
+    mocker.patch.object(settings, "server_timing", server_timing)
+
+    async def run_inference(*args: Any) -> dict[str, Any]:
+        add_request_timing("visual-inference", 0.01)
+        return {"clip": "1"}
+
+    mocker.patch("immich_ml.main.run_inference", side_effect=run_inference)
+    byte_image = BytesIO()
+    pil_image.save(byte_image, format="jpeg")
+
+    response = deployed_app.post(
+        "http://localhost:3003/predict",
+        data={"entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}})},
+        files={"image": byte_image.getvalue()},
+    )
+
+    assert response.status_code == 200
+    if server_timing:
+        metrics = [metric.split(";")[0] for metric in response.headers["server-timing"].split(", ")]
+        assert metrics == ["decode", "visual-inference", "response"]
+        assert "visual-inference;dur=10.00" in response.headers["server-timing"]
+    else:
+        assert "server-timing" not in response.headers
+
+
+def test_predict_returns_503_if_process_pool_breaks(deployed_app: TestClient, mocker: MockerFixture) -> None:
+    pool = mock.Mock()
+    pool.predict = mock.AsyncMock(side_effect=BrokenProcessPool("worker exited"))
+    mocker.patch("immich_ml.main.process_pool", pool)
+
+    response = deployed_app.post(
+        "http://localhost:3003/predict",
+        data={"entries": json.dumps({"clip": {"textual": {"modelName": "ViT-B-32__openai"}}}), "text": "test"},
+    )
+
+    assert response.status_code == 503
+
+
+def test_predict_in_process_pool(deployed_app: TestClient, mocker: MockerFixture) -> None:
+    mocker.patch.object(settings, "server_timing", True)
+    pool = mock.Mock()
+    pool.predict = mock.AsyncMock(return_value=(b'{"clip":"[1.0]"}', {"textual-inference": 0.01}))
+    mocker.patch("immich_ml.main.process_pool", pool)
+    entries: InferenceEntries = (
+        [{"name": "ViT-B-32__openai", "task": ModelTask.SEARCH, "type": ModelType.TEXTUAL, "options": {}}],
+        [],
+    )
+
+    response = deployed_app.post(
+        "http://localhost:3003/predict",
+        data={"entries": json.dumps({"clip": {"textual": {"modelName": "ViT-B-32__openai"}}}), "text": "test"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"clip": "[1.0]"}
+    assert response.headers["content-type"] == "application/json"
+    assert "textual-inference;dur=10.00" in response.headers["server-timing"]
+    pool.predict.assert_awaited_once_with(entries, None, ["test"], batch=False)
+
+
+def test_batch_endpoint(pil_image: Image.Image, deployed_app: TestClient, mocker: MockerFixture) -> None:
+    mock_run = mocker.patch("immich_ml.main.run_batch_inference", return_value=[{"clip": "1"}, {"clip": "2"}])
+    byte_image = BytesIO()
+    pil_image.save(byte_image, format="jpeg")
+
+    response = deployed_app.post(
+        "http://localhost:3003/predict/batch",
+        data={"entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}})},
+        files=[("images", byte_image.getvalue()), ("images", byte_image.getvalue())],
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [{"clip": "1"}, {"clip": "2"}]
+    images = mock_run.call_args.args[0]
+    assert len(images) == 2
+    assert all(isinstance(image, ImageContext) and image.image.size == pil_image.size for image in images)
+
+
+def test_batch_endpoint_binary_embedding(
+    pil_image: Image.Image, deployed_app: TestClient, mocker: MockerFixture
+) -> None:
+    mock_run = mocker.patch("immich_ml.main.run_batch_inference", return_value=[{"clip": "AAA="}])
+    byte_image = BytesIO()
+    pil_image.save(byte_image, format="jpeg")
+
+    response = deployed_app.post(
+        "http://localhost:3003/predict/batch",
+        data={"entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}})},
+        files=[("images", byte_image.getvalue())],
+        headers={"Accept": "application/json; embedding=float16"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json; embedding=float16"
+    entries = mock_run.call_args.args[1]
+    assert entries[0][0]["options"] == {"embedding_format": EmbeddingFormat.FLOAT16}
+
+
+def test_batch_endpoint_rejects_too_many_inputs(deployed_app: TestClient, mocker: MockerFixture) -> None:
+    mocker.patch.object(settings, "max_batch_request_items", 2)
+    mock_run = mocker.patch("immich_ml.main.run_batch_inference")
+
+    response = deployed_app.post(
+        "http://localhost:3003/predict/batch",
+        data={
+            "entries": json.dumps({"clip": {"textual": {"modelName": "ViT-B-32__openai"}}}),
+            "texts": ["dog", "beach", "party"],
+        },
+    )
+
+    assert response.status_code == 413
+    mock_run.assert_not_called()
+
+
+def test_batch_endpoint_requires_inputs(deployed_app: TestClient) -> None:
+    response = deployed_app.post(
+        "http://localhost:3003/predict/batch",
+        data={"entries": json.dumps({"clip": {"textual": {"modelName": "ViT-B-32__openai"}}})},
+    )
+
+    assert response.status_code == 400
+
+
 @pytest.mark.skipif(
     not settings.test_full,
     reason="More time-consuming since it deploys the app and loads models.",